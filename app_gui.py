@@ -1,27 +1,255 @@
+import queue
+import threading
+import time
 import tkinter as tk
-from tkinter import scrolledtext, messagebox, filedialog
-from pathlib import Path
-import re
+from tkinter import scrolledtext, messagebox, filedialog, ttk
 
-from midi_shared import MID_DIR, ARTIFACTS_DIR, ENCODER_SCRIPT, DECODER_SCRIPT
+from midi_shared import MID_DIR, ARTIFACTS_DIR, ensure_dir
 from runner import encode_text, decode_mid
+from codebook import KEYFRAME_INTERVAL
+from bitpack import symbol_count
+from framing import LENGTH_HEADER_SIZE
+from codec_log import LEVEL_NAMES
+from mid_index import MidIndex
+
+# エンコード/デコードはワーカースレッドで 1 件ずつ実行し、結果・ログ・進捗は events キュー経由で
+# メインスレッド（after() のポーリング）が画面に反映する。Tk のウィジェットはメインスレッドからしか触らない。
+POLL_MS = 50
+# 進捗・ログをキューに流す間隔（秒）。SYNC ごと・ノートごとに流すと画面の更新が追いつかない
+FLUSH_INTERVAL = 0.1
+# 1 回のポーリングで処理するイベント数の上限（これを超えた分は次回）
+MAX_EVENTS_PER_POLL = 200
+# 索引ダイアログに並べる行数の上限（絞り込みは SQLite 側で全件に対して行う）
+MAX_INDEX_ROWS = 2000
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    _next_id = 1
+
+    def __init__(self, kind, label, args):
+        self.id = Job._next_id
+        Job._next_id += 1
+        self.kind = kind
+        self.label = label
+        self.args = args
+        self.state = "queued"
+        self.cancel = threading.Event()
+
+    def describe(self):
+        return f"#{self.id} {self.kind:<6} {self.state:<9} {self.label}"
+
+class _QueueStream:
+    """ログの書き込みをまとめて FLUSH_INTERVAL ごとに events キューへ流す。"""
+
+    def __init__(self, events, job):
+        self.events = events
+        self.job = job
+        self.parts = []
+        self.last = time.monotonic()
+
+    def write(self, s):
+        self.parts.append(s)
+        now = time.monotonic()
+        if now - self.last >= FLUSH_INTERVAL:
+            self.flush()
+            self.last = now
+
+    def flush(self):
+        if self.parts:
+            self.events.put(("log", self.job, "".join(self.parts)))
+            self.parts = []
+
+class _Progress:
+    """on_sync から呼ばれ、中断の確認と進捗の通知をする。"""
+
+    def __init__(self, events, job, total_notes=None):
+        self.events = events
+        self.job = job
+        self.total = total_notes
+        self.blocks = 0
+        self.errors = 0
+        self.lines = []
+        self.last = time.monotonic()
+
+    def encoded(self, step, crc):
+        self.blocks += 1
+        self._tick(step)
+
+    def decoded(self, step, reported, actual):
+        self.blocks += 1
+        if reported is None:
+            status = "CRC unreadable"
+        elif reported == actual:
+            status = "CRC OK"
+        else:
+            self.errors += 1
+            status = f"CRC MISMATCH! reported={reported:02X} actual={actual:02X}"
+        self.lines.append(f"[SYNC] step={step} {status}\n")
+        self._tick(self.blocks * KEYFRAME_INTERVAL)
+
+    def _tick(self, notes):
+        if self.job.cancel.is_set():
+            raise JobCancelled()
+        now = time.monotonic()
+        if now - self.last >= FLUSH_INTERVAL:
+            self.flush(notes)
+            self.last = now
+
+    def flush(self, notes=None):
+        if self.lines:
+            self.events.put(("sync", self.job, "".join(self.lines)))
+            self.lines = []
+        if notes is not None:
+            self.events.put(("progress", self.job, notes, self.total, self.blocks, self.errors))
+
+class IndexDialog(tk.Toplevel):
+    """mid/ の索引（mid_index）から .mid を選ぶダイアログ。開いたときに変わったファイルだけを
+    別スレッドで索引し直し、一覧と絞り込みは SQLite への問い合わせだけで行う。"""
+
+    COLUMNS = (("name", "File", 260), ("size", "Size", 80), ("notes", "Notes", 70),
+               ("payload", "Payload", 80), ("codec", "Codec", 60), ("status", "Status", 60))
+
+    def __init__(self, master, on_pick):
+        super().__init__(master)
+        self.title("mid index")
+        self.geometry("720x480")
+        self.on_pick = on_pick
+        self.index = MidIndex()
+        self.updated = queue.Queue()
+
+        bar = tk.Frame(self)
+        bar.pack(fill="x", padx=8, pady=6)
+        tk.Label(bar, text="Title:").pack(side="left")
+        self.title_filter = tk.Entry(bar, width=24)
+        self.title_filter.pack(side="left", padx=4)
+        tk.Label(bar, text="Min bytes:").pack(side="left")
+        self.min_bytes = tk.Entry(bar, width=8)
+        self.min_bytes.pack(side="left", padx=4)
+        self.crc_errors = tk.BooleanVar(value=False)
+        tk.Checkbutton(bar, text="CRC errors", variable=self.crc_errors, command=self.refresh).pack(side="left")
+        self.unreadable = tk.BooleanVar(value=False)
+        tk.Checkbutton(bar, text="Unreadable", variable=self.unreadable, command=self.refresh).pack(side="left")
+        tk.Button(bar, text="Filter", command=self.refresh).pack(side="left", padx=4)
+        for entry in (self.title_filter, self.min_bytes):
+            entry.bind("<Return>", lambda e: self.refresh())
+
+        self.tree = ttk.Treeview(self, columns=[c for c, _, _ in self.COLUMNS], show="headings")
+        for col, text, width in self.COLUMNS:
+            self.tree.heading(col, text=text)
+            self.tree.column(col, width=width, anchor="w" if col == "name" else "e")
+        self.tree.pack(fill="both", expand=True, padx=8)
+        self.tree.bind("<Double-1>", lambda e: self.pick())
+
+        foot = tk.Frame(self)
+        foot.pack(fill="x", padx=8, pady=6)
+        self.status = tk.Label(foot, text="", anchor="w")
+        self.status.pack(side="left", fill="x", expand=True)
+        tk.Button(foot, text="Open", command=self.pick).pack(side="right")
+
+        # 索引の表はここ（メインスレッド）で先に作っておき、更新は別の接続で行う
+        self.refresh()
+        self.status.configure(text=self.status.cget("text") + " — updating index…")
+        threading.Thread(target=self._update, daemon=True).start()
+        self._after = self.after(POLL_MS, self._poll)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+    def _update(self):
+        # ワーカースレッド: sqlite3 の接続はスレッドごとに別に持つ
+        try:
+            with MidIndex() as index:
+                self.updated.put(index.update())
+        except Exception as e:
+            self.updated.put(e)
+
+    def _poll(self):
+        try:
+            res = self.updated.get_nowait()
+        except queue.Empty:
+            self._after = self.after(POLL_MS, self._poll)
+            return
+        self._after = None
+        if isinstance(res, Exception):
+            self.status.configure(text=f"index update failed: {res}")
+            return
+        self.refresh()
+        changed, removed = res
+        self.status.configure(text=self.status.cget("text") + f" ({changed} scanned, {removed} removed)")
+
+    def refresh(self):
+        min_text = self.min_bytes.get().strip()
+        min_payload = int(min_text) if min_text.isdigit() else None
+        query = dict(title=self.title_filter.get().strip() or None, min_payload=min_payload)
+        crc_errors, unreadable = self.crc_errors.get(), self.unreadable.get()
+        if crc_errors or unreadable:
+            # mid_index の --crc-errors / --unreadable と同じく、CRC 不一致 → 読めないファイルの順に並べる
+            rows = ((self.index.find(crc_ok=False, **query) if crc_errors else [])
+                    + (self.index.find(errors=True, **query) if unreadable else []))
+        else:
+            rows = self.index.find(**query)
+        self.tree.delete(*self.tree.get_children())
+        for r in rows[:MAX_INDEX_ROWS]:
+            status = "error" if r.error else ("ok" if r.crc_ok else "crc-ng")
+            self.tree.insert("", "end", iid=str(r.path), values=(
+                r.name, r.size, "-" if r.notes is None else r.notes,
+                "-" if r.payload_len is None else r.payload_len, r.codec or "-", status))
+        shown = min(len(rows), MAX_INDEX_ROWS)
+        self.status.configure(text=f"{shown} of {len(rows)} files" if shown < len(rows) else f"{len(rows)} files")
+
+    def pick(self):
+        sel = self.tree.selection()
+        if sel:
+            self.on_pick(sel[0])
+            self.close()
+
+    def close(self):
+        if self._after is not None:
+            self.after_cancel(self._after)
+        self.index.close()
+        self.destroy()
 
 class App(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("MIDI My Sample — GUI")
-        self.geometry("1000x700")
+        self.geometry("1000x760")
+        self.jobs = queue.Queue()
+        self.events = queue.Queue()
+        self.job_list = []
+        self.current = None
         self._build()
+        threading.Thread(target=self._worker, daemon=True).start()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(POLL_MS, self._poll)
 
     def _build(self):
         top = tk.Frame(self)
         top.pack(fill="x", padx=8, pady=8)
 
+        tk.Label(top, text="Log level:").pack(side="left")
+        self.log_level = tk.StringVar(value="summary")
+        tk.OptionMenu(top, self.log_level, *LEVEL_NAMES).pack(side="left", padx=4)
+
         btn_frame = tk.Frame(top)
         btn_frame.pack(side="right")
         tk.Button(btn_frame, text="Open mid folder", command=self.open_mid_folder).pack(side="left", padx=4)
         tk.Button(btn_frame, text="Open artifacts", command=self.open_artifacts).pack(side="left", padx=4)
 
+        # --- Jobs panel ---
+        jobs_frame = tk.LabelFrame(self, text="Jobs", padx=6, pady=6)
+        jobs_frame.pack(side="bottom", fill="x", padx=8, pady=(0, 8))
+        self.jobs_box = tk.Listbox(jobs_frame, height=5, font="TkFixedFont")
+        self.jobs_box.pack(side="left", fill="x", expand=True)
+        job_btns = tk.Frame(jobs_frame)
+        job_btns.pack(side="right", padx=(6, 0))
+        self.progress = ttk.Progressbar(job_btns, length=220, mode="determinate")
+        self.progress.pack(fill="x")
+        self.progress_label = tk.Label(job_btns, text="idle", anchor="w", width=36)
+        self.progress_label.pack(fill="x")
+        tk.Button(job_btns, text="Cancel", command=self.on_cancel).pack(side="left", pady=4)
+        tk.Button(job_btns, text="Cancel all", command=self.on_cancel_all).pack(side="left", padx=4, pady=4)
+
         body = tk.PanedWindow(self, sashrelief="raised", sashwidth=6, orient="horizontal")
         body.pack(expand=True, fill="both", padx=8, pady=8)
 
@@ -53,44 +281,56 @@ class App(tk.Tk):
         self.dec_mid_path = tk.Entry(dec_frame, width=50)
         self.dec_mid_path.grid(row=0, column=1, sticky="we", padx=4)
         tk.Button(dec_frame, text="Browse", command=self.browse_mid).grid(row=0, column=2, padx=4)
+        tk.Button(dec_frame, text="Index…", command=self.browse_index).grid(row=0, column=3, padx=4)
 
         dec_btn = tk.Button(dec_frame, text="Decode → Text", command=self.on_decode)
-        dec_btn.grid(row=1, column=2, sticky="e", pady=6)
+        dec_btn.grid(row=1, column=3, sticky="e", pady=6)
 
         tk.Label(dec_frame, text="Decoded text:").grid(row=1, column=0, sticky="nw")
         self.dec_text = scrolledtext.ScrolledText(dec_frame, width=60, height=12, wrap="word")
-        self.dec_text.grid(row=2, column=0, columnspan=3, sticky="nsew", padx=4)
+        self.dec_text.grid(row=2, column=0, columnspan=4, sticky="nsew", padx=4)
         dec_frame.columnconfigure(1, weight=1)
 
         self.dec_out = scrolledtext.ScrolledText(dec_frame, height=60, wrap="word", state="disabled")
-        self.dec_out.grid(row=3, column=0, columnspan=3, sticky="we", pady=(4,0))
+        self.dec_out.grid(row=3, column=0, columnspan=4, sticky="we", pady=(4,0))
 
-    def log_to_widget(self, widget, text):
+    def append_to_widget(self, widget, text):
         widget.configure(state="normal")
-        widget.insert("end", text + "\n")
+        widget.insert("end", text)
         widget.see("end")
         widget.configure(state="disabled")
 
+    def log_to_widget(self, widget, text):
+        self.append_to_widget(widget, text + "\n")
+
     def open_mid_folder(self):
         import webbrowser
-        webbrowser.open(str(MID_DIR.resolve()))
+        webbrowser.open(str(ensure_dir(MID_DIR).resolve()))
 
     def open_artifacts(self):
         import webbrowser
-        webbrowser.open(str(ARTIFACTS_DIR.resolve()))
+        webbrowser.open(str(ensure_dir(ARTIFACTS_DIR).resolve()))
 
     def browse_mid(self):
-        p = filedialog.askopenfilename(initialdir=str(MID_DIR.resolve()),
+        p = filedialog.askopenfilename(initialdir=str(ensure_dir(MID_DIR).resolve()),
                                        filetypes=[("MIDI files","*.mid"),("All files","*.*")])
         if p:
-            self.dec_mid_path.delete(0, "end")
-            self.dec_mid_path.insert(0, p)
+            self.set_mid_path(p)
+
+    def browse_index(self):
+        IndexDialog(self, self.set_mid_path)
+
+    def set_mid_path(self, p):
+        self.dec_mid_path.delete(0, "end")
+        self.dec_mid_path.insert(0, p)
 
-    def _extract_saved_mid(self, stdout, fallback):
-        m = re.search(r"MIDI saved:\s*(?:mid/)?([^\s]+\.mid)", stdout)
-        if m:
-            return m.group(1)
-        return f"{fallback}.mid"
+    # --- ジョブの投入 ---
+    def _submit(self, kind, label, args):
+        job = Job(kind, label, args)
+        self.job_list.append(job)
+        self.jobs_box.insert("end", job.describe())
+        self.jobs.put(job)
+        return job
 
     def on_encode(self):
         title = self.enc_title.get().strip()
@@ -98,21 +338,7 @@ class App(tk.Tk):
         if not text:
             messagebox.showwarning("Encode", "テキストを入力してください。")
             return
-        self.enc_out.configure(state="normal")
-        self.enc_out.delete("1.0", "end")
-        self.log_to_widget(self.enc_out, "Running encoder...")
-        enc = encode_text(text, title)
-        self.log_to_widget(self.enc_out, f"[returncode={enc.returncode}]")
-        self.log_to_widget(self.enc_out, enc.stdout[:2000])
-        self.log_to_widget(self.enc_out, "--- STDERR ---")
-        self.log_to_widget(self.enc_out, enc.stderr[:2000])
-
-        saved = self._extract_saved_mid(enc.stdout, title)
-        mid_path = MID_DIR / saved
-        if mid_path.exists():
-            messagebox.showinfo("Encode", f"MIDI saved: {mid_path}")
-        else:
-            messagebox.showwarning("Encode", "MIDI が見つかりません。ログを確認してください。")
+        self._submit("encode", title, (text, title, self.log_level.get()))
 
     def on_decode(self):
         p = self.dec_mid_path.get().strip()
@@ -120,38 +346,130 @@ class App(tk.Tk):
             messagebox.showwarning("Decode", "MIDIファイルを選択してください。")
             return
         # allow full path or basename
-        mid_path = Path(p)
-        basename = mid_path.stem
-        self.dec_out.configure(state="normal")
-        self.dec_out.delete("1.0", "end")
-        self.log_to_widget(self.dec_out, f"Decoding {p} ...")
-        dec = decode_mid(basename)
-        self.log_to_widget(self.dec_out, f"[returncode={dec.returncode}]")
-        self.log_to_widget(self.dec_out, dec.stdout[:4000])
-        self.log_to_widget(self.dec_out, "--- STDERR ---")
-        self.log_to_widget(self.dec_out, dec.stderr[:2000])
-
-        # try to extract decoded text
-        # マーカー "復号テキスト:" の後ろ全てを復元テキストとする（改行を含む）
-        text = ""
-        m = re.search(r"復号テキスト:\s*", dec.stdout)
-        if m:
-            # マーカー直後から末尾までを取得
-            text_tail = dec.stdout[m.end():]
-            # 先頭の空行を除去
-            text_tail = text_tail.lstrip("\r\n")
-            # 後続のログ等が続く場合に備え、よくあるセパレータで切り取る
-            sep = re.search(r"\n(?:===|---|\[|MIDI saved:)", text_tail)
-            if sep:
-                text = text_tail[:sep.start()].rstrip()
+        self._submit("decode", p, (p, self.log_level.get()))
+
+    def _selected_job(self):
+        sel = self.jobs_box.curselection()
+        return self.job_list[sel[0]] if sel else self.current
+
+    def on_cancel(self):
+        job = self._selected_job()
+        if job is not None and job.state in ("queued", "running"):
+            job.cancel.set()
+            if job.state == "queued":
+                self._set_state(job, "cancelled")
+
+    def on_cancel_all(self):
+        for job in self.job_list:
+            if job.state in ("queued", "running"):
+                job.cancel.set()
+                if job.state == "queued":
+                    self._set_state(job, "cancelled")
+
+    def on_close(self):
+        self.on_cancel_all()
+        self.destroy()
+
+    # --- ワーカースレッド（ウィジェットには触らない） ---
+    def _worker(self):
+        while True:
+            job = self.jobs.get()
+            if job.cancel.is_set():
+                continue
+            self.events.put(("state", job, "running"))
+            stream = _QueueStream(self.events, job)
+            try:
+                if job.kind == "encode":
+                    text, title, level = job.args
+                    total = symbol_count(LENGTH_HEADER_SIZE + len(text.encode("utf-8")))
+                    progress = _Progress(self.events, job, total)
+                    out = encode_text(text, title, log=level, stream=stream, on_sync=progress.encoded)
+                    progress.flush(total)
+                else:
+                    path, level = job.args
+                    progress = _Progress(self.events, job)
+                    out = decode_mid(path, log=level, stream=stream, on_sync=progress.decoded)
+                    if not progress.blocks:
+                        # キャッシュから返ったときは on_sync が呼ばれないので、結果から SYNC の一覧を出す
+                        for block in out.sync_blocks:
+                            progress.decoded(*block)
+                    progress.flush(out.notes)
+                stream.flush()
+                self.events.put(("done", job, out))
+            except JobCancelled:
+                stream.flush()
+                self.events.put(("state", job, "cancelled"))
+            except Exception as e:
+                stream.flush()
+                self.events.put(("error", job, e))
+
+    # --- メインスレッド: events キューを反映する ---
+    def _poll(self):
+        try:
+            for _ in range(MAX_EVENTS_PER_POLL):
+                self._handle(*self.events.get_nowait())
+        except queue.Empty:
+            pass
+        self.after(POLL_MS, self._poll)
+
+    def _out_widget(self, job):
+        return self.enc_out if job.kind == "encode" else self.dec_out
+
+    def _set_state(self, job, state):
+        job.state = state
+        i = self.job_list.index(job)
+        self.jobs_box.delete(i)
+        self.jobs_box.insert(i, job.describe())
+
+    def _handle(self, kind, job, *payload):
+        widget = self._out_widget(job)
+        if kind == "state":
+            state, = payload
+            self._set_state(job, state)
+            if state == "running":
+                self.current = job
+                self.log_to_widget(widget, f"=== #{job.id} {job.kind} {job.label} ===")
+                self.progress.configure(mode="determinate" if job.kind == "encode" else "indeterminate", value=0)
+                if job.kind == "decode":
+                    self.progress.start(POLL_MS)
+                self.progress_label.configure(text=f"#{job.id} running")
+            elif state == "cancelled":
+                if job is self.current:
+                    self._job_finished(f"#{job.id} cancelled")
+                self.log_to_widget(widget, f"[CANCELLED] #{job.id}")
+        elif kind in ("log", "sync"):
+            self.append_to_widget(widget, payload[0])
+        elif kind == "progress":
+            notes, total, blocks, errors = payload
+            if total:
+                self.progress.configure(value=100.0 * min(notes, total) / total)
+            self.progress_label.configure(text=f"#{job.id} notes={notes}" + (f"/{total}" if total else "")
+                                          + f" sync={blocks} crc_errors={errors}")
+        elif kind == "done":
+            result, = payload
+            self._set_state(job, "done")
+            self._job_finished(f"#{job.id} done")
+            if job.kind == "encode":
+                self.log_to_widget(widget, f"payload_bytes={len(job.args[0].encode('utf-8'))}")
+                self.log_to_widget(widget, f"MIDI saved: {result}")
             else:
-                text = text_tail.rstrip()
-        else:
-            lines = [l.rstrip() for l in dec.stdout.splitlines() if l.strip()]
-            text = lines[-1] if lines else ""
-        self.dec_text.delete("1.0", "end")
-        self.dec_text.insert("1.0", text)
-        messagebox.showinfo("Decode", "復号処理が完了しました。")
+                self.log_to_widget(widget, f"notes={result.notes} expected_payload_len={result.expected_len}")
+                self.dec_text.delete("1.0", "end")
+                self.dec_text.insert("1.0", result.text)
+        elif kind == "error":
+            err, = payload
+            self._set_state(job, "failed")
+            self._job_finished(f"#{job.id} failed")
+            self.log_to_widget(widget, f"[ERROR] {err}")
+            title = "Encode" if job.kind == "encode" else "Decode"
+            message = "エンコードに失敗しました。" if job.kind == "encode" else "復号に失敗しました。"
+            messagebox.showwarning(title, message + "ログを確認してください。")
+
+    def _job_finished(self, text):
+        self.progress.stop()
+        self.progress.configure(mode="determinate", value=100 if text.endswith("done") else 0)
+        self.progress_label.configure(text=text)
+        self.current = None
 
 if __name__ == "__main__":
     App().mainloop()
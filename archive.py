@@ -0,0 +1,231 @@
+# 複数のメッセージを 1 つの SMF にまとめるアーカイブ形式
+# 1 エントリ = 1 トラック（中身は単体の .mid と同じ timeshift トラック。prev・step はトラックごとに始まり直す）。
+# 最後のトラックがディレクトリで、次のテキスト 1 個だけを持つ:
+#   ARCHIVE:<version>:<JSON>   JSON = [{"title", "length", "crc", "offset", "size"}, ...]
+#     length : ペイロードのバイト数、crc : ペイロードの CRC-32（8 桁の 16 進）
+#     offset : そのトラックのデータ開始位置（MTrk ヘッダの直後）、size : トラックのデータ長
+#   JSON は ASCII（ensure_ascii）なので日本語のタイトルもテキストイベントにそのまま入る。
+# 取り出しはディレクトリの offset / size の範囲だけを読む（他のエントリには触れない）。
+# 追記は既存のエントリまで（ディレクトリのトラックの手前）を一時ファイルに写し、新しいエントリとディレクトリを
+# 書き足して MThd のトラック数を直してから元のファイルと置き換える（途中で失敗しても元のファイルは残る）。
+# 単体の .mid 用のデコーダにアーカイブを渡すと全トラックを 1 本として復号してしまうので、reject_archive で断る。
+import json
+import os
+import shutil
+import sys
+import tempfile
+from dataclasses import asdict, dataclass
+
+from checksum import DEFAULT_CHECKSUM, crc32
+from codec_mode import CLASSIC_BITS
+from smf_stream import MAX_TRACKS, SmfTrackWriter, iter_track, open_smf, set_track_count, track_ranges
+
+ARCHIVE_PREFIX = "ARCHIVE:"
+ARCHIVE_VERSION = 1
+
+class ArchiveError(ValueError):
+    """アーカイブでない・ディレクトリが壊れている・取り出したペイロードの検証に失敗した。"""
+
+@dataclass
+class ArchiveEntry:
+    title: str
+    length: int
+    crc: str
+    offset: int
+    size: int
+
+def format_directory(entries):
+    body = json.dumps([asdict(e) for e in entries], ensure_ascii=True, separators=(",", ":"))
+    return f"{ARCHIVE_PREFIX}{ARCHIVE_VERSION}:{body}"
+
+def parse_directory(text):
+    """ARCHIVE テキストから [ArchiveEntry] を返す。解釈できなければ None。"""
+    if not isinstance(text, str) or not text.startswith(ARCHIVE_PREFIX):
+        return None
+    version, sep, body = text[len(ARCHIVE_PREFIX):].partition(":")
+    if not sep or version != str(ARCHIVE_VERSION):
+        return None
+    try:
+        return [ArchiveEntry(**item) for item in json.loads(body)]
+    except (ValueError, TypeError):
+        return None
+
+def _directory_text(buf, ranges):
+    # 最後のトラックにある ARCHIVE テキスト（無ければ None）
+    if ranges:
+        for _, kind, _, _, text in iter_track(buf, *ranges[-1]):
+            if kind == "text" and text.startswith(ARCHIVE_PREFIX):
+                return text
+    return None
+
+def _directory(buf):
+    # (entries, ディレクトリの MTrk チャンクの開始位置, トラック数)
+    ranges = track_ranges(buf)
+    text = _directory_text(buf, ranges)
+    if text is None:
+        raise ArchiveError("not a timeshift archive (no directory track)")
+    entries = parse_directory(text)
+    if entries is None:
+        raise ArchiveError("broken archive directory")
+    return entries, ranges[-1][0] - 8, len(ranges)
+
+def _not_single():
+    return ArchiveError("this is a timeshift archive; read its entries with archive.extract "
+                        "(timeshift_cli.py archive extract)")
+
+def reject_archive(buf, ranges):
+    """buf（track_ranges が ranges）がアーカイブなら ArchiveError。単体の .mid 用のデコーダが先に呼ぶ。"""
+    # エントリが 1 個でもディレクトリと合わせて 2 トラックある
+    if len(ranges) >= 2 and _directory_text(buf, ranges) is not None:
+        raise _not_single()
+
+def reject_archive_texts(track_count, last_texts):
+    """reject_archive の、トラック数と最後のトラックのテキスト列で判定する版（MidiFile・EventStore 用）。"""
+    if track_count >= 2 and any(text.startswith(ARCHIVE_PREFIX) for text in last_texts):
+        raise _not_single()
+
+def read_directory(src):
+    """アーカイブ（パスまたはバイト列）のエントリ一覧。"""
+    with open_smf(src) as buf:
+        return _directory(buf)[0]
+
+def is_archive(src):
+    try:
+        read_directory(src)
+    except ArchiveError:
+        return False
+    return True
+
+def _encode_items(items, n_existing, checksum_algo, compress, bits_per_note):
+    # 書き始める前に全部エンコードしておく（途中で失敗してもファイルに触れていない）
+    from makemidi_adaptive_timeshift import encode_events
+    encoded = []
+    for title, payload in items:
+        payload = bytes(payload)
+        store, = encode_events(payload, checksum_algo=checksum_algo, compress=compress, bits_per_note=bits_per_note)
+        encoded.append((str(title), payload, store))
+    if n_existing + len(encoded) + 1 > MAX_TRACKS:
+        raise ArchiveError(f"too many entries for one archive (max {MAX_TRACKS - 1})")
+    return encoded
+
+def _write_entries(writer, encoded, entries):
+    # writer の今のトラックから 1 エントリずつ書き、最後のトラックにディレクトリを書く
+    from event_store import write_store
+    for title, payload, store in encoded:
+        offset = writer.tell()
+        write_store(writer, store)
+        writer.next_track()
+        # 新しいトラックの MTrk ヘッダ（8 バイト）の手前までが今のエントリ
+        entries.append(ArchiveEntry(title, len(payload), f"{crc32(payload):08X}", offset,
+                                    writer.tell() - 8 - offset))
+    writer.text(format_directory(entries))
+    writer.close()
+    set_track_count(writer.out, len(entries) + 1)
+    return entries
+
+def write_archive(items, out, checksum_algo=DEFAULT_CHECKSUM, compress=None, bits_per_note=CLASSIC_BITS):
+    """(title, payload) の列を 1 つのアーカイブとしてシーク可能な out に書き、エントリ一覧を返す。
+    compress・bits_per_note は各エントリのエンコードに使う（encode_events と同じ）。"""
+    encoded = _encode_items(items, 0, checksum_algo, compress, bits_per_note)
+    return _write_entries(SmfTrackWriter(out), encoded, [])
+
+def append_archive(path, items, checksum_algo=DEFAULT_CHECKSUM, compress=None, bits_per_note=CLASSIC_BITS):
+    """既存のアーカイブ path にエントリを足す。既存のエントリのトラックは書き換えない。全エントリの一覧を返す。"""
+    with open_smf(path) as buf:
+        entries, dir_pos, _ = _directory(buf)
+    encoded = _encode_items(items, len(entries), checksum_algo, compress, bits_per_note)
+    fd, tmp_path = tempfile.mkstemp(prefix=".archive-", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with open(path, "rb") as src, os.fdopen(fd, "w+b") as f:
+            # 既存のエントリ（ディレクトリのトラックの手前まで）はバイト単位でそのまま写す
+            while src.tell() < dir_pos:
+                chunk = src.read(min(1 << 20, dir_pos - src.tell()))
+                if not chunk:
+                    raise ArchiveError("archive is shorter than its directory position")
+                f.write(chunk)
+            entries = _write_entries(SmfTrackWriter(f, header=False), encoded, entries)
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return entries
+
+def find_entry(entries, key):
+    """key が int ならその番号、str ならそのタイトルのエントリ（同じタイトルが複数あれば後から足したもの）。"""
+    if isinstance(key, int):
+        if not 0 <= key < len(entries):
+            raise ArchiveError(f"no entry #{key} (archive has {len(entries)})")
+        return entries[key]
+    for entry in reversed(entries):
+        if entry.title == key:
+            return entry
+    raise ArchiveError(f"no entry titled {key!r}")
+
+def extract_result(src, key):
+    """エントリ 1 個を復号して (ArchiveEntry, DecodeResult) を返す。読むのはそのトラックだけ。"""
+    from decode_adaptive_timeshift_decode import decode_index, track_index
+    with open_smf(src) as buf:
+        entry = find_entry(_directory(buf)[0], key)
+        if entry.offset + entry.size > len(buf):
+            raise ArchiveError(f"entry {entry.title!r} lies outside the file")
+        index = track_index(buf, (entry.offset, entry.offset + entry.size))
+    return entry, decode_index(index)
+
+def extract(src, key, verify=True):
+    """エントリ 1 個のペイロード。verify なら SYNC の CRC とディレクトリの長さ・CRC-32 を確かめる。"""
+    entry, result = extract_result(src, key)
+    payload = result.payload
+    if verify and (not result.crc_ok or len(payload) != entry.length or f"{crc32(payload):08X}" != entry.crc):
+        raise ArchiveError(f"entry {entry.title!r} failed verification "
+                           f"(crc_errors={len(result.crc_errors)}, length={len(payload)}/{entry.length})")
+    return payload
+
+def files_to_items(paths):
+    """ファイルパスの列を (タイトル = 拡張子を除いたファイル名, 中身) の列にする。"""
+    for path in paths:
+        with open(path, "rb") as f:
+            yield os.path.splitext(os.path.basename(path))[0], f.read()
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="複数のメッセージを 1 つの .mid にまとめる")
+    sub = ap.add_subparsers(dest="action", required=True)
+    for name in ("create", "append"):
+        p = sub.add_parser(name)
+        p.add_argument("archive")
+        p.add_argument("files", nargs="+")
+        p.add_argument("--bits", type=int, default=CLASSIC_BITS)
+        p.add_argument("--compress", default=None)
+    p = sub.add_parser("list")
+    p.add_argument("archive")
+    p = sub.add_parser("extract")
+    p.add_argument("archive")
+    p.add_argument("entry", help="タイトル、または #番号")
+    p.add_argument("-o", "--output", default=None)
+    args = ap.parse_args(argv)
+
+    if args.action == "create":
+        with open(args.archive, "wb") as f:
+            entries = write_archive(files_to_items(args.files), f, compress=args.compress, bits_per_note=args.bits)
+        print(f"{args.archive}: {len(entries)} entries")
+    elif args.action == "append":
+        entries = append_archive(args.archive, files_to_items(args.files), compress=args.compress,
+                                 bits_per_note=args.bits)
+        print(f"{args.archive}: {len(entries)} entries")
+    elif args.action == "list":
+        for k, e in enumerate(read_directory(args.archive)):
+            print(f"#{k:<5d} {e.length:>10d}  {e.crc}  {e.title}")
+    else:
+        key = int(args.entry[1:]) if args.entry.startswith("#") and args.entry[1:].isdigit() else args.entry
+        payload = extract(args.archive, key)
+        if args.output:
+            with open(args.output, "wb") as f:
+                f.write(payload)
+        else:
+            sys.stdout.buffer.write(payload)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+# 大量テキストの一括 encode → decode → 検証
+# 入力はディレクトリ（*.txt を 1 ファイル 1 テキスト）か JSONL（{"id": ..., "text": ...} または文字列を 1 行ずつ）。
+# テキストを chunk_size 件ずつの作業単位にまとめて ProcessPoolExecutor に配り、
+# 各プロセスは mido を介さない stream_encode / StreamDecoder で処理する（プロセス間で渡すのは結果の dict だけ）。
+#
+#   python batch_timeshift.py corpus.jsonl --out mid/batch --workers 8
+#   generate_corpus | python batch_timeshift.py - --manifest -   # JSONL を stdin から読み、マニフェストを stdout へ
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from checksum import DEFAULT_CHECKSUM
+from makemidi_adaptive_timeshift import output_filename_for, stream_encode
+from decode_adaptive_timeshift_decode import StreamDecoder
+
+DEFAULT_CHUNK_SIZE = 64
+MANIFEST_NAME = "manifest.jsonl"
+# 1 プロセスあたりの先行投入数（待ち時間を作らない程度に少なく）
+IN_FLIGHT_PER_WORKER = 4
+
+def first_diff_index(a, b):
+    """バイト列 a, b の最初の差分位置。同一なら None（長さだけ違う場合は短い方の長さ）。"""
+    min_len = min(len(a), len(b))
+    for j in range(min_len):
+        if a[j] != b[j]:
+            return j
+    if len(a) != len(b):
+        return min_len
+    return None
+
+def _safe_name(item_id):
+    # ファイル名に使えない文字は '_' に置き換える
+    return re.sub(r'[^\w.-]', '_', str(item_id)) or "item"
+
+def unique_names(items):
+    """(id, text) に出力名を付けて (id, name, text) を返す。
+    置き換えで同じ名前になる id（"a b" と "a_b"、重複した id、既定の連番と同じ明示 id）には
+    入力順に _2, _3, ... を付けて、別々のプロセスが同じ .mid を上書きしないようにする。
+    大文字小文字だけの違いも区別しないファイルシステムがあるので同じ名前とみなす。"""
+    used = set()
+    for item_id, text in items:
+        base = _safe_name(item_id)
+        name = base
+        k = 1
+        while name.lower() in used:
+            k += 1
+            name = f"{base}_{k}"
+        used.add(name.lower())
+        yield item_id, name, text
+
+def iter_items(src):
+    """入力から (id, text) を順に返す。src が "-" なら stdin の JSONL。"""
+    if str(src) == "-":
+        yield from _iter_jsonl(sys.stdin)
+        return
+    src = Path(src)
+    if src.is_dir():
+        for p in sorted(src.glob("*.txt")):
+            yield p.stem, p.read_text(encoding="utf-8")
+        return
+    with open(src, encoding="utf-8") as f:
+        yield from _iter_jsonl(f)
+
+def _iter_jsonl(f):
+    for n, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        obj = json.loads(line)
+        if isinstance(obj, str):
+            yield f"{n:06d}", obj
+        else:
+            yield obj.get("id", f"{n:06d}"), obj["text"]
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def process_one(item_id, text, out_dir, checksum_algo=DEFAULT_CHECKSUM, name=None):
+    """1 件を encode → 保存 → decode → 比較し、マニフェスト 1 行分の dict を返す。
+    name は出力ファイル名（省略時は id から作る。run_batch は unique_names で重複を避けた名前を渡す）。"""
+    rec = {"id": item_id}
+    orig_bytes = text.encode("utf-8")
+    rec["orig_bytes_len"] = len(orig_bytes)
+    path = output_filename_for(name or _safe_name(item_id), str(out_dir))
+    rec["mid"] = path
+    if name is not None and name != _safe_name(item_id):
+        rec["renamed"] = True
+    try:
+        buf = io.BytesIO()
+        # 長さ指定ありの stream_encode は encode_text と同一のファイルになる
+        stream_encode(io.BytesIO(orig_bytes), buf, checksum_algo, length=len(orig_bytes))
+        smf = buf.getvalue()
+        with open(path, "wb") as f:
+            f.write(smf)
+    except Exception as e:
+        rec.update(match=False, error=f"encoder_failed: {e!r}")
+        return rec
+    try:
+        dec = StreamDecoder(smf)
+        dec_bytes = b"".join(dec)
+    except Exception as e:
+        rec.update(match=False, error=f"decoder_failed: {e!r}")
+        return rec
+    # テキストとしての比較（従来の test_multiple_texts と同じ: 不正な UTF-8 は置換して比べる）
+    dec_bytes = dec_bytes.decode("utf-8", errors="replace").encode("utf-8", errors="replace")
+    rec["dec_bytes_len"] = len(dec_bytes)
+    rec["notes"] = dec.notes
+    rec["crc_errors"] = len(dec.crc_errors)
+    diff_idx = first_diff_index(orig_bytes, dec_bytes)
+    rec["match"] = diff_idx is None
+    if diff_idx is not None:
+        rec["first_diff"] = diff_idx
+        rec["orig_context"] = orig_bytes[max(0, diff_idx - 8):diff_idx + 8].hex()
+        rec["dec_context"] = dec_bytes[max(0, diff_idx - 8):diff_idx + 8].hex()
+    return rec
+
+def _process_chunk(args):
+    chunk, out_dir, checksum_algo = args
+    return [process_one(item_id, text, out_dir, checksum_algo, name) for item_id, name, text in chunk]
+
+def _ordered_map(pool, fn, jobs, window):
+    # Executor.map は全入力を先に submit してしまうので、投入中の作業単位を window 件までに抑える。
+    # 結果は入力順に返す（マニフェストの並びも入力順になる）。
+    pending = deque()
+    for job in jobs:
+        pending.append(pool.submit(fn, job))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def run_batch(src, out_dir, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, checksum_algo=DEFAULT_CHECKSUM,
+              manifest=None, progress=None):
+    """src の全テキストを並列に処理し、結果を manifest（JSONL）へ入力順に書く。集計 dict を返す。
+    workers=1 のときはプロセスを起動せずその場で処理する（None なら CPU 数）。manifest="-" なら stdout に書く。
+    id から作る出力名が重なったものは unique_names で別名にし、その件数を summary["renamed"] に入れる。"""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError(f"workers must be >= 1: {workers}")
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if manifest is None:
+        manifest = out_dir / MANIFEST_NAME
+    jobs = ((chunk, str(out_dir), checksum_algo) for chunk in _chunks(unique_names(iter_items(src)), chunk_size))
+    summary = {"total": 0, "ok": 0, "failed": 0, "renamed": 0, "manifest": str(manifest)}
+    t0 = time.perf_counter()
+    mf_ctx = nullcontext(sys.stdout) if str(manifest) == "-" else open(manifest, "w", encoding="utf-8")
+    with mf_ctx as mf:
+        if workers == 1:
+            results = map(_process_chunk, jobs)
+            pool = None
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            results = _ordered_map(pool, _process_chunk, jobs, workers * IN_FLIGHT_PER_WORKER)
+        try:
+            for recs in results:
+                for rec in recs:
+                    mf.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                    summary["total"] += 1
+                    summary["ok" if rec["match"] else "failed"] += 1
+                    if rec.get("renamed"):
+                        summary["renamed"] += 1
+                if progress is not None:
+                    progress(summary["total"])
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+    summary["seconds"] = round(time.perf_counter() - t0, 3)
+    return summary
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="timeshift 一括 encode/decode/検証")
+    ap.add_argument("src", help="*.txt のディレクトリ、または JSONL ファイル（- で stdin）")
+    ap.add_argument("--out", default=str(Path("mid") / "batch"), help="MIDI とマニフェストの出力先")
+    ap.add_argument("--workers", type=int, default=None, help="プロセス数（既定: CPU 数）")
+    ap.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    ap.add_argument("--checksum", default=DEFAULT_CHECKSUM, choices=["crc8", "crc16", "crc32"])
+    ap.add_argument("--manifest", default=None, help="マニフェストの出力先（- で stdout）")
+    args = ap.parse_args(argv)
+    if args.workers is not None and args.workers < 1:
+        ap.error("--workers must be >= 1")
+
+    def progress(n):
+        print(f"\r{n} 件処理", end="", file=sys.stderr, flush=True)
+
+    summary = run_batch(args.src, args.out, args.workers, args.chunk_size, args.checksum, args.manifest,
+                        progress=progress)
+    print(file=sys.stderr)
+    if summary["renamed"]:
+        print(f"警告: 出力名が重なった {summary['renamed']} 件に _2 などを付けて保存しました（manifest の mid 参照）",
+              file=sys.stderr)
+    print(f"合格 {summary['ok']}/{summary['total']} ({summary['seconds']}s) manifest: {summary['manifest']}",
+          file=sys.stderr if summary["manifest"] == "-" else sys.stdout)
+    return 0 if summary["failed"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+# ビット変換の簡易ベンチマーク: 旧来の '0'/'1' 文字列方式と bitpack の比較
+# 使い方: python bench_bitpack.py [サイズ(MB), 既定 10] [旧方式の計測上限(MB), 既定 0.1]
+# 旧方式は文字列連結が入力長に対して超線形に遅くなるため、上限を超える分は
+# 先頭部分だけで計測し、入力長に比例するとみなした下限値で比較する。
+import os
+import sys
+import time
+
+from bitpack import bytes_to_symbols, symbols_to_bytes
+
+def legacy_to_chunks(data):
+    binary_data = ''.join(f'{b:08b}' for b in data)
+    return [binary_data[i:i+6].ljust(6, '0') for i in range(0, len(binary_data), 6)]
+
+def legacy_from_chunks(chunks):
+    bit_string = ""
+    for c in chunks:
+        bit_string += c
+    rem = len(bit_string) % 8
+    if rem != 0:
+        bit_string = bit_string + '0' * (8 - rem)
+    return bytes(int(bit_string[i:i+8], 2) for i in range(0, len(bit_string), 8))
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - t0
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    legacy_mb = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    data = os.urandom(int(size_mb * 1024 * 1024))
+    print(f"input: {len(data)} bytes")
+
+    sample = data[:int(legacy_mb * 1024 * 1024)]
+    scale = len(data) / len(sample) if sample else 1.0
+    chunks, t_legacy_enc = timed(legacy_to_chunks, sample)
+    back, t_legacy_dec = timed(legacy_from_chunks, chunks)
+    assert back[:len(sample)] == sample
+    del chunks, back
+    t_legacy_enc *= scale
+    t_legacy_dec *= scale
+    if scale > 1:
+        print(f"legacy measured on first {len(sample)} bytes, scaled x{scale:.1f} (lower bound)")
+
+    syms, t_enc = timed(bytes_to_symbols, data)
+    back, t_dec = timed(symbols_to_bytes, syms)
+    assert back[:len(data)] == data
+
+    print(f"{'stage':<18}{'legacy [s]':>12}{'bitpack [s]':>12}{'speedup':>10}")
+    print(f"{'bytes -> 6bit':<18}{t_legacy_enc:12.3f}{t_enc:12.3f}{t_legacy_enc / t_enc:9.1f}x")
+    print(f"{'6bit -> bytes':<18}{t_legacy_dec:12.3f}{t_dec:12.3f}{t_legacy_dec / t_dec:9.1f}x")
+
+if __name__ == "__main__":
+    main()
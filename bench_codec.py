@@ -0,0 +1,246 @@
+# timeshift エンコーダ/デコーダのベンチマーク（同一プロセス内）
+# 使い方:
+#   python bench_codec.py                         # 既定サイズ (10B〜1MB) を計測して artifacts/bench_codec.json に保存
+#   python bench_codec.py --sizes 10 1K 100M      # サイズ指定（K/M 接尾辞可）
+#   python bench_codec.py --compare old.json      # 以前の結果と比較し、遅くなった段階を表示（終了コード 1）
+#
+# 段階ごとの計測:
+#   pack   : 長さヘッダ付与 + 6bit シンボル化
+#   map    : シンボル -> ノート/SYNC の決定（出力先は何もしない sink）
+#   build  : mido の MidiTrack 構築（map を含む時間から map を引いたもの）
+#   save   : MidiFile.save（BytesIO）
+#   parse  : MidiFile の読み込み
+#   pair   : note_on/note_off の対応付け（build_note_index）
+#   decode : シンボル復元・SYNC 検証・ペイロード取り出し
+# STREAM_THRESHOLD を超えるサイズは mido のオブジェクトがメモリに載り切らないので、
+# ストリーム経路（stream_encode / StreamDecoder）の encode_stream / decode_stream だけを計測する。
+import argparse
+import io
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from mido import MidiFile, MidiTrack
+
+from midi_shared import ARTIFACTS_DIR, SAMPLE_TEXTS, ensure_dir
+from bitpack import bytes_to_symbols
+from framing import length_header
+from note_index import build_note_index
+from makemidi_adaptive_timeshift import MidiTrackSink, TimeshiftEncoder, stream_encode
+from decode_adaptive_timeshift_decode import StreamDecoder, TimeshiftDecoder
+
+DEFAULT_SIZES = ["10", "100", "1K", "10K", "100K", "1M"]
+STREAM_THRESHOLD = 4 * 1024 * 1024
+BASELINE_PATH = ARTIFACTS_DIR / "bench_codec.json"
+# --compare でこの割合以上遅くなった段階を回帰とみなす
+DEFAULT_TOLERANCE = 0.10
+
+def _is_ascii(s):
+    return all(ord(c) < 128 for c in s)
+
+def _is_emoji_text(s):
+    return any(ord(c) > 0xFFFF for c in s)
+
+# SAMPLE_TEXTS から種類別のもとになる文字列を作る
+KINDS = {
+    "ascii": "\n".join(t for t in SAMPLE_TEXTS if _is_ascii(t)),
+    "japanese": "\n".join(t for t in SAMPLE_TEXTS if not _is_ascii(t) and not _is_emoji_text(t)),
+    "emoji": "\n".join(t for t in SAMPLE_TEXTS if _is_emoji_text(t)),
+    "mixed": "\n".join(SAMPLE_TEXTS),
+}
+
+def parse_size(s):
+    s = str(s).strip().upper()
+    mult = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}.get(s[-1:], 1)
+    return int(float(s[:-1] if mult > 1 else s) * mult)
+
+def make_payload(kind, size):
+    """kind の文字列を繰り返して size バイト以下の UTF-8 バイト列を作る（文字の途中では切らない）。"""
+    unit = (KINDS[kind] + "\n").encode("utf-8")
+    data = unit * (size // len(unit) + 1)
+    return data[:size].decode("utf-8", errors="ignore").encode("utf-8")
+
+class NullSink:
+    def note(self, note_num, velocity, duration):
+        pass
+
+    def text(self, text):
+        pass
+
+def _timed(stages, name, fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    stages[name] = time.perf_counter() - t0
+    return out
+
+def _run_in_memory(payload):
+    """mido 経路の 1 回分。(段階ごとの秒数, ノート数) を返す。"""
+    st = {}
+    syms = _timed(st, "pack", lambda: bytes_to_symbols(length_header(len(payload)) + payload))
+    _timed(st, "map", lambda: TimeshiftEncoder(NullSink()).feed(syms))
+
+    def build():
+        mid = MidiFile()
+        track = MidiTrack()
+        mid.tracks.append(track)
+        TimeshiftEncoder(MidiTrackSink(track)).feed(syms)
+        return mid
+    mid = _timed(st, "build", build)
+    st["build"] = max(0.0, st["build"] - st["map"])
+
+    buf = io.BytesIO()
+    _timed(st, "save", mid.save, None, buf)
+    del mid
+    smf = buf.getvalue()
+    mid = _timed(st, "parse", lambda: MidiFile(file=io.BytesIO(smf)))
+    msgs = [m for tr in mid.tracks for m in tr]
+    index = _timed(st, "pair", build_note_index, msgs)
+    del msgs, mid
+
+    def decode():
+        dec = TimeshiftDecoder()
+        for i in range(len(index)):
+            dec.note(index.note[i], index.velocity[i], index.duration(i), index.sync_text(i))
+        return dec.finish(index.end_text)
+    result = _timed(st, "decode", decode)
+    if result.payload != payload or not result.crc_ok:
+        raise AssertionError("round trip mismatch")
+    st["encode_total"] = st["pack"] + st["map"] + st["build"] + st["save"]
+    st["decode_total"] = st["parse"] + st["pair"] + st["decode"]
+    return st, len(index)
+
+def _run_stream(payload):
+    """ストリーム経路の 1 回分。"""
+    st = {}
+    out = io.BytesIO()
+    _timed(st, "encode_stream", stream_encode, io.BytesIO(payload), out, "crc8", len(payload))
+    smf = out.getvalue()
+    del out
+    dec = StreamDecoder(smf)
+    back = _timed(st, "decode_stream", lambda: b"".join(dec))
+    if back != payload or not dec.crc_ok:
+        raise AssertionError("round trip mismatch")
+    st["encode_total"] = st["encode_stream"]
+    st["decode_total"] = st["decode_stream"]
+    return st, dec.notes
+
+def _peak_rss_mb():
+    # ru_maxrss は Linux では KiB、macOS では byte
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def bench_one(kind, size, repeat=1, trace_memory=True):
+    payload = make_payload(kind, size)
+    run = _run_stream if len(payload) > STREAM_THRESHOLD else _run_in_memory
+    best = None
+    for _ in range(repeat):
+        st, notes = run(payload)
+        best = st if best is None else {k: min(v, best[k]) for k, v in st.items()}
+    rec = {
+        "kind": kind,
+        "size": size,
+        "payload_bytes": len(payload),
+        "path": "stream" if run is _run_stream else "mido",
+        "notes": notes,
+        "stages": {k: round(v, 6) for k, v in best.items()},
+        "encode_notes_per_s": round(notes / best["encode_total"], 1) if best["encode_total"] else None,
+        "decode_notes_per_s": round(notes / best["decode_total"], 1) if best["decode_total"] else None,
+        "encode_bytes_per_s": round(len(payload) / best["encode_total"], 1) if best["encode_total"] else None,
+        "decode_bytes_per_s": round(len(payload) / best["decode_total"], 1) if best["decode_total"] else None,
+    }
+    if trace_memory:
+        # tracemalloc は処理を遅くするので、時間計測とは別の 1 回で測る
+        tracemalloc.start()
+        run(payload)
+        rec["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 3)
+        tracemalloc.stop()
+    rec["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+    return rec
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=str(ARTIFACTS_DIR.parent)).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """(kind, size, stage, 旧秒数, 新秒数, 比) のうち tolerance を超えて遅くなったものを返す。"""
+    old = {(r["kind"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for r in current["results"]:
+        o = old.get((r["kind"], r["size"]))
+        if o is None:
+            continue
+        for stage, t in r["stages"].items():
+            t_old = o["stages"].get(stage)
+            # 1ms 未満の段階は誤差が大きいので比較しない
+            if not t_old or max(t, t_old) < 1e-3:
+                continue
+            ratio = t / t_old
+            if ratio > 1 + tolerance:
+                regressions.append((r["kind"], r["size"], stage, t_old, t, ratio))
+    return regressions
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="timeshift encode/decode のベンチマーク")
+    ap.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="ペイロードサイズ（例: 10 1K 100M）")
+    ap.add_argument("--kinds", nargs="+", default=list(KINDS), choices=list(KINDS))
+    ap.add_argument("--repeat", type=int, default=3, help="各条件の繰り返し回数（最小値を採る）")
+    ap.add_argument("--no-tracemalloc", action="store_true", help="tracemalloc によるピーク計測を省く")
+    ap.add_argument("--out", default=str(BASELINE_PATH), help="結果 JSON の保存先")
+    ap.add_argument("--compare", default=None, help="比較対象の結果 JSON")
+    ap.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = ap.parse_args(argv)
+
+    # --out が比較対象と同じファイルでも上書き前の内容と比べるよう、計測の前に読んでおく
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = []
+    print(f"{'kind':<9}{'size':>10}{'notes':>11}{'enc notes/s':>13}{'dec notes/s':>13}"
+          f"{'enc MB/s':>10}{'dec MB/s':>10}{'tracemalloc':>13}")
+    for size in args.sizes:
+        for kind in args.kinds:
+            size_bytes = parse_size(size)
+            # 大きいサイズでは繰り返しを 1 回に抑える
+            repeat = args.repeat if size_bytes <= STREAM_THRESHOLD else 1
+            rec = bench_one(kind, size_bytes, repeat, not args.no_tracemalloc)
+            results.append(rec)
+            mem = rec.get("tracemalloc_peak_mb")
+            print(f"{kind:<9}{size:>10}{rec['notes']:>11}{rec['encode_notes_per_s'] or 0:>13.0f}"
+                  f"{rec['decode_notes_per_s'] or 0:>13.0f}{(rec['encode_bytes_per_s'] or 0) / 1e6:>10.3f}"
+                  f"{(rec['decode_bytes_per_s'] or 0) / 1e6:>10.3f}{'' if mem is None else f'{mem:.1f}MB':>13}")
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    ensure_dir(Path(args.out).parent)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"\n結果を保存: {args.out}")
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        print(f"比較対象: {args.compare} (commit {baseline.get('commit')})")
+        for kind, size, stage, t_old, t, ratio in regressions:
+            print(f"  [REGRESSION] {kind} {size}B {stage}: {t_old:.4f}s -> {t:.4f}s (x{ratio:.2f})")
+        if regressions:
+            return 1
+        print("  回帰なし")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
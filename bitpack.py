@@ -0,0 +1,174 @@
+# バイト列 <-> 6bit シンボル列の変換（'0'/'1' 文字列を経由しない）
+# 3 バイト (24bit) がちょうど 4 シンボルになるので、3 バイト単位で整数演算する。
+# 端数は従来どおり末尾をゼロで埋める（エンコード側は 6bit 単位、デコード側は 8bit 単位）。
+# 6bit 以外の幅（codec_mode の hd モード）は汎用の経路で扱い、シンボル列は array('H') になる。
+from array import array
+from math import lcm
+
+SYMBOL_BITS = 6
+SYMBOL_MASK = (1 << SYMBOL_BITS) - 1
+
+def symbol_count(n_bytes, bits=SYMBOL_BITS):
+    return (n_bytes * 8 + bits - 1) // bits
+
+def bytes_to_symbols(data, bits=SYMBOL_BITS):
+    """data を 6bit シンボル列（1 シンボル 1 バイトの bytes）に変換する。
+    bits が 6 以外なら bits 幅のシンボル列（array('H')）を返す。"""
+    if bits != SYMBOL_BITS:
+        return _bytes_to_symbols_n(data, bits)
+    data = memoryview(data)
+    n = len(data)
+    full = n - n % 3
+    out = bytearray(symbol_count(n))
+    o = 0
+    for i in range(0, full, 3):
+        v = (data[i] << 16) | (data[i + 1] << 8) | data[i + 2]
+        out[o] = v >> 18
+        out[o + 1] = (v >> 12) & 63
+        out[o + 2] = (v >> 6) & 63
+        out[o + 3] = v & 63
+        o += 4
+    rest = n - full
+    if rest:
+        # 残り 1〜2 バイトは 24bit に左詰めし、必要なシンボル数だけ取り出す
+        v = int.from_bytes(bytes(data[full:]) + b"\x00" * (3 - rest), "big")
+        for k in range(len(out) - o):
+            out[o + k] = (v >> (18 - 6 * k)) & 63
+    return bytes(out)
+
+def _bytes_to_symbols_n(data, bits):
+    # lcm(8, bits) ビットずつ整数にして切り出す
+    group_bits = lcm(8, bits)
+    group_bytes = group_bits // 8
+    per_group = group_bits // bits
+    mask = (1 << bits) - 1
+    data = bytes(data)
+    n = len(data)
+    out = array('H', bytes(2 * symbol_count(n, bits)))
+    o = 0
+    for i in range(0, n, group_bytes):
+        chunk = data[i:i + group_bytes]
+        v = int.from_bytes(chunk.ljust(group_bytes, b"\x00"), "big")
+        k = min(per_group, len(out) - o)
+        for j in range(k):
+            out[o + j] = (v >> (group_bits - bits * (j + 1))) & mask
+        o += k
+    return out
+
+def iter_symbols(data, chunk_size=3 * 4096):
+    """bytes_to_symbols の逐次版。大きな入力を少しずつシンボル化する。"""
+    for start in range(0, len(data), chunk_size):
+        # chunk_size は 3 の倍数なので、途中のチャンクで端数パディングは起きない
+        yield from bytes_to_symbols(data[start:start + chunk_size])
+
+class SymbolWriter:
+    """6bit（または bits 幅の）シンボルを受け取ってバイト列に詰めるライタ。"""
+
+    def __init__(self, bits=SYMBOL_BITS):
+        self.bits = bits
+        self._mask = (1 << bits) - 1
+        self._buf = bytearray()
+        self._acc = 0
+        self._nacc = 0
+        self.symbols = 0
+
+    def write(self, sym):
+        self._acc = (self._acc << self.bits) | (sym & self._mask)
+        self._nacc += self.bits
+        self.symbols += 1
+        while self._nacc >= 8:
+            self._nacc -= 8
+            self._buf.append(self._acc >> self._nacc)
+            self._acc &= (1 << self._nacc) - 1
+
+    def extend(self, syms):
+        for s in syms:
+            self.write(s)
+
+    def extend_packed(self, data, n_symbols):
+        """n_symbols 個のシンボルを詰めたバイト列（末尾の端数ビットはゼロ）をまとめて書く。
+        ライタがバイト境界にいるときだけ使える（codec_numpy の一括復号用）。"""
+        if self._nacc:
+            raise ValueError("SymbolWriter is not byte aligned")
+        full, rest = divmod(n_symbols * self.bits, 8)
+        self._buf += data[:full]
+        if rest:
+            self._acc = data[full] >> (8 - rest)
+            self._nacc = rest
+        self.symbols += n_symbols
+
+    def truncate(self, n_symbols):
+        """先頭の n_symbols 個だけを残す（resync での位置合わせ用）。take_bytes で取り出した分より前には戻せない。"""
+        if n_symbols >= self.symbols:
+            return
+        keep = n_symbols * self.bits - (self.symbols * self.bits - self._nacc - len(self._buf) * 8)
+        if keep < 0:
+            raise ValueError("cannot truncate into bytes already taken")
+        full, rest = divmod(keep, 8)
+        if full < len(self._buf):
+            self._acc = self._buf[full] >> (8 - rest)
+        else:
+            self._acc >>= self._nacc - rest
+        del self._buf[full:]
+        self._nacc = rest
+        self.symbols = n_symbols
+
+    @property
+    def bit_length(self):
+        return self.symbols * self.bits
+
+    def take_bytes(self):
+        """確定済み（8bit 揃った）バイトを取り出してバッファから除く。"""
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+    def getvalue(self):
+        """末尾の不完全バイトをゼロでパディングした全バイト列を返す。"""
+        if self._nacc:
+            return bytes(self._buf) + bytes([(self._acc << (8 - self._nacc)) & 0xFF])
+        return bytes(self._buf)
+
+    def tail_bits(self, n):
+        # 詳細ログ用: 末尾 n ビットを '0'/'1' 文字列で返す
+        head = ''.join(f'{b:08b}' for b in self._buf[-(n // 8 + 1):])
+        if self._nacc:
+            head += format(self._acc, f'0{self._nacc}b')
+        return head[-n:] if n else ""
+
+class SymbolBuffer:
+    """SymbolWriter と同じ write でシンボルを詰めずにそのまま貯める（ストライプの組み直し用）。"""
+
+    def __init__(self, bits=SYMBOL_BITS):
+        self.bits = bits
+        self.syms = array('H')
+        self.write = self.syms.append
+
+    @property
+    def symbols(self):
+        return len(self.syms)
+
+    def truncate(self, n_symbols):
+        del self.syms[n_symbols:]
+
+def symbols_to_bytes(symbols, bits=SYMBOL_BITS):
+    """6bit シンボル列をバイト列に戻す（4 シンボル -> 3 バイト、端数はゼロパディング）。"""
+    if bits != SYMBOL_BITS:
+        w = SymbolWriter(bits)
+        w.extend(symbols)
+        return w.getvalue()
+    n = len(symbols)
+    full = n - n % 4
+    out = bytearray(full // 4 * 3)
+    o = 0
+    for i in range(0, full, 4):
+        v = (symbols[i] << 18) | (symbols[i + 1] << 12) | (symbols[i + 2] << 6) | symbols[i + 3]
+        out[o] = v >> 16
+        out[o + 1] = (v >> 8) & 0xFF
+        out[o + 2] = v & 0xFF
+        o += 3
+    if full < n:
+        w = SymbolWriter()
+        w.extend(symbols[full:])
+        out += w.getvalue()
+    return bytes(out)
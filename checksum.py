@@ -0,0 +1,60 @@
+# SYNC ブロック用チェックサム（バイト列に対して直接計算する）
+# 既定は従来と同じ CRC-8 (poly 0x07, init 0)。長いファイル向けに CRC-16 / CRC-32 も選べる。
+import zlib
+
+def _make_table(poly, width):
+    top = 1 << (width - 1)
+    mask = (1 << width) - 1
+    table = []
+    for b in range(256):
+        crc = b << (width - 8)
+        for _ in range(8):
+            if crc & top:
+                crc = ((crc << 1) & mask) ^ poly
+            else:
+                crc = (crc << 1) & mask
+        table.append(crc)
+    return tuple(table)
+
+CRC8_TABLE = _make_table(0x07, 8)
+CRC16_TABLE = _make_table(0x1021, 16)
+
+def crc8(data, crc=0):
+    table = CRC8_TABLE
+    for b in data:
+        crc = table[crc ^ b]
+    return crc
+
+def crc16(data, crc=0xFFFF):
+    # CRC-16/CCITT-FALSE
+    table = CRC16_TABLE
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ b]
+    return crc
+
+def crc32(data, crc=0):
+    return zlib.crc32(data, crc) & 0xFFFFFFFF
+
+# 名前 -> (関数, 16 進桁数)
+CHECKSUMS = {
+    "crc8": (crc8, 2),
+    "crc16": (crc16, 4),
+    "crc32": (crc32, 8),
+}
+DEFAULT_CHECKSUM = "crc8"
+
+def checksum(algo, data):
+    return CHECKSUMS[algo][0](data)
+
+def check_checksum(algo):
+    if algo not in CHECKSUMS:
+        raise ValueError(f"checksum_algo must be one of {', '.join(CHECKSUMS)}: {algo!r}")
+
+def hex_digits(algo):
+    return CHECKSUMS.get(algo, CHECKSUMS[DEFAULT_CHECKSUM])[1]
+
+def crc8_bits(bitstr):
+    # 旧 API 互換: '0'/'1' 文字列（8 の倍数にゼロパディング）に対する CRC-8
+    if len(bitstr) % 8 != 0:
+        bitstr = bitstr + '0' * (8 - (len(bitstr) % 8))
+    return crc8(bytes(int(bitstr[i:i+8], 2) for i in range(0, len(bitstr), 8)))
@@ -0,0 +1,99 @@
+# エンコーダ/デコーダ共通の音階モデルと、prev_note ごとに事前計算したコードブック
+# prev_note の状態は NOTE_NAMES の 11 通りしかないので、確率表と 16 スロットの
+# マッピングは import 時に一度だけ作り、1 ノートあたりの処理は整数インデックスで済ませる。
+from functools import lru_cache
+
+# ---------------------------
+# 音階・基準設定
+# ---------------------------
+NOTE_NAMES = ["G3", "A3", "B3", "C4", "D4", "E4", "F4", "G4", "A4", "B4", "C5"]
+NOTE_TO_MIDI = {
+    "G3": 55, "A3": 57, "B3": 59,
+    "C4": 60, "D4": 62, "E4": 64, "F4": 65,
+    "G4": 67, "A4": 69, "B4": 71, "C5": 72
+}
+MIDI_TO_NOTE = {v: k for k, v in NOTE_TO_MIDI.items()}
+
+RELATIVE_WEIGHTS = [1, 2, 3, 3, 3, 2, 1, 1]  # -3..+4
+
+DURATION_TABLE = {
+    "00": 480,   # 4分音符
+    "01": 240,   # 8分音符
+    "10": 960,   # 2分音符
+    "11": 720    # 付点4分音符
+}
+
+# キーフレーム設定
+KEYFRAME_INTERVAL = 20
+BASE_VELOCITY = 80
+KEYFRAME_PHRASE = [
+    ("D4", 240), ("E4", 240), ("A4", 240), ("A3", 240)
+]
+# 微小時間ずらし (ticks): キーフレーム音は duration を +1 tick する
+KEYFRAME_DURATION_SHIFT = 1
+
+def make_probability_table(prev_note):
+    if prev_note not in NOTE_NAMES:
+        prev_note = "C4"
+    center_index = NOTE_NAMES.index(prev_note)
+    prob_table = {}
+    for offset, weight in enumerate(RELATIVE_WEIGHTS):
+        rel_idx = offset - 3
+        target_index = center_index + rel_idx
+        if 0 <= target_index < len(NOTE_NAMES):
+            note = NOTE_NAMES[target_index]
+            prob_table[note] = prob_table.get(note, 0) + weight
+    total = sum(prob_table.values()) or 1
+    for k in list(prob_table.keys()):
+        prob_table[k] = prob_table[k] / total
+    return prob_table
+
+def make_mapping_from_prob_table(prob_table):
+    notes = []
+    for note in NOTE_NAMES:
+        prob = prob_table.get(note, 0)
+        if prob <= 0:
+            continue
+        count = max(1, round(prob * 16))
+        notes.extend([note] * count)
+    while len(notes) < 16:
+        notes.append(list(prob_table.keys())[len(prob_table)//2])
+    notes = notes[:16]
+    return {format(i, '04b'): notes[i] for i in range(16)}
+
+# ---------------------------
+# 事前計算テーブル（添字はすべて NOTE_NAMES のインデックス）
+# ---------------------------
+NOTE_INDEX = {n: i for i, n in enumerate(NOTE_NAMES)}
+DEFAULT_PREV = NOTE_INDEX["C4"]
+NOTE_MIDI = [NOTE_TO_MIDI[n] for n in NOTE_NAMES]
+MIDI_TO_INDEX = {m: i for i, m in enumerate(NOTE_MIDI)}
+# 2bit コード -> ticks
+DURATION_TICKS = [DURATION_TABLE[format(c, '02b')] for c in range(4)]
+
+# 詳細ログ表示用に元の dict 形式も保持しておく
+PROB_TABLES = [make_probability_table(n) for n in NOTE_NAMES]
+MAPPINGS = [make_mapping_from_prob_table(p) for p in PROB_TABLES]
+
+# BITS_TO_NOTE[prev][sym4] -> note index
+BITS_TO_NOTE = [tuple(NOTE_INDEX[m[format(b, '04b')]] for b in range(16)) for m in MAPPINGS]
+# NOTE_SLOTS[prev][note] -> その音に割り当てられた 4bit シンボル（昇順）
+NOTE_SLOTS = [
+    tuple(tuple(b for b in range(16) if row[b] == n) for n in range(len(NOTE_NAMES)))
+    for row in BITS_TO_NOTE
+]
+# SLOT_OFFSET[prev][sym4] -> 同じ音の候補内での順位（= velocity - BASE_VELOCITY）
+SLOT_OFFSET = [
+    tuple(slots[row[b]].index(b) for b in range(16))
+    for row, slots in zip(BITS_TO_NOTE, NOTE_SLOTS)
+]
+
+def prev_index(prev_note):
+    # 未知の音名（壊れた SYNC など）は make_probability_table と同じく C4 扱い
+    return NOTE_INDEX.get(prev_note, DEFAULT_PREV)
+
+@lru_cache(maxsize=4096)
+def nearest_duration_code(dur_ticks):
+    # DURATION_TABLE の並び順で最初に見つかった最近傍を採用（同距離の扱いを従来と揃える）
+    closest = min(DURATION_TABLE.items(), key=lambda kv: abs(kv[1] - dur_ticks))
+    return int(closest[0], 2)
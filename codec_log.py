@@ -0,0 +1,93 @@
+# エンコーダ/デコーダのログ出力
+# レベル: silent < summary（全体情報）< block（SYNC ブロックごと）< note（1 ノートごとの詳細）
+# trace にバイナリストリームを渡すと、block / note のログをテキストではなく固定長レコードで書く。
+# ホットループ側は note_text / note_trace などの真偽値だけを見るので、無効時の整形コストはかからない。
+import os
+import struct
+import sys
+
+SILENT, SUMMARY, BLOCK, NOTE = range(4)
+LEVEL_NAMES = {"silent": SILENT, "summary": SUMMARY, "block": BLOCK, "note": NOTE}
+
+# --- バイナリトレース ---
+TRACE_MAGIC = b"TSTR\x01"
+REC_NOTE = 1
+REC_SYNC = 2
+# kind, step, note, velocity, duration, symbol
+NOTE_RECORD = struct.Struct("<BIBBHB")
+# kind, step, reported_crc (不明なら 0xFFFFFFFF), actual_crc, ok
+SYNC_RECORD = struct.Struct("<BIIIB")
+UNKNOWN_CRC = 0xFFFFFFFF
+TRACE_RECORDS = {REC_NOTE: NOTE_RECORD, REC_SYNC: SYNC_RECORD}
+
+class CodecLog:
+    """header が偽なら trace に TRACE_MAGIC を書かない（書き始めた trace を別の CodecLog で引き継ぐとき用）。"""
+
+    def __init__(self, level=SUMMARY, stream=None, trace=None, header=True):
+        self.level = level
+        # stream 未指定時は書き込み時点の sys.stdout を使う（redirect_stdout で捕捉できるように）
+        self._stream = stream
+        self.trace = trace
+        self.summary_on = level >= SUMMARY
+        self.block_text = level >= BLOCK and trace is None
+        self.note_text = level >= NOTE and trace is None
+        self.block_trace = level >= BLOCK and trace is not None
+        self.note_trace = level >= NOTE and trace is not None
+        if trace is not None and header:
+            trace.write(TRACE_MAGIC)
+
+    @property
+    def stream(self):
+        return self._stream if self._stream is not None else sys.stdout
+
+    def write(self, msg):
+        print(msg, file=self.stream)
+
+    def summary(self, msg):
+        if self.summary_on:
+            self.write(msg)
+
+    def trace_note(self, step, note, velocity, duration, symbol):
+        self.trace.write(NOTE_RECORD.pack(REC_NOTE, step, note, velocity, min(duration, 0xFFFF), symbol))
+
+    def trace_sync(self, step, reported, actual):
+        ok = reported is None or reported == actual
+        step = int(step) if str(step).isdigit() else 0
+        self.trace.write(SYNC_RECORD.pack(REC_SYNC, step, UNKNOWN_CRC if reported is None else reported,
+                                          actual, ok))
+
+SILENT_LOG = CodecLog(SILENT)
+
+def get_log(log):
+    """log 引数を CodecLog に正規化する。None/False は無出力、True は従来の詳細表示（note）、
+    int はレベル、文字列はレベル名。"""
+    if isinstance(log, CodecLog):
+        return log
+    if log is None or log is False:
+        return SILENT_LOG
+    if log is True:
+        return CodecLog(NOTE)
+    if isinstance(log, str):
+        return CodecLog(LEVEL_NAMES[log])
+    return CodecLog(int(log))
+
+def level_from_env(default=NOTE):
+    # 対話スクリプト用: TIMESHIFT_LOG=silent|summary|block|note で出力量を切り替える
+    name = os.environ.get("TIMESHIFT_LOG")
+    return LEVEL_NAMES.get(name, default) if name else default
+
+def read_trace(f):
+    """バイナリトレースを (kind, fields...) のタプルで順に返す。未知のレコード・途中で切れたレコードは ValueError。"""
+    if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+        raise ValueError("not a timeshift trace file")
+    while True:
+        kind = f.read(1)
+        if not kind:
+            return
+        rec = TRACE_RECORDS.get(kind[0])
+        if rec is None:
+            raise ValueError(f"unknown trace record kind: {kind[0]}")
+        body = f.read(rec.size - 1)
+        if len(body) != rec.size - 1:
+            raise ValueError("truncated trace record")
+        yield rec.unpack(kind + body)
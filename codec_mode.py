@@ -0,0 +1,103 @@
+# 符号化モード（1 ノートあたりのビット数）
+# classic: 6bit/ノート = 音高 4bit（16 スロットのマッピング）+ 長さ 2bit（DURATION_TABLE）。
+#          velocity は同じ音に割り当てられたスロットの順位（BASE_VELOCITY + slot）だけを表す。
+# hd     : 音高 4bit はそのままに、velocity に vel_bits、長さに dur_bits を追加で載せる。
+#          velocity = HD_VELOCITY_BASE + extra * MAX_SLOTS + slot（slot は classic と同じ順位）
+#          長さ     = unit * (code + 1)、unit = 960 >> dur_bits（最長は classic と同じ 960 tick）
+#          トラック先頭に MODE:hd<version>:<bits> テキストを置き、デコーダはそれを見て切り替える。
+#          classic ではテキストを書かない（従来のファイルと同一）。
+from functools import lru_cache
+
+from codebook import BASE_VELOCITY, DURATION_TICKS, NOTE_SLOTS, nearest_duration_code
+
+MODE_PREFIX = "MODE:"
+MODE_VERSION = 1
+PITCH_BITS = 4
+CLASSIC_BITS = 6
+MAX_BITS = 14
+# 同じ音に割り当てられるスロット数の最大（velocity の刻み幅）
+MAX_SLOTS = max(len(c) for row in NOTE_SLOTS for c in row)
+HD_VELOCITY_BASE = 8
+HD_MAX_DURATION = 960
+
+class CodecMode:
+    def __init__(self, bits, vel_bits, dur_bits, velocity_base, durations, header_text=None):
+        self.bits = bits
+        self.vel_bits = vel_bits
+        self.dur_bits = dur_bits
+        # 音高より下のビット数（シンボル = pitch << low_bits | extra << dur_bits | dur）
+        self.low_bits = vel_bits + dur_bits
+        self.vel_mask = (1 << vel_bits) - 1
+        self.dur_mask = (1 << dur_bits) - 1
+        self.velocity_base = velocity_base
+        self.vel_stride = MAX_SLOTS if vel_bits else 0
+        self.durations = tuple(durations)
+        self.duration_set = frozenset(self.durations)
+        self.header_text = header_text
+        if velocity_base + (self.vel_mask + 1) * max(1, self.vel_stride) - 1 > 127:
+            raise ValueError(f"velocity range exceeds 127 for {bits} bits/note")
+
+    @property
+    def name(self):
+        return "classic" if self.header_text is None else f"hd{MODE_VERSION}:{self.bits}"
+
+    def velocity(self, slot_index, extra):
+        return self.velocity_base + extra * self.vel_stride + slot_index
+
+    def velocity_extra(self, velocity):
+        """velocity に載せた追加ビット（classic では常に 0）。"""
+        if not self.vel_bits:
+            return 0
+        off = velocity - self.velocity_base
+        return (off // self.vel_stride) & self.vel_mask if off > 0 else 0
+
+    def slot_from_velocity(self, velocity):
+        # 同じ音の候補内での順位（候補数での剰余は呼び出し側で取る）
+        off = velocity - self.velocity_base
+        if off < 0:
+            off = 0
+        return off % self.vel_stride if self.vel_bits else off
+
+    def nearest_duration_code(self, dur_ticks):
+        return _hd_nearest(self.durations, dur_ticks)
+
+class _ClassicMode(CodecMode):
+    def nearest_duration_code(self, dur_ticks):
+        # DURATION_TABLE の同距離時の扱いを従来と揃える
+        return nearest_duration_code(dur_ticks)
+
+@lru_cache(maxsize=8192)
+def _hd_nearest(durations, dur_ticks):
+    unit = durations[0]
+    code = (dur_ticks + unit // 2) // unit - 1
+    return min(max(code, 0), len(durations) - 1)
+
+CLASSIC = _ClassicMode(CLASSIC_BITS, 0, 2, BASE_VELOCITY, DURATION_TICKS)
+
+def split_bits(bits):
+    """bits/ノートを (vel_bits, dur_bits) に振り分ける。velocity は最大 4bit、長さは 2bit 以上。"""
+    extra = bits - PITCH_BITS
+    vel_bits = min(4, extra // 2)
+    return vel_bits, extra - vel_bits
+
+@lru_cache(maxsize=None)
+def get_mode(bits_per_note=CLASSIC_BITS):
+    """bits/ノートに対応する CodecMode。6 は classic、7〜14 は hd。"""
+    if bits_per_note == CLASSIC_BITS:
+        return CLASSIC
+    if not CLASSIC_BITS < bits_per_note <= MAX_BITS:
+        raise ValueError(f"bits_per_note must be {CLASSIC_BITS}..{MAX_BITS}: {bits_per_note}")
+    vel_bits, dur_bits = split_bits(bits_per_note)
+    unit = HD_MAX_DURATION >> dur_bits
+    durations = [unit * (c + 1) for c in range(1 << dur_bits)]
+    return CodecMode(bits_per_note, vel_bits, dur_bits, HD_VELOCITY_BASE, durations,
+                     header_text=f"{MODE_PREFIX}hd{MODE_VERSION}:{bits_per_note}")
+
+def mode_from_text(text):
+    """トラック先頭の MODE テキストから CodecMode を得る。テキストが無ければ classic。"""
+    if text is None:
+        return CLASSIC
+    parts = text.split(":")
+    if len(parts) != 3 or parts[1] != f"hd{MODE_VERSION}" or not parts[2].isdigit():
+        raise ValueError(f"unsupported codec mode: {text!r}")
+    return get_mode(int(parts[2]))
@@ -0,0 +1,303 @@
+# NumPy による一括エンコード/デコード（任意。numpy が無ければ純 Python の経路のまま）
+# 1 ノートごとの処理をシンボル列全体に対する配列演算に置き換える。出力は純 Python 経路とバイト単位で同一。
+#   prev_note の連鎖: prev は 11 状態しかないので「状態 x 入力 -> 次の状態」の表を引く漸化式になる。
+#     長さ B のブロックごとに 11 状態すべてから表を B 回引いてブロック全体の写像を作り、
+#     ブロック先頭の状態だけを順に繋いでから、各位置の状態を B 回の表引きで埋める（配列演算は約 2√n 回）。
+#   SYNC の CRC: ブロックを行にした行列をビット展開 -> packbits し、CRC 表を列ごとに全行まとめて引く。
+# backend(n) は numpy が使えて入力が大きいときだけこのモジュールを返す。
+# TIMESHIFT_NUMPY=0 で無効、=1 で入力の大きさによらず使う（既定は MIN_SYMBOLS 以上で使う）。
+import os
+import sys
+import zlib
+from array import array
+
+from codebook import BITS_TO_NOTE, KEYFRAME_DURATION_SHIFT, KEYFRAME_INTERVAL, NOTE_MIDI, NOTE_NAMES, NOTE_SLOTS, SLOT_OFFSET
+from bitpack import SymbolBuffer
+from checksum import CRC8_TABLE, CRC16_TABLE
+from sync_marker import format_sync, parse_sync
+from codec_stats import clock
+
+np = None
+MIN_SYMBOLS = 4096
+# CRC・ビット展開を行う 1 回あたりの行数（一時配列の大きさを抑える）
+CHUNK_ROWS = 1 << 15
+
+def backend(n_symbols):
+    """n_symbols 個を処理するのに NumPy 経路を使うならこのモジュール、使わないなら None。"""
+    global np
+    value = os.environ.get("TIMESHIFT_NUMPY", "")
+    if value in ("0", "off", "no") or (value != "1" and n_symbols < MIN_SYMBOLS):
+        return None
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+        _build_tables()
+    return sys.modules[__name__]
+
+_T = {}
+
+def _build_tables():
+    n = len(NOTE_NAMES)
+    slots = max(len(c) for row in NOTE_SLOTS for c in row)
+    slot_syms = np.zeros((n, n, slots), np.int64)
+    slot_count = np.zeros((n, n), np.int64)
+    for p in range(n):
+        for q in range(n):
+            c = NOTE_SLOTS[p][q]
+            slot_count[p, q] = len(c)
+            slot_syms[p, q, :len(c)] = c
+    has = slot_count > 0
+    _T.update(
+        bits_to_note=np.array(BITS_TO_NOTE, np.int64),
+        slot_offset=np.array(SLOT_OFFSET, np.int64),
+        note_midi=np.array(NOTE_MIDI, np.int64),
+        midi_to_index=np.array([NOTE_MIDI.index(m) if m in NOTE_MIDI else -1 for m in range(256)], np.int64),
+        slot_syms=slot_syms,
+        slot_count=np.maximum(slot_count, 1),
+        # 復号側の状態遷移: 候補の無い音は読み飛ばされ prev は変わらない
+        accept=has,
+        dec_next=np.where(has, np.arange(n)[None, :], np.arange(n)[:, None]),
+        crc8=np.array(CRC8_TABLE, np.uint8),
+        crc16=np.array(CRC16_TABLE, np.uint32),
+    )
+
+# --- 共通部品 ---
+def _scan(table, inputs, start):
+    """state[i+1] = table[state[i], inputs[i]] の各 i での state[i]（入力前の状態）と最終状態を返す。"""
+    n = len(inputs)
+    if n == 0:
+        return np.zeros(0, np.int64), start
+    n_states = table.shape[0]
+    width = max(16, int(n ** 0.5))
+    blocks = -(-n // width)
+    x = np.zeros(blocks * width, np.int64)
+    x[:n] = inputs
+    x = x.reshape(blocks, width)
+    # maps[b, s]: ブロック b に状態 s で入ったときの出口の状態
+    maps = np.broadcast_to(np.arange(n_states), (blocks, n_states)).copy()
+    for j in range(width):
+        maps = table[maps, x[:, j:j + 1]]
+    starts = np.empty(blocks, np.int64)
+    s = start
+    for b, row in enumerate(maps.tolist()):
+        starts[b] = s
+        s = row[s]
+    states = np.empty((blocks, width), np.int64)
+    cur = starts
+    for j in range(width):
+        states[:, j] = cur
+        cur = table[cur, x[:, j]]
+    states = states.reshape(-1)[:n]
+    return states, int(table[states[-1], inputs[-1]])
+
+def _unpack_bits(syms, bits):
+    # (..., L) のシンボルを (..., L * bits) の 0/1 に展開する（上位ビットから）
+    shifts = np.arange(bits - 1, -1, -1, dtype=np.int64)
+    out = (syms[..., None].astype(np.int64) >> shifts) & 1
+    return out.astype(np.uint8).reshape(*syms.shape[:-1], syms.shape[-1] * bits)
+
+def pack_symbols(syms, bits):
+    """シンボル列をビット列に詰めたバイト列（bitpack.symbols_to_bytes と同じ。末尾はゼロ埋め）。"""
+    step = 8 * CHUNK_ROWS
+    out = bytearray()
+    for i in range(0, len(syms), step):
+        # 8 シンボル = bits バイトなので、途中のチャンクの境界でビットがずれない
+        out += np.packbits(_unpack_bits(syms[i:i + step][None, :], bits)[0]).tobytes()
+    return bytes(out)
+
+def block_crcs(rows, bits, algo):
+    """rows（(m, L) のシンボル行列）の各行を symbols_to_bytes したものの CRC のリスト。"""
+    out = []
+    for i in range(0, len(rows), CHUNK_ROWS):
+        packed = np.packbits(_unpack_bits(rows[i:i + CHUNK_ROWS], bits), axis=1)
+        if algo == "crc8":
+            table = _T["crc8"]
+            crc = np.zeros(len(packed), np.uint8)
+            for k in range(packed.shape[1]):
+                crc = table[crc ^ packed[:, k]]
+        elif algo == "crc16":
+            table = _T["crc16"]
+            crc = np.full(len(packed), 0xFFFF, np.uint32)
+            for k in range(packed.shape[1]):
+                crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ packed[:, k]]
+        else:
+            data = packed.tobytes()
+            w = packed.shape[1]
+            crc = [zlib.crc32(data[r * w:(r + 1) * w]) & 0xFFFFFFFF for r in range(len(packed))]
+        out.extend(crc.tolist() if hasattr(crc, "tolist") else crc)
+    return out
+
+def bytes_to_symbols(data, bits):
+    """bitpack.bytes_to_symbols と同じ（6bit なら bytes、それ以外は array('H')）。"""
+    n = (len(data) * 8 + bits - 1) // bits
+    flat = np.zeros(n * bits, np.uint8)
+    flat[:len(data) * 8] = np.unpackbits(np.frombuffer(bytes(data), np.uint8))
+    weights = 1 << np.arange(bits - 1, -1, -1, dtype=np.int64)
+    syms = flat.reshape(n, bits) @ weights
+    if bits == 6:
+        return syms.astype(np.uint8).tobytes()
+    return array('H', syms.astype(np.uint16).tobytes())
+
+def _as_array(symbols):
+    if isinstance(symbols, array):
+        return np.frombuffer(symbols, np.uint16).astype(np.int64)
+    return np.frombuffer(bytes(symbols), np.uint8).astype(np.int64)
+
+# --- エンコード ---
+def encode_into(enc, symbols):
+    """TimeshiftEncoder.feed と同じ結果を enc の EventStore にまとめて書く（enc.can_bulk() のときだけ呼ぶ）。"""
+    store = enc.store
+    mode = enc.mode
+    checksum_algo = enc.checksum_algo
+    stats = enc.stats
+    timing = stats.on
+    t0 = clock() if timing else 0.0
+    syms = _as_array(symbols)
+    n = len(syms)
+    if n == 0:
+        return
+    sym4 = syms >> mode.low_bits
+    prev, last = _scan(_T["bits_to_note"], sym4, enc.prev)
+    note_idx = _T["bits_to_note"][prev, sym4]
+    velocity = (mode.velocity_base + ((syms >> mode.dur_bits) & mode.vel_mask) * mode.vel_stride
+                + _T["slot_offset"][prev, sym4])
+    np.minimum(velocity, 127, out=velocity)
+    off_time = np.array(mode.durations, np.int64)[syms & mode.dur_mask]
+    n_blocks = n // KEYFRAME_INTERVAL
+    ends = np.arange(1, n_blocks + 1, dtype=np.int64) * KEYFRAME_INTERVAL - 1
+    off_time[ends] += KEYFRAME_DURATION_SHIFT
+    if timing:
+        t1 = clock()
+        stats.add_time("lookup", t1 - t0)
+
+    crcs = block_crcs(syms[:n_blocks * KEYFRAME_INTERVAL].reshape(n_blocks, KEYFRAME_INTERVAL), mode.bits,
+                      checksum_algo)
+    first_step = enc.step + 1
+    if enc.sync_offsets:
+        bits = mode.bits
+        texts = [format_sync(first_step + e, NOTE_NAMES[q], crc, checksum_algo, off=(first_step + e) * bits)
+                 for e, q, crc in zip(ends.tolist(), note_idx[ends].tolist(), crcs)]
+    else:
+        texts = [format_sync(first_step + e, NOTE_NAMES[q], crc, checksum_algo)
+                 for e, q, crc in zip(ends.tolist(), note_idx[ends].tolist(), crcs)]
+    if timing:
+        t2 = clock()
+        stats.add_time("crc", t2 - t1)
+
+    # ノート行と、各ブロックの最後のノートの直後に SYNC テキスト行を並べる
+    rows = n + n_blocks
+    is_end = np.zeros(n, np.int64)
+    is_end[ends] = 1
+    note_rows = np.arange(n, dtype=np.int64) + np.cumsum(is_end) - is_end
+    text_rows = ends + np.arange(1, n_blocks + 1, dtype=np.int64)
+    end_tick = np.cumsum(off_time) + store.tick
+    abs_tick = np.empty(rows, np.int64)
+    abs_tick[note_rows] = end_tick - off_time
+    abs_tick[text_rows] = end_tick[ends]
+    kind = np.zeros(rows, np.uint8)
+    kind[text_rows] = 1
+    pitch = np.zeros(rows, np.uint8)
+    pitch[note_rows] = _T["note_midi"][note_idx]
+    vel = np.zeros(rows, np.uint8)
+    vel[note_rows] = velocity
+    duration = np.zeros(rows, np.int64)
+    duration[note_rows] = off_time
+    text_ref = np.full(rows, -1, np.int64)
+    text_ref[text_rows] = np.arange(n_blocks, dtype=np.int64) + len(store.texts)
+    store.extend_rows(abs_tick.astype(np.dtype(store.abs_tick.typecode)).tobytes(), kind.tobytes(), pitch.tobytes(),
+                      vel.tobytes(), duration.astype(np.dtype(store.duration.typecode)).tobytes(),
+                      text_ref.astype(np.dtype(store.text_ref.typecode)).tobytes(), texts, int(end_tick[-1]))
+
+    # エンコーダの状態を純 Python 経路で feed した後と同じにする
+    rest = syms[n_blocks * KEYFRAME_INTERVAL:].tolist()
+    enc.block_syms.extend(rest)
+    enc.notes_since_keyframe = len(rest)
+    enc.prev = last
+    enc.step += n
+    if timing:
+        stats.add_time("events", clock() - t2)
+        stats.add("notes", n)
+        stats.add("sync_blocks", n_blocks)
+    if enc.on_sync is not None:
+        for e, crc in zip(ends.tolist(), crcs):
+            enc.on_sync(first_step + e, crc)
+
+# --- デコード ---
+def decode_into(dec, index):
+    """feed_index と同じく NoteIndex の全ノートを dec に渡す（dec.can_bulk() のときだけ呼ぶ）。"""
+    mode = dec.mode
+    n = len(index)
+    if n == 0:
+        return
+    note = np.frombuffer(index.note, np.uint8).astype(np.int64)
+    velocity = np.frombuffer(index.velocity, np.uint8).astype(np.int64)
+    on_tick = np.frombuffer(index.on_tick, np.int64)
+    off_tick = np.frombuffer(index.off_tick, np.int64)
+    sync = np.frombuffer(index.sync, np.dtype(index.sync.typecode)).astype(np.int64)
+    # 対応する note_off が無いノートは duration 0
+    dur = np.where(off_tick >= 0, off_tick - on_tick, 0)
+
+    # 音階外の音と、prev の状態で候補の無い音は読み飛ばす（prev もステップも進まない）
+    note_idx = _T["midi_to_index"][note]
+    keep = note_idx >= 0
+    note_idx, velocity, dur, sync = note_idx[keep], velocity[keep], dur[keep], sync[keep]
+    prev, _ = _scan(_T["dec_next"], note_idx, dec.prev)
+    keep = _T["accept"][prev, note_idx]
+    note_idx, velocity, dur, sync, prev = note_idx[keep], velocity[keep], dur[keep], sync[keep], prev[keep]
+    n = len(note_idx)
+    if n == 0:
+        return
+
+    if mode.vel_bits:
+        off = velocity - mode.velocity_base
+        slot = np.maximum(off, 0) % mode.vel_stride
+        extra = np.where(off > 0, (off // mode.vel_stride) & mode.vel_mask, 0)
+    else:
+        slot = np.maximum(velocity - mode.velocity_base, 0)
+        extra = None
+    sym4 = _T["slot_syms"][prev, note_idx, slot % _T["slot_count"][prev, note_idx]]
+    durations = np.array(mode.durations, np.int64)
+    if mode.vel_bits:
+        unit = mode.durations[0]
+        dur_code = np.clip((dur + unit // 2) // unit - 1, 0, len(durations) - 1)
+    else:
+        # 同距離なら DURATION_TABLE の並びで先のもの（argmin は最初の最小値を返す）
+        dur_code = np.argmin(np.abs(dur[:, None] - durations[None, :]), axis=1)
+    full = (sym4 << mode.low_bits) | dur_code
+    if extra is not None:
+        full |= extra << mode.dur_bits
+
+    # SYNC: SYNC テキストが紐づき、長さが正規の長さ + KEYFRAME_DURATION_SHIFT のノートでブロックを閉じる
+    ends = np.nonzero((sync >= 0) & np.isin(dur - KEYFRAME_DURATION_SHIFT, durations))[0]
+    starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64)
+    markers = [parse_sync(index.sync_texts[k]) for k in sync[ends].tolist()]
+    timing = dec._timing
+    t0 = clock() if timing else 0.0
+    # 長さと CRC 方式が同じブロックごとにまとめて計算する（正常なファイルならほぼ全部が 1 組）
+    groups = {}
+    for i, (m, length) in enumerate(zip(markers, (ends - starts + 1).tolist())):
+        if m is not None:
+            groups.setdefault((m.algo if m.crc_known else "crc8", length), []).append(i)
+    actual = [None] * len(ends)
+    for (algo, length), sel in groups.items():
+        rows = full[starts[sel][:, None] + np.arange(length)]
+        for i, crc in zip(sel, block_crcs(rows, mode.bits, algo)):
+            actual[i] = crc
+    if timing:
+        dec.crc_time += clock() - t0
+    for m, act in zip(markers, actual):
+        if m is not None:
+            dec.on_sync(m.step, m.crc if m.crc_known else None, act)
+
+    writer = dec.writer
+    if isinstance(writer, SymbolBuffer):
+        writer.syms.frombytes(full.astype(np.uint16).tobytes())
+    else:
+        writer.extend_packed(pack_symbols(full, mode.bits), n)
+    tail = int(ends[-1]) + 1 if len(ends) else 0
+    dec.block_syms.extend(full[tail:].tolist())
+    dec.prev = int(note_idx[-1])
+    dec.step += n
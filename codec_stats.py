@@ -0,0 +1,193 @@
+# エンコーダ/デコーダの計測（段階ごとの時間とカウンタ）と JSON レポート
+# 段階: read（入力読み込み）/ compress / pack（ビット詰め）/ lookup（コードブック参照）/ events（イベント構築）/
+#       crc（SYNC の CRC 計算・検証）/ write（SMF 書き出し）/ parse（SMF 読み込み）/ pair（ノート対応付け）/
+#       unpack（シンボル -> バイト列・枠の除去）/ utf8（UTF-8 デコード）
+# 無効時は NULL_STATS（on = False）を渡す。ホットループ側は stats.on だけを見て、計測はブロック単位か
+# ループの外でしか行わないので、無効時のコストはほぼかからない。
+# profile=True で cProfile、memory=True で tracemalloc のピークと上位の確保箇所をレポートに含める
+# （cProfile / tracemalloc は使うときだけ import する）。
+import io
+import json
+import os
+import time
+from contextlib import nullcontext
+
+from midi_shared import ARTIFACTS_DIR, ensure_dir
+
+PROFILE_TOP = 30
+MEMORY_TOP = 15
+
+clock = time.perf_counter
+
+class CodecStats:
+    on = True
+
+    def __init__(self, profile=False, memory=False):
+        self.timers = {}
+        self.counters = {}
+        self.profile = profile
+        self.memory = memory
+        self._profiler = None
+        self._profile_text = None
+        self._memory_report = None
+        self._t0 = None
+        self.wall = None
+
+    def add(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name, seconds):
+        self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+    def time_of(self, name):
+        return self.timers.get(name, 0.0)
+
+    def stage(self, name):
+        """with stats.stage("pack"): ... の区間の時間を name に積む。返り値は繰り返し使える。"""
+        return _Stage(self, name)
+
+    # --- cProfile / tracemalloc を含む全体の計測 ---
+    def start(self):
+        import cProfile
+        import tracemalloc
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._t0 = clock()
+        return self
+
+    def stop(self):
+        import pstats
+        import tracemalloc
+        if self._t0 is not None:
+            self.wall = clock() - self._t0
+            self._t0 = None
+        if self._profiler is not None:
+            self._profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(self._profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            self._profile_text = out.getvalue()
+            self._profiler = None
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:MEMORY_TOP]
+            tracemalloc.stop()
+            self._memory_report = {
+                "current_mb": round(current / (1024 * 1024), 3),
+                "peak_mb": round(peak / (1024 * 1024), 3),
+                "top": [{"where": str(s.traceback[0]), "size_kb": round(s.size / 1024, 1), "count": s.count}
+                        for s in top],
+            }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def report(self, **extra):
+        import platform
+        rep = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "wall_s": None if self.wall is None else round(self.wall, 6),
+            "timers_s": {k: round(v, 6) for k, v in self.timers.items()},
+            "counters": dict(self.counters),
+        }
+        notes = self.counters.get("notes")
+        busy = sum(self.timers.values())
+        if notes and busy:
+            rep["notes_per_s"] = round(notes / busy, 1)
+        if self._memory_report is not None:
+            rep["tracemalloc"] = self._memory_report
+        if self._profile_text is not None:
+            rep["profile"] = self._profile_text
+        rep.update(extra)
+        return rep
+
+    def save(self, name, out_dir=ARTIFACTS_DIR, **extra):
+        """レポートを <out_dir>/<name>_stats.json に書き、そのパスを返す。"""
+        path = os.path.join(str(ensure_dir(out_dir)), f"{name}_stats.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(**extra), f, ensure_ascii=False, indent=1)
+        return path
+
+class _Stage:
+    __slots__ = ("stats", "name", "t0")
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.t0 = None
+
+    def __enter__(self):
+        self.t0 = clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.name, clock() - self.t0)
+        return False
+
+class _NullStats:
+    on = False
+    timers = {}
+    counters = {}
+
+    def add(self, name, n=1):
+        pass
+
+    def add_time(self, name, seconds):
+        pass
+
+    def time_of(self, name):
+        return 0.0
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+_NULL_STAGE = nullcontext()
+NULL_STATS = _NullStats()
+
+def get_stats(stats):
+    """stats 引数を正規化する。None/False は計測なし、True は CodecStats()。"""
+    if stats is None or stats is False:
+        return NULL_STATS
+    if stats is True:
+        return CodecStats()
+    return stats
+
+def stats_from_env():
+    # 対話スクリプト用: TIMESHIFT_STATS=1 で計測、profile / memory を , 区切りで加えると cProfile / tracemalloc も取る
+    value = os.environ.get("TIMESHIFT_STATS", "")
+    if not value or value in ("0", "off"):
+        return NULL_STATS
+    opts = {v.strip() for v in value.split(",")}
+    return CodecStats(profile="profile" in opts, memory="memory" in opts)
+
+class TimedSink:
+    """sink への書き込み（イベント構築）の時間を stats の events に積む。計測有効時だけ挟む。"""
+
+    def __init__(self, sink, stats, name="events"):
+        self.sink = sink
+        self.stats = stats
+        self.name = name
+        self.elapsed = 0.0
+
+    def note(self, note_num, velocity, duration):
+        t0 = clock()
+        self.sink.note(note_num, velocity, duration)
+        self.elapsed += clock() - t0
+
+    def text(self, text):
+        t0 = clock()
+        self.sink.text(text)
+        self.elapsed += clock() - t0
+
+    def flush(self):
+        # 積んだ時間を stats に移す（feed の終わりに呼ぶ）
+        elapsed, self.elapsed = self.elapsed, 0.0
+        self.stats.add_time(self.name, elapsed)
+        return elapsed
@@ -0,0 +1,80 @@
+# ペイロードの圧縮（標準ライブラリの zlib / lzma / bz2）
+# 圧縮したときは framing の長さヘッダに COMPRESSED_FLAG を立て、直後の 1 バイトに方式 ID を置く。
+# "auto" は全方式を試して最も短くなるものを選び、圧縮しない方が短ければ圧縮しない。
+import bz2
+import lzma
+import zlib
+
+NONE = 0
+ZLIB = 1
+LZMA = 2
+BZ2 = 3
+
+# 生の LZMA2 ストリーム（.xz コンテナのヘッダ分を節約する）
+_LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 9 | lzma.PRESET_EXTREME}]
+
+CODECS = {
+    "zlib": (ZLIB, lambda d: zlib.compress(d, 9), zlib.decompressobj),
+    "lzma": (LZMA, lambda d: lzma.compress(d, format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS),
+             lambda: lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS)),
+    "bz2": (BZ2, lambda d: bz2.compress(d, 9), bz2.BZ2Decompressor),
+}
+CODEC_NAMES = {NONE: "none"}
+CODEC_NAMES.update({cid: name for name, (cid, _, _) in CODECS.items()})
+METHODS = ["none", "auto"] + list(CODECS)
+
+def compress_payload(data, method="auto"):
+    """data を method で圧縮して (方式 ID, バイト列) を返す。None / "none" は圧縮しない。
+    "auto" では方式 ID の 1 バイトも含めて最短のものを選ぶ。"""
+    if method is None or method == "none":
+        return NONE, data
+    if method != "auto":
+        cid, compress, _ = CODECS[method]
+        return cid, compress(data)
+    best_id, best = NONE, data
+    for cid, compress, _ in CODECS.values():
+        out = compress(data)
+        # 圧縮時は方式 ID の 1 バイトが増える
+        if len(out) + 1 < len(best) + (best_id != NONE):
+            best_id, best = cid, out
+    return best_id, best
+
+class Decompressor:
+    """逐次伸長。壊れたデータでは、そこまでに伸長できた分だけを返して以降は捨てる。
+    入力を PIECE バイト単位（位置は先頭から固定）で処理するので、feed の区切り方によらず結果は同じ。"""
+
+    PIECE = 64
+
+    def __init__(self, codec_id):
+        self.codec_id = codec_id
+        factory = {cid: make for cid, _, make in CODECS.values()}.get(codec_id)
+        # 未知の方式 ID（ヘッダの破損など）は伸長せずにそのまま返す
+        self._obj = factory() if factory is not None else None
+        self._pending = b""
+        self.error = False
+
+    def _run(self, piece):
+        if self._obj is None:
+            return piece
+        if self.error or getattr(self._obj, "eof", False):
+            return b""
+        try:
+            return self._obj.decompress(piece)
+        except (zlib.error, lzma.LZMAError, OSError, EOFError, ValueError):
+            self.error = True
+            return b""
+
+    def feed(self, data):
+        data = self._pending + data
+        cut = len(data) - len(data) % self.PIECE
+        self._pending = data[cut:]
+        return b"".join(self._run(data[i:i + self.PIECE]) for i in range(0, cut, self.PIECE))
+
+    def flush(self):
+        out = self._run(self._pending) if self._pending else b""
+        self._pending = b""
+        return out
+
+def decompress(codec_id, data):
+    d = Decompressor(codec_id)
+    return d.feed(data) + d.flush()
@@ -1,158 +1,86 @@
-from mido import MidiFile
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from array import array
+from typing import List, Optional, Tuple
 import os
 import sys
 
-# --- 設定（エンコードと一致させること） ---
-NOTE_NAMES = ["G3", "A3", "B3", "C4", "D4", "E4", "F4", "G4", "A4", "B4", "C5"]
-NOTE_TO_MIDI = {
-    "G3": 55, "A3": 57, "B3": 59,
-    "C4": 60, "D4": 62, "E4": 64, "F4": 65,
-    "G4": 67, "A4": 69, "B4": 71, "C5": 72
-}
-MIDI_TO_NOTE = {v: k for k, v in NOTE_TO_MIDI.items()}
-
-RELATIVE_WEIGHTS = [1, 2, 3, 3, 3, 2, 1, 1]  # -3..+4
-
-DURATION_TABLE = {
-    "00": 480,   # 4分音符
-    "01": 240,   # 8分音符
-    "10": 960,   # 2分音符
-    "11": 720    # 付点4分音符
-}
-
-# キーフレーム関連（エンコーダと一致）
-KEYFRAME_INTERVAL = 20
-BASE_VELOCITY = 80
-# timeshift エンコーダで使ったフレーズと shift
-KEYFRAME_PHRASE = [
-    ("D4", 240),
-    ("E4", 240),
-    ("A4", 240),
-    ("A3", 240)
-]
-# エンコーダでの微小ずらし量（ticks）
-KEYFRAME_DURATION_SHIFT = 1
+# --- 設定（エンコーダと共通の codebook から取り込む） ---
+from codebook import (
+    NOTE_NAMES, NOTE_TO_MIDI,
+    KEYFRAME_INTERVAL, BASE_VELOCITY, KEYFRAME_PHRASE, KEYFRAME_DURATION_SHIFT,
+    DEFAULT_PREV, MIDI_TO_INDEX, NOTE_INDEX, NOTE_SLOTS,
+)
+from bitpack import SYMBOL_BITS, SymbolBuffer, SymbolWriter, symbols_to_bytes
+from note_index import NoteIndexBuilder, NoteStream, build_note_index, feed_messages
+from checksum import checksum, hex_digits
+from sync_marker import parse_sync
+from framing import LENGTH_HEADER_SIZE, StreamUnframer, is_compressed, parse_end, unframe
+from smf_stream import iter_events, iter_track, open_smf, track_ranges
+from codec_log import get_log, level_from_env
+from codec_mode import CLASSIC, mode_from_text
+from stripes import interleave, stripe_marker
+from codec_stats import clock, get_stats, stats_from_env
+from event_store import TEXT
+from archive import reject_archive, reject_archive_texts
+import codec_numpy
 
 # --- ヘルパ ---
-def make_probability_table(prev_note):
-    if prev_note not in NOTE_NAMES:
-        prev_note = "C4"
-    center_index = NOTE_NAMES.index(prev_note)
-    prob_table = {}
-    for offset, weight in enumerate(RELATIVE_WEIGHTS):
-        rel_idx = offset - 3
-        target_index = center_index + rel_idx
-        if 0 <= target_index < len(NOTE_NAMES):
-            note = NOTE_NAMES[target_index]
-            prob_table[note] = prob_table.get(note, 0) + weight
-    total = sum(prob_table.values()) or 1
-    for k in list(prob_table.keys()):
-        prob_table[k] = prob_table[k] / total
-    return prob_table
-
-def make_mapping_from_prob_table(prob_table):
-    notes = []
-    for note in NOTE_NAMES:
-        prob = prob_table.get(note, 0)
-        if prob <= 0:
-            continue
-        count = max(1, round(prob * 16))
-        notes.extend([note] * count)
-    while len(notes) < 16:
-        notes.append(list(prob_table.keys())[len(prob_table)//2])
-    notes = notes[:16]
-    return {format(i, '04b'): notes[i] for i in range(16)}
-
-def select_slot_from_velocity(note_name, mapping, velocity):
-    candidates = [bits for bits, n in mapping.items() if n == note_name]
-    candidates.sort(key=lambda x: int(x, 2))
+def select_slot_from_velocity(prev, note_idx, velocity, mode=CLASSIC):
+    # prev の状態で note_idx に割り当てられた 4bit シンボルのうち velocity が指すもの
+    candidates = NOTE_SLOTS[prev][note_idx]
     if not candidates:
         return None
-    vel_index = velocity - BASE_VELOCITY
+    vel_index = velocity - BASE_VELOCITY if mode is CLASSIC else mode.slot_from_velocity(velocity)
     if vel_index < 0:
         vel_index = 0
-    idx = vel_index % len(candidates)
-    return candidates[idx]
-
-def crc8_bits(bitstr):
-    if len(bitstr) % 8 != 0:
-        bitstr = bitstr + '0' * (8 - (len(bitstr) % 8))
-    data = [int(bitstr[i:i+8], 2) for i in range(0, len(bitstr), 8)]
-    crc = 0
-    for b in data:
-        crc ^= b
-        for _ in range(8):
-            if crc & 0x80:
-                crc = ((crc << 1) & 0xFF) ^ 0x07
-            else:
-                crc = (crc << 1) & 0xFF
-    return crc
-
-# find paired note_off index and compute duration_ticks
-def find_note_duration_and_off_index(all_msgs, start_idx):
-    msg_len = len(all_msgs)
-    accum = 0
-    note_num = getattr(all_msgs[start_idx], "note", None)
-    for j in range(start_idx + 1, msg_len):
-        m = all_msgs[j]
-        accum += getattr(m, "time", 0)
-        if (getattr(m, "type", None) == "note_off" and getattr(m, "note", None) == note_num) or \
-           (getattr(m, "type", None) == "note_on" and getattr(m, "velocity", 0) == 0 and getattr(m, "note", None) == note_num):
-            return accum, j
-    return None, None
+    return candidates[vel_index % len(candidates)]
 
 # キーフレーズ（timeshift考慮）検出
-def find_keyframe_block(all_msgs, start_idx):
+def find_keyframe_block(index, start_note):
     """
-    start_idx に note_on があり、そこから KEYFRAME_PHRASE と同じノート列が連続して存在し、
+    NoteIndex の start_note 番目から KEYFRAME_PHRASE と同じノート列が連続して存在し、
     各ノートの duration が expected または expected+KEYFRAME_DURATION_SHIFT のいずれかに一致し、
-    その直後に SYNC テキストがあれば (set_of_indices_to_skip, sync_index, reported_sync_text) を返す。
+    その直後に SYNC テキストがあれば (set_of_note_indices, sync_msg_index, reported_sync_text) を返す。
     """
     if not KEYFRAME_PHRASE:
         return None
-    msg_len = len(all_msgs)
-    needed = [NOTE_TO_MIDI[n] for n, _ in KEYFRAME_PHRASE]
-    found_note_on_idxs = []
-    i = start_idx
-    # collect next note_on events (allow intervening non-text messages like delta-time/note_off, but require ordering)
-    while i < msg_len and len(found_note_on_idxs) < len(needed):
-        m = all_msgs[i]
-        if getattr(m, "type", None) == "note_on" and getattr(m, "velocity", 0) > 0:
-            found_note_on_idxs.append(i)
-        elif getattr(m, "type", None) == "text":
-            # stray text before finishing -> abort
-            return None
-        i += 1
-    if len(found_note_on_idxs) != len(needed):
+    needed = len(KEYFRAME_PHRASE)
+    if start_note + needed > len(index):
         return None
-    # check note numbers match expected order
-    for idx, expect in zip(found_note_on_idxs, needed):
-        if getattr(all_msgs[idx], "note", None) != expect:
+    notes = range(start_note, start_note + needed)
+    # stray text before finishing -> abort
+    first_on, last_on = index.on_msg[notes[0]], index.on_msg[notes[-1]]
+    lo = bisect_left(index.text_msgs, first_on)
+    if lo < len(index.text_msgs) and index.text_msgs[lo] < last_on:
+        return None
+    for i, (phrase_note, phrase_dur) in zip(notes, KEYFRAME_PHRASE):
+        # check note numbers match expected order
+        if index.note[i] != NOTE_TO_MIDI[phrase_note]:
             return None
-    # for each found note, verify duration equals expected or expected+shift (allow tolerance 0)
-    off_indices = []
-    durations_ok = True
-    for on_idx, (phrase_note, phrase_dur) in zip(found_note_on_idxs, KEYFRAME_PHRASE):
-        dur_ticks, off_idx = find_note_duration_and_off_index(all_msgs, on_idx)
-        if off_idx is None:
-            durations_ok = False
-            break
         # allow exact match to phrase_dur or phrase_dur + KEYFRAME_DURATION_SHIFT
-        if not (dur_ticks == phrase_dur or dur_ticks == phrase_dur + KEYFRAME_DURATION_SHIFT):
-            durations_ok = False
-            break
-        off_indices.append(off_idx)
-    if not durations_ok:
+        dur_ticks = index.duration(i)
+        if dur_ticks is None or not (dur_ticks == phrase_dur or dur_ticks == phrase_dur + KEYFRAME_DURATION_SHIFT):
+            return None
+    # SYNC text soon after the last note_off
+    k = index.sync[notes[-1]]
+    if k < 0:
         return None
-    last_off = off_indices[-1] if off_indices else found_note_on_idxs[-1]
-    # find SYNC text soon after last_off
-    for j in range(last_off + 1, min(last_off + 1 + 64, msg_len)):
-        m = all_msgs[j]
-        if getattr(m, "type", None) == "text" and isinstance(getattr(m, "text", None), str) and m.text.startswith("SYNC:"):
-            # return set of indices to skip (all involved note_on and their offs) and sync index and sync text
-            skip_set = set(found_note_on_idxs) | set(off_indices)
-            return skip_set, j, m.text
-    return None
+    return set(notes), index.sync_msgs[k], index.sync_texts[k]
+
+# resync 復号で信用する位置ずれの上限（シンボル数）。これより大きくずれた SYNC は壊れたテキストとみなす
+MAX_RESYNC_GAP = KEYFRAME_INTERVAL * 4
+
+def erasure_bytes(ranges, bits):
+    """シンボル位置の範囲 [(start, end)] を復元バイト列上のバイト範囲にし、重なり・隣接をまとめる。"""
+    out = []
+    for a, b in sorted(ranges):
+        start, end = a * bits // 8, (b * bits + 7) // 8
+        if out and start <= out[-1][1]:
+            out[-1] = (out[-1][0], max(out[-1][1], end))
+        else:
+            out.append((start, end))
+    return out
 
 # デバッグ出力（簡潔）
 VERBOSE = True
@@ -160,142 +88,566 @@ def print_decode_verbose(*args, **kwargs):
     # timeshift 用デコーダでは詳細表示は不要なので無害なダミーにする
     return
 
-# --- メイン ---
-def main():
-    name = input("解析するMIDIファイル名を入力してください（拡張子 .mid は不要）: ")
-    path = os.path.join("mid", f"{name}.mid")
-    if not os.path.exists(path):
-        print(f"ファイルが見つかりません: {path}")
-        return
+# --- 復号結果 ---
+@dataclass
+class DecodeResult:
+    text: str
+    payload: bytes
+    raw_bytes: bytes
+    expected_len: Optional[int]
+    notes: int = 0
+    # (step, reported_crc, actual_crc) per SYNC block; reported_crc は解釈できなければ None
+    sync_blocks: List[Tuple[str, Optional[int], int]] = field(default_factory=list)
+    # ストリーム形式の END トレーラ（全体 CRC-32）の検証結果。トレーラが無ければ None
+    trailer_ok: Optional[bool] = None
+    # 1 ノートあたりのビット数（codec_mode）
+    bits_per_note: int = SYMBOL_BITS
+    # resync 復号で壊れていたと分かった範囲（raw_bytes 上の [start, end) バイト位置）
+    erasures: List[Tuple[int, int]] = field(default_factory=list)
+    # 復元したビット数（末尾パディング前）。不明なら None（raw_bytes のビット数とみなす）
+    bit_length: Optional[int] = None
 
-    mid = MidiFile(path)
-    prev_note = "C4"
-    step = 1
-    bit_string = ""
-
-    # flatten all messages (preserve relative times)
-    all_msgs = []
-    for tr in mid.tracks:
-        all_msgs.extend(tr)
-    msg_len = len(all_msgs)
-
-    block_bits_accum = ""
-    skip_indices = set()
-    idx = 0
-    while idx < msg_len:
-        msg = all_msgs[idx]
-        if idx in skip_indices:
-            idx += 1
-            continue
+    @property
+    def crc_errors(self):
+        return [b for b in self.sync_blocks if b[1] is not None and b[1] != b[2]]
 
-        # only process note_on with velocity>0
-        if getattr(msg, "type", None) != "note_on" or getattr(msg, "velocity", 0) == 0:
-            idx += 1
-            continue
+    @property
+    def crc_ok(self):
+        return not self.crc_errors and self.trailer_ok is not False
+
+    @property
+    def payload_erasures(self):
+        """erasures をペイロード上の位置に直したもの。圧縮ペイロードでは位置が対応しないので None。"""
+        raw = self.raw_bytes
+        if len(raw) > LENGTH_HEADER_SIZE and is_compressed(int.from_bytes(raw[:LENGTH_HEADER_SIZE], 'big'),
+                                                           raw[LENGTH_HEADER_SIZE]):
+            return None
+        n = len(self.payload)
+        return [(max(0, a - LENGTH_HEADER_SIZE), min(n, b - LENGTH_HEADER_SIZE)) for a, b in self.erasures
+                if b > LENGTH_HEADER_SIZE and a - LENGTH_HEADER_SIZE < n]
+
+class TimeshiftDecoder:
+    """ノートを 1 個ずつ受け取り 6bit シンボルに戻す状態機械（エンコーダの TimeshiftEncoder と対）。
+    SYNC ブロックを閉じるたびに on_sync(step, reported_crc, actual_crc) を呼ぶ。
+    resync が真なら、ノートの欠落・挿入でずれたシンボル数を SYNC の step（off= があればそちら）で合わせ直し、
+    prev も SYNC のキーフレーム音に戻す。ずれたブロックと CRC の合わないブロックは erasures に記録する。"""
 
-        # compute duration (find corresponding note_off)
-        dur_ticks, off_idx = find_note_duration_and_off_index(all_msgs, idx)
+    def __init__(self, log=None, on_sync=None, mode=CLASSIC, writer=None, stats=None, resync=False):
+        self.log = log = get_log(log)
+        # stats（codec_stats）が有効なら SYNC の CRC 検証時間を crc_time に積む
+        self.stats = stats = get_stats(stats)
+        self._timing = stats.on
+        self.crc_time = 0.0
+        self.mode = mode
+        self._note_text, self._note_trace = log.note_text, log.note_trace
+        self._block_text, self._block_trace = log.block_text, log.block_trace
+        self.prev = DEFAULT_PREV
+        self.step = 1
+        # writer は write(sym) を持つもの（ストライプ復号では詰めずに貯める SymbolBuffer）
+        self.writer = writer if writer is not None else SymbolWriter(mode.bits)
+        self.block_syms = bytearray() if mode.bits == SYMBOL_BITS else array('H')
+        self.sync_blocks = []
+        self.on_sync = on_sync if on_sync is not None else (lambda *b: self.sync_blocks.append(b))
+        self.resync = resync
+        # 最後に位置を合わせたシンボル数と、壊れていた範囲（シンボル位置）
+        self.anchor = 0
+        self.erasures = []
+
+    def can_bulk(self):
+        """codec_numpy の一括経路を使えるか（ノート・ブロック単位のログが無く、まだ何も受け取っていない）。"""
+        return (self.step == 1 and not self.block_syms and self.writer.symbols == 0 and not self.resync
+                and not (self._note_text or self._note_trace or self._block_text or self._block_trace))
+
+    def note(self, note_num, velocity, dur_ticks, sync_text=None):
+        log = self.log
+        step = self.step
+        # 対応する note_off が無いノートは duration 0 とみなす
         if dur_ticks is None:
             dur_ticks = 0
 
-        note_num = getattr(msg, "note", None)
-        velocity = getattr(msg, "velocity", 0)
-        note_name = MIDI_TO_NOTE.get(note_num)
-        if note_name is None:
-            idx += 1
-            continue
+        note_idx = MIDI_TO_INDEX.get(note_num)
+        if note_idx is None:
+            if self.resync:
+                self._erased_note(sync_text)
+            return
+        note_name = NOTE_NAMES[note_idx]
 
-        # reconstruct mapping and select slot
-        prob_table = make_probability_table(prev_note)
-        mapping = make_mapping_from_prob_table(prob_table)
-        selected_bits = select_slot_from_velocity(note_name, mapping, velocity)
-        if selected_bits is None:
-            print(f"[Step {step}] slot 選択失敗: note_name={note_name}")
-            idx += 1
-            continue
-        data4 = selected_bits
+        # select slot from the precomputed codebook
+        mode = self.mode
+        sym = select_slot_from_velocity(self.prev, note_idx, velocity, mode)
+        if sym is None:
+            if self._note_text:
+                log.write(f"[Step {step}] slot 選択失敗: note_name={note_name}")
+            if self.resync:
+                self._erased_note(sync_text)
+            return
         # round duration to nearest 2bit code
-        closest = min(DURATION_TABLE.items(), key=lambda kv: abs(kv[1] - dur_ticks))
-        dur_bits = closest[0]
+        dur_code = mode.nearest_duration_code(dur_ticks)
 
-        full_bits = data4 + dur_bits
-        bit_string += full_bits
+        full_sym = (sym << mode.low_bits) | dur_code
+        if mode.vel_bits:
+            # hd モード: velocity に載せた追加ビット
+            full_sym |= mode.velocity_extra(velocity) << mode.dur_bits
+        self.writer.write(full_sym)
         # append to block accumulator for SYNC CRC
-        block_bits_accum += full_bits
+        block_syms = self.block_syms
+        block_syms.append(full_sym)
 
         # check whether this note is a timeshift keyframe marker:
         # if dur_ticks equals some canonical duration + KEYFRAME_DURATION_SHIFT, and a SYNC meta follows the note_off,
         # then treat SYNC as block boundary. The note itself remains part of data (we already added its bits).
-        is_keyframe_marker = False
-        for code, base_dur in DURATION_TABLE.items():
-            if dur_ticks == base_dur + KEYFRAME_DURATION_SHIFT:
-                # check for SYNC text shortly after off_idx
-                if off_idx is not None:
-                    for j in range(off_idx + 1, min(off_idx + 1 + 64, msg_len)):
-                        m = all_msgs[j]
-                        if getattr(m, "type", None) == "text" and isinstance(getattr(m, "text", None), str) and m.text.startswith("SYNC:"):
-                            # validate CRC on block_bits_accum (which currently includes this note)
-                            parts = m.text.split(":", 3)
-                            if len(parts) >= 4:
-                                _, s_step, s_note, s_crc = parts
-                                print(f"[Keyframe+SYNC READ] step={s_step} prev_note を {s_note} に同期、reported_crc={s_crc}")
-                                actual_crc = crc8_bits(block_bits_accum)
-                                try:
-                                    reported_crc = int(s_crc, 16)
-                                except:
-                                    reported_crc = None
-                                print(f"  block_bits_len={len(block_bits_accum)} actual_crc={actual_crc:02X}")
-                                if reported_crc is not None and actual_crc != reported_crc:
-                                    print(f"  CRC MISMATCH! reported={reported_crc:02X} actual={actual_crc:02X}")
-                                elif reported_crc is not None:
-                                    print("  CRC OK")
-                            # consume the SYNC meta (skip its index)
-                            skip_indices.add(j)
-                            # synchronize prev_note to reported note (or leave as current)
-                            try:
-                                prev_note = s_note
-                            except:
-                                prev_note = note_name
-                            # reset block accumulator after handling
-                            block_bits_accum = ""
-                            is_keyframe_marker = True
-                            break
-                break
-
-        print(f"[Step {step}] decoded note={note_name} dur={dur_ticks} vel={velocity} -> bits={full_bits}")
-        prev_note = note_name
-        step += 1
-        idx += 1
-
-    # パディング方針：末尾の不完全バイトはゼロでパディングして復元する
-    rem = len(bit_string) % 8
-    print(f"[DECODE INFO] bit_string_len={len(bit_string)} rem={rem} (last32={bit_string[-32:]!r})")
+        # resync では呼び出し側が SYNC ごとに最後のノートにだけ sync_text を渡すので、
+        # キーフレーム音が欠けていても SYNC の位置をブロック境界にする
+        if sync_text is not None and (self.resync or dur_ticks - KEYFRAME_DURATION_SHIFT in mode.duration_set):
+            note_idx = self._close_block(sync_text, note_idx)
+
+        if self._note_trace:
+            log.trace_note(step, note_num, velocity, dur_ticks, full_sym)
+        elif self._note_text:
+            log.write(f"[Step {step}] decoded note={note_name} dur={dur_ticks} vel={velocity} -> bits={full_sym:0{mode.bits}b}")
+        self.prev = note_idx
+        self.step = step + 1
+
+    def _close_block(self, sync_text, note_idx):
+        """SYNC ブロックを閉じて CRC を検証する。次の prev（resync なら SYNC のキーフレーム音）を返す。"""
+        log = self.log
+        mode = self.mode
+        block_syms = self.block_syms
+        # validate CRC on block_syms (which currently includes this note)
+        marker = parse_sync(sync_text)
+        if marker is not None:
+            reported_crc = marker.crc if marker.crc_known else None
+            algo = marker.algo if marker.crc_known else "crc8"
+            if self._timing:
+                t0 = clock()
+                actual_crc = checksum(algo, symbols_to_bytes(block_syms, mode.bits))
+                self.crc_time += clock() - t0
+            else:
+                actual_crc = checksum(algo, symbols_to_bytes(block_syms, mode.bits))
+            self.on_sync(marker.step, reported_crc, actual_crc)
+            if self._block_trace:
+                log.trace_sync(marker.step, reported_crc, actual_crc)
+            elif self._block_text:
+                w = hex_digits(algo)
+                log.write(f"[Keyframe+SYNC READ] step={marker.step} prev_note を {marker.note} に同期、reported_crc={sync_text.split(':')[3]}")
+                log.write(f"  block_bits_len={len(block_syms) * mode.bits} actual_crc={actual_crc:0{w}X}")
+                if reported_crc is not None and actual_crc != reported_crc:
+                    log.write(f"  CRC MISMATCH! reported={reported_crc:0{w}X} actual={actual_crc:0{w}X}")
+                elif reported_crc is not None:
+                    log.write("  CRC OK")
+            if self.resync:
+                note_idx = self._realign(marker, reported_crc is not None and actual_crc != reported_crc, note_idx)
+        # reset block accumulator after handling
+        del block_syms[:]
+        return note_idx
+
+    def _erased_note(self, sync_text):
+        # resync: 復号できないノート（音階外・prev から届かない音）も 0 のシンボルとして数え、SYNC の境界を保つ
+        self.writer.write(0)
+        self.block_syms.append(0)
+        if sync_text is not None:
+            self.prev = self._close_block(sync_text, self.prev)
+        self.step += 1
+
+    def _realign(self, marker, crc_bad, note_idx):
+        """SYNC の位置でシンボル数を合わせ直し、次の prev を返す。"""
+        bits = self.mode.bits
+        off = marker.bit_offset
+        if off is not None and off % bits == 0:
+            expected = off // bits
+        else:
+            expected = int(marker.step) if marker.step.isdigit() else None
+        writer = self.writer
+        have = writer.symbols
+        if expected is None or not (self.anchor < expected and abs(expected - have) <= MAX_RESYNC_GAP):
+            # 位置を読めない・信用できない SYNC では合わせ直さない
+            if crc_bad:
+                self.erasures.append((self.anchor, have))
+            self.anchor = have
+            return note_idx
+        if have != expected:
+            if have > expected:
+                writer.truncate(expected)
+            else:
+                for _ in range(expected - have):
+                    writer.write(0)
+            if self._block_text:
+                self.log.write(f"  RESYNC: symbols {have} -> {expected}")
+            crc_bad = True
+        if crc_bad:
+            self.erasures.append((self.anchor, expected))
+        self.anchor = expected
+        return NOTE_INDEX.get(marker.note, note_idx)
+
+    def finish(self, end_text=None):
+        """蓄積したシンボルからペイロードを取り出して DecodeResult を返す。"""
+        writer = self.writer
+        # パディング方針：末尾の不完全バイトはゼロでパディングして復元する
+        stats = self.stats
+        unpack = stats.stage("unpack")
+        with unpack:
+            reconstructed_bytes = writer.getvalue()
+        # ヘッダ付き出力を想定: 先頭4バイトが元データ長 (big-endian)、ストリーム形式なら END トレーラで長さを得る
+        with unpack:
+            payload, expected_len, trailer_ok = unframe(reconstructed_bytes, parse_end(end_text))
+        with stats.stage("utf8"):
+            decoded_text = payload.decode('utf-8', errors='replace')
+        if stats.on:
+            stats.add("notes", self.step - 1)
+            stats.add("sync_blocks", len(self.sync_blocks))
+            stats.add("crc_errors", sum(1 for b in self.sync_blocks if b[1] is not None and b[1] != b[2]))
+            stats.add("payload_bytes", len(payload))
+        result = DecodeResult(text=decoded_text, payload=payload, raw_bytes=reconstructed_bytes,
+                              expected_len=expected_len, notes=self.step - 1, sync_blocks=self.sync_blocks,
+                              trailer_ok=trailer_ok, bits_per_note=self.mode.bits,
+                              erasures=erasure_bytes(self.erasures, self.mode.bits), bit_length=writer.bit_length)
+        if self.log.summary_on:
+            log_summary(self.log, result)
+        return result
+
+def _tail_bits(raw, bit_length, n):
+    # raw（末尾はゼロパディング）の先頭 bit_length ビットのうち末尾 n ビットを '0'/'1' 文字列で
+    n = min(n, bit_length)
+    if n <= 0:
+        return ""
+    pad = len(raw) * 8 - bit_length
+    tail = raw[-((n + pad + 7) // 8):]
+    return format((int.from_bytes(tail, 'big') >> pad) & ((1 << n) - 1), f'0{n}b')
+
+def log_summary(log, result):
+    """summary レベルの要約を書く（TimeshiftDecoder.finish と、復号キャッシュのヒット時に同じものを出す）。"""
+    write = log.write
+    raw = result.raw_bytes
+    bit_length = len(raw) * 8 if result.bit_length is None else result.bit_length
+    rem = bit_length % 8
+    write(f"[DECODE INFO] bit_string_len={bit_length} rem={rem} (last32={_tail_bits(raw, bit_length, 32)!r})")
     if rem != 0:
-        pad = 8 - rem
-        print(f"[INFO] 末尾の不完全なビットを{rem}個検出、{pad}個の'0'でパディングして復号します")
-        bit_string = bit_string + '0' * pad
-    bytes_list = [int(bit_string[i:i+8], 2) for i in range(0, len(bit_string), 8)]
-    try:
-        reconstructed_bytes = bytes(bytes_list)
-    except Exception:
-        reconstructed_bytes = b"".join(bytes([b]) for b in bytes_list)
-
-    print(f"[DECODE INFO] reconstructed_bytes_len={len(reconstructed_bytes)} "
-          f"first4={reconstructed_bytes[:4].hex()} last4={reconstructed_bytes[-4:].hex()}")
-    # ヘッダ付き出力を想定: 先頭4バイトが元データ長 (big-endian)
-    if len(reconstructed_bytes) >= 4:
-        expected_len = int.from_bytes(reconstructed_bytes[:4], 'big')
-        print(f"[DECODE INFO] expected_payload_len={expected_len} available={len(reconstructed_bytes)-4}")
-        # 期待長が手元のバイト数内に収まればその分だけ取り出す。足りなければ残りをデコード。
-        if expected_len <= len(reconstructed_bytes) - 4:
-            payload = reconstructed_bytes[4:4 + expected_len]
+        write(f"[INFO] 末尾の不完全なビットを{rem}個検出、{8 - rem}個の'0'でパディングして復号します")
+    write(f"[DECODE INFO] reconstructed_bytes_len={len(raw)} first4={raw[:4].hex()} last4={raw[-4:].hex()}")
+    if result.expected_len is not None:
+        write(f"[DECODE INFO] expected_payload_len={result.expected_len} available={len(raw)-4}")
+        if result.trailer_ok is False:
+            write("[DECODE INFO] END トレーラの CRC が一致しません")
+
+def decode_midi(mid, log=None, on_sync=None, stats=None, resync=False):
+    """読み込み済みの MidiFile を復号して DecodeResult を返す。
+    on_sync(step, reported_crc, actual_crc) は SYNC ブロックを検証するたびに呼ばれる（進捗表示用）。
+    stats は段階ごとの計測（codec_stats.get_stats が受け付ける値）。
+    resync が真ならノートの欠落・挿入を SYNC で合わせ直し、壊れた範囲を result.erasures に返す。"""
+    stats = get_stats(stats)
+    if mid.tracks:
+        reject_archive_texts(len(mid.tracks), (m.text for m in mid.tracks[-1] if m.type == "text"))
+    markers = [stripe_marker((m.type, getattr(m, "velocity", 0), getattr(m, "text", None)) for m in tr)
+               for tr in mid.tracks]
+    if any(markers):
+        with stats.stage("pair"):
+            tracks = [(mk, build_note_index(tr)) for mk, tr in zip(markers, mid.tracks) if mk]
+        return _decode_striped(tracks, log, on_sync, stats, resync)
+    # トラックを順に 1 つの builder に流す（全メッセージを連結したリストは作らない）
+    with stats.stage("pair"):
+        builder = NoteIndexBuilder()
+        for tr in mid.tracks:
+            feed_messages(builder.feed, tr)
+        index = builder.finish()
+    return decode_index(index, log, on_sync, stats, resync)
+
+def decode_events(stores, log=None, on_sync=None, stats=None, resync=False):
+    """encode_events が返した EventStore のリストを、SMF や mido を経由せずに復号する。"""
+    stats = get_stats(stats)
+    if stores:
+        reject_archive_texts(len(stores), stores[-1].texts)
+    markers = [_store_marker(store) for store in stores]
+    if any(markers):
+        with stats.stage("pair"):
+            tracks = []
+            for mk, store in zip(markers, stores):
+                if mk:
+                    builder = NoteIndexBuilder()
+                    store.replay(builder.feed)
+                    tracks.append((mk, builder.finish()))
+        return _decode_striped(tracks, log, on_sync, stats, resync)
+    with stats.stage("pair"):
+        builder = NoteIndexBuilder()
+        for store in stores:
+            store.replay(builder.feed)
+        index = builder.finish()
+    return decode_index(index, log, on_sync, stats, resync)
+
+def decode_smf(src, log=None, on_sync=None, stats=None, resync=False):
+    """SMF（パスまたはバイト列）を mido を使わずに読んで復号する。結果は decode_file と同じ。
+    stats の parse にはイベント解析とノートの対応付けの両方が入る（1 パスで行うため）。"""
+    stats = get_stats(stats)
+    builder = NoteIndexBuilder()
+    feed = builder.feed
+    with open_smf(src) as buf:
+        stats.add("smf_bytes", len(buf))
+        parse = stats.stage("parse")
+        with parse:
+            ranges = track_ranges(buf)
+            reject_archive(buf, ranges)
+            markers = [stripe_marker((ev[1], ev[3], ev[4]) for ev in iter_track(buf, *r)) for r in ranges]
+        if any(markers):
+            with parse:
+                tracks = [(mk, track_index(buf, r)) for mk, r in zip(markers, ranges) if mk]
+            return _decode_striped(tracks, log, on_sync, stats, resync)
+        with parse:
+            for ev in iter_events(buf):
+                feed(*ev)
+            index = builder.finish()
+    return decode_index(index, log, on_sync, stats, resync)
+
+def is_striped(src):
+    """SMF（パスまたはバイト列）がストライプ形式か（どれかのトラック先頭に STRIPE テキストがあるか）。"""
+    with open_smf(src) as buf:
+        return _has_stripes(buf, track_ranges(buf))
+
+def _has_stripes(buf, ranges):
+    return any(stripe_marker((ev[1], ev[3], ev[4]) for ev in iter_track(buf, *r)) for r in ranges)
+
+def track_index(buf, track_range):
+    """SMF のバッファ buf のうち track_range = (開始, 終了) の 1 トラックだけを読んで NoteIndex にする。"""
+    b = NoteIndexBuilder()
+    feed = b.feed
+    for ev in iter_track(buf, *track_range):
+        feed(*ev)
+    return b.finish()
+
+# --- ストライプ（stripes 参照） ---
+def _store_marker(store):
+    texts = store.texts
+    return stripe_marker(("text", 0, texts[ref]) if kind == TEXT else ("note_on", v, None)
+                          for kind, v, ref in zip(store.kind, store.velocity, store.text_ref))
+
+def decode_stripe(index, k, log=None, on_sync=None, stats=None, resync=False):
+    """1 本のストライプを復号する。シンボルは詰めずに writer.syms に残る。
+    SYNC ブロックの step には s<k>: を前置する。"""
+    mode = mode_from_text(index.mode_text)
+    blocks = []
+
+    def record(step, rep, act):
+        block = (f"s{k}:{step}", rep, act)
+        blocks.append(block)
+        if on_sync is not None:
+            on_sync(*block)
+    dec = TimeshiftDecoder(log, on_sync=record, mode=mode, writer=SymbolBuffer(mode.bits), stats=stats, resync=resync)
+    dec.sync_blocks = blocks
+    feed_index(dec, index)
+    return dec
+
+def join_stripes(parts, log=None, end_text=None, stats=None, erasures=()):
+    """parts: ストライプ番号順の (シンボル列, sync_blocks, ノート数, mode) から DecodeResult を作る。
+    欠けたストライプは mode を None にする。erasures は組み直した後のシンボル位置の範囲。"""
+    mode = next((p[3] for p in parts if p[3] is not None), CLASSIC)
+    writer = SymbolWriter(mode.bits)
+    writer.extend(interleave([p[0] for p in parts]))
+    dec = TimeshiftDecoder(log, mode=mode, writer=writer, stats=stats)
+    dec.sync_blocks = [b for p in parts for b in p[1]]
+    dec.step = sum(p[2] for p in parts) + 1
+    dec.erasures = list(erasures)
+    return dec.finish(end_text)
+
+def _decode_striped(tracks, log=None, on_sync=None, stats=None, resync=False):
+    # 同じ番号が重複していれば先のものを使う。欠けたストライプは空として組み直す
+    n = max(mk[1] for mk, _ in tracks)
+    by_k = {}
+    for (k, _), index in tracks:
+        by_k.setdefault(k, index)
+    parts = []
+    erasures = []
+    for k in range(n):
+        index = by_k.get(k)
+        if index is None:
+            parts.append((array('H'), [], 0, None))
+            continue
+        dec = decode_stripe(index, k, log, on_sync, stats, resync)
+        parts.append((dec.writer.syms, dec.sync_blocks, dec.step - 1, dec.mode))
+        # ストライプ内の i 番目のシンボルは組み直すと i * n + k 番目になる
+        erasures.extend((a * n + k, (b - 1) * n + k + 1) for a, b in dec.erasures if b > a)
+    return join_stripes(parts, log, stats=stats, erasures=erasures)
+
+def feed_index(dec, index):
+    """NoteIndex の全ノートを dec に渡す。条件がそろえば codec_numpy の一括経路を使う。"""
+    # stats が有効なら、ノートを渡している間の CRC 以外の時間をコードブック参照（lookup）として積む
+    stats = dec.stats
+    t0 = clock() if stats.on else 0.0
+    crc0 = dec.crc_time
+    bulk = codec_numpy.backend(len(index)) if dec.can_bulk() else None
+    if bulk is not None:
+        bulk.decode_into(dec, index)
+    elif dec.resync:
+        # 同じ SYNC に紐づいたノートのうち最後のもの（キーフレーム音の位置）にだけ sync_text を渡す。
+        # 組にならなかったノート（sync = -1）は飛ばし、次に SYNC に紐づいたノートと比べる
+        note, velocity, duration, sync_text, sync = index.note, index.velocity, index.duration, index.sync_text, index.sync
+        block_end = bytearray(len(index))
+        following = -1
+        for i in range(len(index) - 1, -1, -1):
+            k = sync[i]
+            if k >= 0:
+                if k != following:
+                    block_end[i] = 1
+                following = k
+        for i in range(len(index)):
+            dec.note(note[i], velocity[i], duration(i), sync_text(i) if block_end[i] else None)
+    else:
+        note, velocity, duration, sync_text = index.note, index.velocity, index.duration, index.sync_text
+        for i in range(len(index)):
+            dec.note(note[i], velocity[i], duration(i), sync_text(i))
+    if stats.on:
+        crc = dec.crc_time - crc0
+        stats.add_time("crc", crc)
+        stats.add_time("lookup", clock() - t0 - crc)
+
+def decode_index(index, log=None, on_sync=None, stats=None, resync=False):
+    """NoteIndex（build_note_index / track_index の結果）を復号して DecodeResult を返す。"""
+    dec = TimeshiftDecoder(log, mode=mode_from_text(index.mode_text), stats=stats, resync=resync)
+    if on_sync is not None:
+        record = dec.on_sync
+
+        def hook(*block):
+            record(*block)
+            on_sync(*block)
+        dec.on_sync = hook
+    feed_index(dec, index)
+    return dec.finish(index.end_text)
+
+def decode_file(path, log=None, stats=None):
+    from mido import MidiFile
+    stats = get_stats(stats)
+    with stats.stage("parse"):
+        mid = MidiFile(path)
+    stats.add("smf_bytes", os.path.getsize(path))
+    return decode_midi(mid, log=log, stats=stats)
+
+# --- ストリーム復号 ---
+# note_off の来ない note_on をこの件数まで保留する（NoteStream 参照）
+MAX_PENDING_NOTES = 1 << 16
+
+class StreamDecoder:
+    """SMF を mido を使わずに先頭から読み、確定したペイロードバイトを順に返す。
+    メモリ使用量はファイル長に依存しない。SYNC ブロックは読み進めながら検証する。
+
+        dec = StreamDecoder(path)
+        for chunk in dec:
+            out.write(chunk)
+        dec.crc_errors, dec.trailer_ok ...
+
+    ストライプ形式のファイルはトラックが順に並んでいて逐次には組み直せないので、decode_smf で全体を
+    復号してから 1 チャンクで返す（この場合メモリ使用量はファイル長に比例する。striped が真になる）。
+    """
+
+    def __init__(self, src, max_pending=MAX_PENDING_NOTES, on_sync=None):
+        self.src = src
+        self.max_pending = max_pending
+        self.user_on_sync = on_sync
+        self.notes = 0
+        self.sync_ok = 0
+        self.crc_errors = []
+        self.expected_len = None
+        self.payload_len = 0
+        self.trailer_ok = None
+        self.bits_per_note = SYMBOL_BITS
+        self.striped = False
+
+    def _on_sync(self, step, reported, actual):
+        if reported is not None and reported != actual:
+            self.crc_errors.append((step, reported, actual))
         else:
-            payload = reconstructed_bytes[4:]
-        decoded_text = payload.decode('utf-8', errors='replace')
+            self.sync_ok += 1
+        if self.user_on_sync is not None:
+            self.user_on_sync(step, reported, actual)
+
+    @property
+    def crc_ok(self):
+        return not self.crc_errors and self.trailer_ok is not False
+
+    def _iter_striped(self):
+        self.striped = True
+        result = decode_smf(self.src)
+        for step, reported, actual in result.sync_blocks:
+            self._on_sync(step, reported, actual)
+        self.notes = result.notes
+        self.expected_len = result.expected_len
+        self.trailer_ok = result.trailer_ok
+        self.bits_per_note = result.bits_per_note
+        self.payload_len = len(result.payload)
+        if result.payload:
+            yield result.payload
+
+    def _make_decoder(self, stream):
+        return TimeshiftDecoder(on_sync=self._on_sync, mode=mode_from_text(stream.mode_text))
+
+    def __iter__(self):
+        with open_smf(self.src) as buf:
+            ranges = track_ranges(buf)
+            reject_archive(buf, ranges)
+            striped = _has_stripes(buf, ranges)
+        if striped:
+            # ストライプのトラックはファイル内で順に並んでいるので、逐次には組み直せない。まとめて復号する
+            yield from self._iter_striped()
+            return
+        stream = NoteStream(max_pending=self.max_pending)
+        dec = None
+        unframer = StreamUnframer()
+        with open_smf(self.src) as buf:
+            for ev in iter_events(buf):
+                stream.feed(*ev)
+                ready = stream.drain()
+                if not ready:
+                    continue
+                if dec is None:
+                    # モード宣言はトラック先頭（最初のノートより前）にある
+                    dec = self._make_decoder(stream)
+                for rec in ready:
+                    dec.note(*rec)
+                out = unframer.push(dec.writer.take_bytes())
+                if out:
+                    self.payload_len += len(out)
+                    yield out
+        if dec is None:
+            dec = self._make_decoder(stream)
+        for rec in stream.flush():
+            dec.note(*rec)
+        # 残りのバイト（末尾の不完全バイトはゼロパディング）と保留分
+        out = unframer.push(dec.writer.getvalue())
+        out += unframer.finish(parse_end(stream.end_text))
+        self.notes = dec.step - 1
+        self.expected_len = unframer.expected_len
+        self.trailer_ok = unframer.trailer_ok
+        self.bits_per_note = dec.mode.bits
+        if out:
+            self.payload_len += len(out)
+            yield out
+
+def stream_decode(src, dst, on_sync=None):
+    """src（パス / SMF バイト列）を逐次復号して dst（バイナリの file-like）へ書き込む。"""
+    dec = StreamDecoder(src, on_sync=on_sync)
+    for chunk in dec:
+        dst.write(chunk)
+    return dec
+
+# --- メイン ---
+def main():
+    # 引数でパスを渡せば対話入力を省く（非対話の用途は timeshift_cli.py decode を参照）
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+        name = os.path.splitext(os.path.basename(path))[0]
     else:
-        decoded_text = reconstructed_bytes.decode('utf-8', errors='replace')
+        name = input("解析するMIDIファイル名を入力してください（拡張子 .mid は不要）: ")
+        path = os.path.join("mid", f"{name}.mid")
+    if not os.path.exists(path):
+        print(f"ファイルが見つかりません: {path}")
+        return
+
+    # TIMESHIFT_STATS=1（,profile / ,memory）で段階ごとの計測を artifacts/<name>_decode_stats.json に書く
+    stats = stats_from_env()
+    if stats.on:
+        stats.start()
+    result = decode_file(path, log=level_from_env(), stats=stats)
+    if stats.on:
+        stats.stop()
+        print(f"stats: {stats.save(name + '_decode')}")
+    decoded_text = result.text
     # 修正箇所: エラーが出ても無理やり表示させる
-    import sys
     try:
         # コンソールで表示できない文字は '?' などに置き換えて表示
         safe_text = decoded_text.encode(sys.stdout.encoding, errors='replace').decode(sys.stdout.encoding)
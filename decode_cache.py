@@ -0,0 +1,287 @@
+# 復号結果のキャッシュ（artifacts/decode_cache）
+# キーは「ファイル内容の SHA-256 + CODEC_VERSION」。値はペイロードと SYNC ブロックごとの CRC 結果・統計。
+# パスごとに (size, mtime_ns) -> キー を index.json に覚えておき、変わっていなければハッシュ計算も省く。
+# エントリの mtime を最終使用時刻として扱い、合計サイズが max_bytes を超えたら古いものから消す（LRU）。
+#
+#   cache = default_cache()
+#   result = cache.decode(path)        # 2 回目以降はファイルを読まずに返る
+#
+# TIMESHIFT_DECODE_CACHE=0 で無効になる。
+import hashlib
+import json
+import os
+import sys
+import time
+from array import array
+from pathlib import Path
+
+from midi_shared import ARTIFACTS_DIR
+from codec_mode import MODE_VERSION
+from codec_log import get_log
+from decode_adaptive_timeshift_decode import DecodeResult, log_summary
+
+CACHE_DIR = ARTIFACTS_DIR / "decode_cache"
+# 復号結果が変わる修正をしたら上げる（古いエントリは参照されなくなり、LRU で消える）
+CODEC_VERSION = 1
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+INDEX_NAME = "index.json"
+ENTRY_SUFFIX = ".tsc"
+HASH_CHUNK = 1 << 20
+
+def cache_enabled():
+    return os.environ.get("TIMESHIFT_DECODE_CACHE", "1") not in ("0", "off", "no")
+
+def content_key(path):
+    """ファイル内容とコーデックのバージョンから作るキャッシュキー。"""
+    h = hashlib.sha256(f"timeshift:{CODEC_VERSION}:{MODE_VERSION}\n".encode("ascii"))
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+# --- エントリの読み書き ---
+# JSON ヘッダ 1 行 + SYNC ブロック + ペイロード + raw_bytes
+# SYNC ブロックは数十万件になるので JSON には入れず、step は改行区切りの文字列、
+# reported / actual は int64 の配列で持つ（reported が None = 解釈できなかった CRC は -1）。
+def _dump_entry(f, result):
+    blocks = result.sync_blocks
+    steps = "\n".join(str(b[0]) for b in blocks).encode("utf-8")
+    reported = array("q", [-1 if b[1] is None else b[1] for b in blocks])
+    actual = array("q", [b[2] for b in blocks])
+    header = {
+        "codec": CODEC_VERSION,
+        "payload_len": len(result.payload),
+        "raw_len": len(result.raw_bytes),
+        "expected_len": result.expected_len,
+        "notes": result.notes,
+        "sync_count": len(blocks),
+        "steps_len": len(steps),
+        "trailer_ok": result.trailer_ok,
+        "bits_per_note": result.bits_per_note,
+        "bit_length": result.bit_length,
+    }
+    f.write(json.dumps(header, separators=(",", ":")).encode("utf-8") + b"\n")
+    f.write(steps)
+    f.write(reported.tobytes())
+    f.write(actual.tobytes())
+    f.write(result.payload)
+    f.write(result.raw_bytes)
+
+def _read_exact(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise ValueError("truncated cache entry")
+    return data
+
+def _read_array(f, n):
+    a = array("q")
+    a.frombytes(_read_exact(f, n * a.itemsize))
+    return a
+
+def _load_entry(f):
+    header = json.loads(f.readline())
+    if header.get("codec") != CODEC_VERSION:
+        raise ValueError("codec version mismatch")
+    n = header["sync_count"]
+    steps = _read_exact(f, header["steps_len"]).decode("utf-8").split("\n") if n else []
+    reported = _read_array(f, n)
+    actual = _read_array(f, n)
+    if len(steps) != n:
+        raise ValueError("broken cache entry")
+    payload = _read_exact(f, header["payload_len"])
+    raw = _read_exact(f, header["raw_len"])
+    if -1 in reported:
+        blocks = [(s, None if r < 0 else r, a) for s, r, a in zip(steps, reported, actual)]
+    else:
+        blocks = list(zip(steps, reported, actual))
+    return DecodeResult(text=payload.decode("utf-8", errors="replace"), payload=payload, raw_bytes=raw,
+                        expected_len=header["expected_len"], notes=header["notes"], sync_blocks=blocks,
+                        trailer_ok=header["trailer_ok"], bits_per_note=header["bits_per_note"],
+                        bit_length=header.get("bit_length"))
+
+def _default_decoder(path, log=None):
+    # 既存の API と同じ復号（mido 経由）
+    import timeshift_codec
+    return timeshift_codec.decode(path, log=log)
+
+class DecodeCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._paths = None
+
+    # --- パス -> キー（stat による高速経路） ---
+    def _index(self):
+        if self._paths is None:
+            try:
+                with open(self.dir / INDEX_NAME, encoding="utf-8") as f:
+                    data = json.load(f)
+                self._paths = data["paths"] if data.get("codec") == CODEC_VERSION else {}
+            except (OSError, ValueError, KeyError, TypeError):
+                self._paths = {}
+        return self._paths
+
+    def _save_index(self):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.dir / f"{INDEX_NAME}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"codec": CODEC_VERSION, "paths": self._paths}, f)
+        os.replace(tmp, self.dir / INDEX_NAME)
+
+    def key_for(self, path):
+        """path のキャッシュキー。size と mtime が前回と同じならハッシュを計算しない。"""
+        path = Path(path).resolve()
+        st = path.stat()
+        paths = self._index()
+        name = str(path)
+        known = paths.get(name)
+        if known is not None and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            return known[2]
+        key = content_key(path)
+        paths[name] = [st.st_size, st.st_mtime_ns, key]
+        self._save_index()
+        return key
+
+    def _entry_path(self, key):
+        return self.dir / f"{key}{ENTRY_SUFFIX}"
+
+    # --- 取得・登録 ---
+    def get(self, path, key=None):
+        """キャッシュ済みの DecodeResult。無ければ None。"""
+        key = key or self.key_for(path)
+        entry = self._entry_path(key)
+        try:
+            with open(entry, "rb") as f:
+                result = _load_entry(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError, KeyError, TypeError):
+            # 壊れたエントリは消して作り直す
+            self._remove(entry)
+            self.misses += 1
+            return None
+        # 最終使用時刻を更新する（LRU）
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        self.hits += 1
+        return result
+
+    def put(self, path, result, key=None):
+        key = key or self.key_for(path)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        entry = self._entry_path(key)
+        tmp = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            _dump_entry(f, result)
+        os.replace(tmp, entry)
+        self.evict()
+
+    def decode(self, path, decoder=None, log=None):
+        """path を復号する。キャッシュにあればそれを返し、無ければ decoder(path, log) の結果を登録する。
+        summary レベルのログはキャッシュの結果から出し直す。block / note のログ（復号の過程）を出すときは復号し直す。"""
+        key = self.key_for(path)
+        codec_log = get_log(log)
+        per_block = codec_log.block_text or codec_log.note_text or codec_log.block_trace or codec_log.note_trace
+        result = None if per_block else self.get(path, key)
+        if result is None:
+            result = (decoder or _default_decoder)(path, log=log)
+            self.put(path, result, key)
+        elif codec_log.summary_on:
+            log_summary(codec_log, result)
+        return result
+
+    # --- 容量管理 ---
+    def _entries(self):
+        out = []
+        if not self.dir.is_dir():
+            return out
+        for p in self.dir.iterdir():
+            if p.suffix != ENTRY_SUFFIX:
+                continue
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            out.append((st.st_mtime_ns, st.st_size, p))
+        return out
+
+    def _remove(self, entry):
+        try:
+            entry.unlink()
+        except OSError:
+            pass
+
+    def evict(self, max_bytes=None):
+        """合計サイズが max_bytes 以下になるまで、最後に使ったのが古いエントリから消す。消した数を返す。"""
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, p in entries:
+            if total <= limit:
+                break
+            self._remove(p)
+            total -= size
+            removed += 1
+        if removed:
+            # 消えたエントリを指すパスを index から落とす
+            alive = {p.name[:-len(ENTRY_SUFFIX)] for _, _, p in self._entries()}
+            paths = self._index()
+            for name in [n for n, v in paths.items() if v[2] not in alive]:
+                del paths[name]
+            self._save_index()
+        return removed
+
+    def clear(self):
+        removed = self.evict(0)
+        self._paths = {}
+        self._save_index()
+        return removed
+
+    def stats(self):
+        entries = self._entries()
+        return {"entries": len(entries), "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+_default = None
+
+def default_cache():
+    global _default
+    if _default is None:
+        _default = DecodeCache()
+    return _default
+
+def cached_decode(path, log=None, decoder=None):
+    """キャッシュ有効時はキャッシュ経由で、無効時はそのまま復号する。"""
+    if not cache_enabled():
+        return (decoder or _default_decoder)(path, log=log)
+    return default_cache().decode(path, decoder=decoder, log=log)
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="復号キャッシュの確認・削除")
+    ap.add_argument("paths", nargs="*", help="復号する .mid（時間を表示する）")
+    ap.add_argument("--clear", action="store_true", help="キャッシュを全て消す")
+    ap.add_argument("--max-mb", type=float, default=None, help="この容量まで古いエントリを消す")
+    args = ap.parse_args()
+    cache = default_cache()
+    if args.clear:
+        print(f"removed: {cache.clear()}")
+    if args.max_mb is not None:
+        print(f"removed: {cache.evict(int(args.max_mb * 1024 * 1024))}")
+    for p in args.paths:
+        t0 = time.perf_counter()
+        result = cache.decode(p)
+        hit = "hit" if cache.hits else "miss"
+        cache.hits = cache.misses = 0
+        print(f"{p}: {hit} {time.perf_counter() - t0:.4f}s notes={result.notes} "
+              f"crc_errors={len(result.crc_errors)}", file=sys.stderr)
+    print(json.dumps(cache.stats()))
+
+if __name__ == "__main__":
+    main()
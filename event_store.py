@@ -0,0 +1,144 @@
+# トラック 1 本分のイベント列を列指向の配列で持つ（mido の Message をノートごとに作らない）
+# 1 行 = ノート 1 個（note_on〜note_off）またはテキスト 1 個。
+#   abs_tick : 開始 tick（ノートは note_on、テキストはその位置）
+#   kind     : NOTE / TEXT
+#   pitch, velocity, duration : ノートの値（テキスト行は 0）
+#   text_ref : texts の添字（ノート行は -1）
+# TimeshiftEncoder の出力先（note / text）としてそのまま使え、mido へは to_track / to_midi_file、
+# SMF バイト列へは write_smf / write_store（smf_stream.SmfTrackWriter）で変換する。
+# 復号側へは replay で NoteIndexBuilder / NoteStream に流す（SMF や mido を経由しない）。
+from array import array
+
+NOTE = 0
+TEXT = 1
+
+class EventStore:
+    __slots__ = ("abs_tick", "kind", "pitch", "velocity", "duration", "text_ref", "texts", "channel", "tick")
+
+    def __init__(self, channel=0):
+        self.abs_tick = array('q')
+        self.kind = array('B')
+        self.pitch = array('B')
+        self.velocity = array('B')
+        self.duration = array('L')
+        self.text_ref = array('l')
+        self.texts = []
+        self.channel = channel
+        # 次のイベントの開始 tick（= 最後のノートの note_off の位置）
+        self.tick = 0
+
+    def __len__(self):
+        return len(self.kind)
+
+    @property
+    def note_count(self):
+        return len(self.kind) - len(self.texts)
+
+    # --- TimeshiftEncoder の出力先としてのインタフェース ---
+    def note(self, note_num, velocity, duration):
+        self.abs_tick.append(self.tick)
+        self.kind.append(NOTE)
+        self.pitch.append(note_num)
+        self.velocity.append(velocity)
+        self.duration.append(duration)
+        self.text_ref.append(-1)
+        self.tick += duration
+
+    def text(self, text):
+        self.abs_tick.append(self.tick)
+        self.kind.append(TEXT)
+        self.pitch.append(0)
+        self.velocity.append(0)
+        self.duration.append(0)
+        self.text_ref.append(len(self.texts))
+        self.texts.append(text)
+
+    def extend_rows(self, abs_tick, kind, pitch, velocity, duration, text_ref, texts, end_tick):
+        """行をまとめて追加する（codec_numpy の一括エンコード用）。
+        各列は対応する array と同じ型のバイト列、text_ref は self.texts への添字（追加する texts を含む）。"""
+        self.abs_tick.frombytes(abs_tick)
+        self.kind.frombytes(kind)
+        self.pitch.frombytes(pitch)
+        self.velocity.frombytes(velocity)
+        self.duration.frombytes(duration)
+        self.text_ref.frombytes(text_ref)
+        self.texts.extend(texts)
+        self.tick = end_tick
+
+    # --- 変換 ---
+    def to_track(self, track=None):
+        """mido の MidiTrack に変換する（MidiTrackSink で直接積んだものと同じメッセージ列）。"""
+        from mido import Message, MetaMessage, MidiTrack
+        if track is None:
+            track = MidiTrack()
+        append = track.append
+        ch = self.channel
+        pitch, velocity, duration, text_ref, texts = self.pitch, self.velocity, self.duration, self.text_ref, self.texts
+        for i, k in enumerate(self.kind):
+            if k == NOTE:
+                append(Message('note_on', channel=ch, note=pitch[i], velocity=velocity[i], time=0))
+                append(Message('note_off', channel=ch, note=pitch[i], velocity=0, time=duration[i]))
+            else:
+                append(MetaMessage('text', text=texts[text_ref[i]], time=0))
+        return track
+
+    def replay(self, feed):
+        """feed(delta, kind, note, velocity, text)（NoteIndexBuilder.feed など）に SMF と同じイベント列を流す。"""
+        pitch, velocity, duration, text_ref, texts = self.pitch, self.velocity, self.duration, self.text_ref, self.texts
+        for i, k in enumerate(self.kind):
+            if k == NOTE:
+                n = pitch[i]
+                feed(0, "note_on", n, velocity[i])
+                feed(duration[i], "note_off", n, 0)
+            else:
+                feed(0, "text", None, 0, texts[text_ref[i]])
+        feed(0, "end_of_track")
+
+def write_smf(stores, out, ticks_per_beat=None, seek_index=False):
+    """EventStore のリストを 1 ファイル（1 ストア = 1 トラック）として out に書く。mido.MidiFile.save と同じバイト列。
+    seek_index が真なら末尾に索引トラック（seek_index 参照）を足す。ストライプ形式（複数トラック）には付けられない。
+    out がシーク不可（パイプ等）のときは一時ファイルに書いてからコピーする（トラック長を書き戻すため）。"""
+    from smf_stream import DEFAULT_TICKS_PER_BEAT, SmfTrackWriter
+    if not out.seekable():
+        import shutil
+        import tempfile
+        with tempfile.TemporaryFile() as tmp:
+            write_smf(stores, tmp, ticks_per_beat, seek_index)
+            tmp.seek(0)
+            shutil.copyfileobj(tmp, out)
+        return
+    if seek_index and len(stores) != 1:
+        raise ValueError("seek index needs a single-track file")
+    writer = SmfTrackWriter(out, ticks_per_beat or DEFAULT_TICKS_PER_BEAT, n_tracks=len(stores) + bool(seek_index))
+    table = None
+    if seek_index:
+        from seek_index import SeekTable
+        table = SeekTable(writer.tell())
+    for k, store in enumerate(stores):
+        if k:
+            writer.next_track()
+        write_store(writer, store, table)
+    if table is not None:
+        writer.next_track()
+        writer.text(table.format())
+    writer.close()
+
+def write_store(writer, store, table=None):
+    """1 ストアのイベントを SmfTrackWriter の今のトラックに書く。table（seek_index.SeekTable）には SYNC の位置を記録する。"""
+    ch = store.channel
+    pitch, velocity, duration, text_ref, texts = store.pitch, store.velocity, store.duration, store.text_ref, store.texts
+    write_note, write_text = writer.note, writer.text
+    for i, kind in enumerate(store.kind):
+        if kind == NOTE:
+            write_note(pitch[i], velocity[i], duration[i], ch)
+        else:
+            write_text(texts[text_ref[i]])
+            if table is not None:
+                table.add(texts[text_ref[i]], store.abs_tick[i], writer.tell())
+
+def to_midi_file(stores, ticks_per_beat=None):
+    from mido import MidiFile
+    mid = MidiFile() if ticks_per_beat is None else MidiFile(ticks_per_beat=ticks_per_beat)
+    for store in stores:
+        mid.tracks.append(store.to_track())
+    return mid
@@ -0,0 +1,137 @@
+# ペイロードの枠組み（ヘッダ・トレーラ）
+# 通常: 先頭 4 バイト (big-endian) に元のバイト長を置く。
+# ストリーム: 長さが事前に分からないので先頭 4 バイトを STREAM_LENGTH にし、
+#             最後のノートの後に END:<len>:<crc32> テキストを置いて長さと全体 CRC を示す。
+# 圧縮: 長さの最上位ビット (COMPRESSED_FLAG) を立て、下位 31bit に圧縮後の長さ、
+#       ヘッダ直後の 1 バイトに圧縮方式 ID（compression 参照）を置く。
+from checksum import crc32
+from compression import CODEC_NAMES, NONE, Decompressor
+
+LENGTH_HEADER_SIZE = 4
+STREAM_LENGTH = 0xFFFFFFFF
+COMPRESSED_FLAG = 0x80000000
+END_PREFIX = "END:"
+
+def length_header(n, codec_id=NONE):
+    if codec_id == NONE:
+        return n.to_bytes(LENGTH_HEADER_SIZE, 'big')
+    if n >= COMPRESSED_FLAG:
+        raise ValueError(f"compressed payload too large: {n} bytes")
+    return (n | COMPRESSED_FLAG).to_bytes(LENGTH_HEADER_SIZE, 'big') + bytes([codec_id])
+
+def is_compressed(header_len, codec_byte):
+    # 方式 ID が既知のときだけ圧縮とみなす（壊れた長さヘッダを従来どおり長さとして扱うため）
+    return (header_len != STREAM_LENGTH and bool(header_len & COMPRESSED_FLAG)
+            and codec_byte is not None and codec_byte != NONE and codec_byte in CODEC_NAMES)
+
+def stream_header():
+    return length_header(STREAM_LENGTH)
+
+def format_end(length, crc):
+    return f"{END_PREFIX}{length}:{crc:08X}"
+
+def parse_end(text):
+    """END テキストから (length, crc) を返す。解釈できなければ None。"""
+    if not isinstance(text, str) or not text.startswith(END_PREFIX):
+        return None
+    parts = text.split(":")
+    try:
+        length = int(parts[1])
+        crc = int(parts[2], 16) if len(parts) > 2 else None
+    except (IndexError, ValueError):
+        return None
+    return length, crc
+
+def unframe(raw, end=None):
+    """復元バイト列 raw からヘッダを外して (payload, expected_len, trailer_ok) を返す。
+    end はストリーム形式の END トレーラ (length, crc)。"""
+    if len(raw) < LENGTH_HEADER_SIZE:
+        return raw, None, None
+    expected_len = int.from_bytes(raw[:LENGTH_HEADER_SIZE], 'big')
+    body = raw[LENGTH_HEADER_SIZE:]
+    if is_compressed(expected_len, body[0] if body else None):
+        # 圧縮: 圧縮後の長さぶんを伸長する。expected_len は圧縮後の長さ
+        n = expected_len & ~COMPRESSED_FLAG
+        d = Decompressor(body[0])
+        payload = d.feed(body[1:1 + n]) + d.flush()
+        return payload, n, None
+    trailer_ok = None
+    if expected_len == STREAM_LENGTH and end is not None:
+        expected_len = end[0]
+        if end[1] is not None:
+            trailer_ok = expected_len <= len(body) and crc32(body[:expected_len]) == end[1]
+    # 期待長が手元のバイト数内に収まればその分だけ取り出す。足りなければ残りをデコード。
+    if expected_len <= len(body):
+        return body[:expected_len], expected_len, trailer_ok
+    return body, expected_len, trailer_ok
+
+class StreamUnframer:
+    """unframe の逐次版。復元バイトを push するたびに確定したペイロード部分を返す。
+    ストリーム形式では末尾のパディング（6bit なら最大 1 バイト、hd モードでは最大 2 バイト）を
+    END が来るまで保留する。"""
+
+    HOLDBACK = 2
+
+    def __init__(self):
+        self._header = bytearray()
+        self._held = b""
+        self.expected_len = None
+        self.emitted = 0
+        self.trailer_ok = None
+        self._crc = 0
+        self.compressed = False
+        self._flagged = False
+        self._decomp = None
+        self._remaining = 0
+
+    def push(self, data):
+        if self.expected_len is None:
+            need = LENGTH_HEADER_SIZE - len(self._header)
+            self._header += data[:need]
+            data = data[need:]
+            if len(self._header) < LENGTH_HEADER_SIZE:
+                return b""
+            self.expected_len = int.from_bytes(self._header, 'big')
+            self._flagged = self.expected_len != STREAM_LENGTH and bool(self.expected_len & COMPRESSED_FLAG)
+        if self._flagged:
+            # 圧縮かどうかは次の 1 バイト（方式 ID）を見るまで決まらない
+            if not data:
+                return b""
+            self._flagged = False
+            if is_compressed(self.expected_len, data[0]):
+                # unframe と同じく expected_len は圧縮後の長さ
+                self.compressed = True
+                self.expected_len = self._remaining = self.expected_len & ~COMPRESSED_FLAG
+                self._decomp = Decompressor(data[0])
+                data = data[1:]
+        if self.compressed:
+            data = data[:self._remaining]
+            self._remaining -= len(data)
+            out = self._decomp.feed(data)
+        elif self.expected_len == STREAM_LENGTH:
+            data = self._held + data
+            cut = max(0, len(data) - self.HOLDBACK)
+            out, self._held = data[:cut], data[cut:]
+        else:
+            out = data[:max(0, self.expected_len - self.emitted)]
+        self.emitted += len(out)
+        self._crc = crc32(out, self._crc)
+        return out
+
+    def finish(self, end=None):
+        """入力終端で保留分を返す。end はストリーム形式の END トレーラ (length, crc)。"""
+        if self.expected_len is None:
+            # ヘッダにも満たない長さ: unframe と同様にそのまま返す
+            return bytes(self._header)
+        out = self._held
+        self._held = b""
+        if self._decomp is not None:
+            out = self._decomp.flush()
+        elif self.expected_len == STREAM_LENGTH and end is not None:
+            self.expected_len = end[0]
+            out = out[:max(0, end[0] - self.emitted)]
+        self.emitted += len(out)
+        self._crc = crc32(out, self._crc)
+        if end is not None and end[1] is not None:
+            self.trailer_ok = self.emitted == end[0] and self._crc == end[1]
+        return out
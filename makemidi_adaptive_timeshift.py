@@ -1,92 +1,340 @@
 # makemidi_adaptive のコピーを基に、キーフレーム音の duration を微小にずらす（+1 tick）実装
-from mido import Message, MidiFile, MidiTrack, MetaMessage
+# mido は MidiFile を返す経路でだけ使う（event_store / MidiTrackSink で遅延 import）
 import os
+import shutil
+import tempfile
+from array import array
+from math import lcm
+
+from codebook import (
+    NOTE_NAMES,
+    KEYFRAME_INTERVAL, BASE_VELOCITY, KEYFRAME_DURATION_SHIFT,
+    DEFAULT_PREV, NOTE_MIDI, PROB_TABLES, MAPPINGS, BITS_TO_NOTE, SLOT_OFFSET,
+)
+from bitpack import SYMBOL_BITS, bytes_to_symbols, symbols_to_bytes
+from checksum import DEFAULT_CHECKSUM, check_checksum, checksum, crc32, hex_digits
+from sync_marker import format_sync
+from framing import length_header, stream_header, format_end
+from smf_stream import SmfTrackWriter
+from codec_log import get_log, level_from_env
+from compression import CODEC_NAMES, NONE, compress_payload
+from codec_mode import CLASSIC, CLASSIC_BITS, get_mode
+from stripes import STRIPE_CHANNELS, check_stripes, format_stripe, split_symbols
+from codec_stats import TimedSink, clock, get_stats, stats_from_env
+from event_store import EventStore, to_midi_file, write_smf
+import codec_numpy
 
-# ---------------------------
-# 音階・基準設定 (エンコーダと一致)
-# ---------------------------
-NOTE_NAMES = ["G3", "A3", "B3", "C4", "D4", "E4", "F4", "G4", "A4", "B4", "C5"]
-NOTE_TO_MIDI = {
-    "G3": 55, "A3": 57, "B3": 59,
-    "C4": 60, "D4": 62, "E4": 64, "F4": 65,
-    "G4": 67, "A4": 69, "B4": 71, "C5": 72
-}
-
-RELATIVE_WEIGHTS = [1, 2, 3, 3, 3, 2, 1, 1]
-
-DURATION_TABLE = {
-    "00": 480,
-    "01": 240,
-    "10": 960,
-    "11": 720
-}
-
-# キーフレーム設定
-KEYFRAME_INTERVAL = 20
-BASE_VELOCITY = 80
-KEYFRAME_PHRASE = [
-    ("D4", 240), ("E4", 240), ("A4", 240), ("A3", 240)
-]
 KEYFRAME_VELOCITY = BASE_VELOCITY
-# 微小時間ずらし (ticks) を導入
-KEYFRAME_DURATION_SHIFT = 1  # キーフレーム音は duration を +1 tick する
-
-def make_probability_table(prev_note):
-    if prev_note not in NOTE_NAMES:
-        prev_note = "C4"
-    center_index = NOTE_NAMES.index(prev_note)
-    prob_table = {}
-    for offset, weight in enumerate(RELATIVE_WEIGHTS):
-        rel_idx = offset - 3
-        target_index = center_index + rel_idx
-        if 0 <= target_index < len(NOTE_NAMES):
-            note = NOTE_NAMES[target_index]
-            prob_table[note] = prob_table.get(note, 0) + weight
-    total = sum(prob_table.values()) or 1
-    for k in list(prob_table.keys()):
-        prob_table[k] = prob_table[k] / total
-    return prob_table
-
-def make_mapping_from_prob_table(prob_table):
-    notes = []
-    for note in NOTE_NAMES:
-        prob = prob_table.get(note, 0)
-        if prob <= 0:
-            continue
-        count = max(1, round(prob * 16))
-        notes.extend([note] * count)
-    while len(notes) < 16:
-        notes.append(list(prob_table.keys())[len(prob_table)//2])
-    notes = notes[:16]
-    return {format(i, '04b'): notes[i] for i in range(16)}
-
-def print_mapping_verbose(prob_table, mapping, step, prev_note, chunk, pitch_bits_for_map, slot_index):
-    print("\n--- ENCODE STEP (詳細) ---")
-    print(f"Step {step} | prev_note={prev_note} | input_chunk={chunk} (pitch={chunk[:4]} dur={chunk[4:]})")
-    print("確率分布:")
+
+def print_mapping_verbose(prob_table, mapping, step, prev_note, chunk, pitch_bits_for_map, slot_index, file=None):
+    print("\n--- ENCODE STEP (詳細) ---", file=file)
+    print(f"Step {step} | prev_note={prev_note} | input_chunk={chunk} (pitch={chunk[:4]} dur={chunk[4:]})", file=file)
+    print("確率分布:", file=file)
     for n, p in prob_table.items():
-        print(f"  {n:<3}: {p:.4f} {'#'*int(p*40)}")
-    print("4bit -> 音 のマッピング (index順):")
+        print(f"  {n:<3}: {p:.4f} {'#'*int(p*40)}", file=file)
+    print("4bit -> 音 のマッピング (index順):", file=file)
     for bits in sorted(mapping.keys(), key=lambda x: int(x,2)):
         mark = "<-- selected" if bits == pitch_bits_for_map else ""
-        print(f"  {bits} -> {mapping[bits]:4s} {mark}")
-    print(f"pitch_bits_for_map={pitch_bits_for_map} slot_index={slot_index}")
+        print(f"  {bits} -> {mapping[bits]:4s} {mark}", file=file)
+    print(f"pitch_bits_for_map={pitch_bits_for_map} slot_index={slot_index}", file=file)
+
+class MidiTrackSink:
+    """TimeshiftEncoder の出力先: mido の MidiTrack に Message を積む。"""
+
+    def __init__(self, track, channel=0):
+        from mido import Message, MetaMessage
+        self._message = Message
+        self._meta = MetaMessage
+        self.track = track
+        self.channel = channel
+
+    def note(self, note_num, velocity, duration):
+        self.track.append(self._message('note_on', channel=self.channel, note=note_num, velocity=velocity, time=0))
+        self.track.append(self._message('note_off', channel=self.channel, note=note_num, velocity=0, time=duration))
+
+    def text(self, text):
+        self.track.append(self._meta('text', text=text, time=0))
+
+class TimeshiftEncoder:
+    """6bit シンボルを受け取り、ノートと SYNC を sink に書き出す状態機械。
+    prev_note・ブロック内シンボル・ステップ数を保持するので、入力を分割して feed してよい。
+    SYNC を書くたびに on_sync(step, crc) を呼ぶ（進捗表示用）。
+    sync_offsets が真なら SYNC に累積ビット数 off= を書く（sync_marker 参照）。
+    stats（codec_stats）が有効なら lookup / events / crc の時間と notes / sync_blocks を数える。"""
+
+    def __init__(self, sink, log=None, checksum_algo=DEFAULT_CHECKSUM, mode=CLASSIC, on_sync=None, stats=None,
+                 sync_offsets=False):
+        check_checksum(checksum_algo)
+        self.stats = stats = get_stats(stats)
+        # EventStore への書き込みなら大きな入力は codec_numpy でまとめて処理できる
+        self.store = sink if isinstance(sink, EventStore) else None
+        if stats.on:
+            sink = TimedSink(sink, stats)
+        self.sink = sink
+        self.on_sync = on_sync
+        self.log = get_log(log)
+        self.checksum_algo = checksum_algo
+        self.sync_offsets = sync_offsets
+        self.mode = mode
+        self.prev = DEFAULT_PREV
+        # 6bit なら 1 シンボル 1 バイト、hd モードは 16bit 配列
+        self.block_syms = bytearray() if mode.bits == SYMBOL_BITS else array('H')
+        self.notes_since_keyframe = 0
+        self.step = 0
+        if mode.header_text is not None:
+            # hd モードはトラック先頭でモードを宣言する
+            sink.text(mode.header_text)
+
+    def can_bulk(self):
+        """codec_numpy の一括経路を使えるか（出力先が EventStore で、ノート・ブロック単位のログが無く、
+        まだ何も書いていない）。"""
+        log = self.log
+        return (self.store is not None and self.step == 0 and not self.block_syms
+                and not (log.note_text or log.note_trace or log.block_text or log.block_trace))
+
+    def feed(self, symbols):
+        if self.can_bulk():
+            bulk = codec_numpy.backend(len(symbols))
+            if bulk is not None:
+                bulk.encode_into(self, symbols)
+                return
+        sink = self.sink
+        mode = self.mode
+        bits = mode.bits
+        low_bits, dur_bits, vel_mask, dur_mask = mode.low_bits, mode.dur_bits, mode.vel_mask, mode.dur_mask
+        velocity_base, vel_stride, durations = mode.velocity_base, mode.vel_stride, mode.durations
+        log = self.log
+        note_text, note_trace = log.note_text, log.note_trace
+        block_text, block_trace = log.block_text, log.block_trace
+        on_sync = self.on_sync
+        checksum_algo = self.checksum_algo
+        sync_offsets = self.sync_offsets
+        prev = self.prev
+        block_syms = self.block_syms
+        notes_since_keyframe = self.notes_since_keyframe
+        timing = self.stats.on
+        if timing:
+            t_start = clock()
+            step_start = self.step
+            crc_time = 0.0
+            blocks = 0
+
+        for step, chunk_sym in enumerate(symbols, self.step + 1):
+            sym = chunk_sym >> low_bits
+            dur_code = chunk_sym & dur_mask
+
+            # 事前計算済みコードブックから音と同音候補内の順位を引く
+            note_idx = BITS_TO_NOTE[prev][sym]
+            slot_index = SLOT_OFFSET[prev][sym]
+
+            if note_text:
+                chunk = format(chunk_sym, f'0{bits}b')
+                print_mapping_verbose(PROB_TABLES[prev], MAPPINGS[prev], step, NOTE_NAMES[prev], chunk, chunk[:4], slot_index,
+                                      file=log.stream)
+
+            duration = durations[dur_code]
+            new_velocity = velocity_base + ((chunk_sym >> dur_bits) & vel_mask) * vel_stride + slot_index
+            if new_velocity > 127:
+                new_velocity = 127
+
+            # decide whether THIS data note is the KEYFRAME (i.e. the N=KEYFRAME_INTERVAL-th note)
+            is_keyframe_note = (notes_since_keyframe + 1) >= KEYFRAME_INTERVAL
+
+            # append data note; if it's keyframe note, add duration shift to its note_off
+            off_time = duration + (KEYFRAME_DURATION_SHIFT if is_keyframe_note else 0)
+            sink.note(NOTE_MIDI[note_idx], new_velocity, off_time)
+            if note_trace:
+                log.trace_note(step, NOTE_MIDI[note_idx], new_velocity, off_time, chunk_sym)
+
+            # accumulate symbols (include this 20th note's bits)
+            block_syms.append(chunk_sym)
+
+            # update notes counter / handle keyframe action AFTER adding the 20th note
+            notes_since_keyframe += 1
+            if is_keyframe_note:
+                if timing:
+                    t_crc = clock()
+                    crc = checksum(checksum_algo, symbols_to_bytes(block_syms, bits))
+                    crc_time += clock() - t_crc
+                    blocks += 1
+                else:
+                    crc = checksum(checksum_algo, symbols_to_bytes(block_syms, bits))
+                # emit SYNC text immediately after the shifted note_off
+                last_note = NOTE_NAMES[note_idx]
+                if sync_offsets:
+                    sync_text = format_sync(step, last_note, crc, checksum_algo, off=step * bits)
+                else:
+                    sync_text = format_sync(step, last_note, crc, checksum_algo)
+                sink.text(sync_text)
+                if block_trace:
+                    log.trace_sync(step, crc, crc)
+                elif block_text:
+                    log.write(f"[SYNC(timeshift) WRITE] step={step} block_bits_len={len(block_syms) * bits} crc={crc:0{hex_digits(checksum_algo)}X} keyframe_note={last_note} text='{sync_text}'")
+                del block_syms[:]
+                notes_since_keyframe = 0
+                if on_sync is not None:
+                    on_sync(step, crc)
+
+            prev = note_idx
+            self.step = step
+
+        self.prev = prev
+        self.notes_since_keyframe = notes_since_keyframe
+        if timing:
+            stats = self.stats
+            events = sink.flush()
+            stats.add_time("crc", crc_time)
+            stats.add_time("lookup", clock() - t_start - events - crc_time)
+            stats.add("notes", self.step - step_start)
+            stats.add("sync_blocks", blocks)
+
+def encode_events(payload_bytes, log=None, checksum_algo=DEFAULT_CHECKSUM, compress=None, bits_per_note=CLASSIC_BITS,
+                  stripes=1, on_sync=None, stats=None, sync_offsets=False):
+    """payload_bytes を timeshift 方式でエンコードし、トラックごとの EventStore のリストを返す。
+    log はログ出力（codec_log.get_log 参照）、checksum_algo は SYNC ブロックの CRC 種別（crc8 / crc16 / crc32）。
+    compress は圧縮方式（None / "auto" / "zlib" / "lzma" / "bz2"、compression 参照）。
+    bits_per_note は 1 ノートのビット数（6 は従来方式、7〜14 は codec_mode の hd モード）。
+    stripes > 1 ならシンボルを stripes 本のトラックに振り分けて同時に鳴らす（stripes 参照）。
+    on_sync(step, crc) は SYNC を書くたびに呼ばれる（TimeshiftEncoder 参照）。
+    stats は段階ごとの計測（codec_stats.get_stats が受け付ける値）。
+    sync_offsets が真なら SYNC に累積ビット数 off= を書く（resync 復号用。既定では書かない）。"""
+    log = get_log(log)
+    stats = get_stats(stats)
+    mode = get_mode(bits_per_note)
+    check_stripes(stripes)
+    # 1 ブロックに満たない入力では CRC を計算しないので、種別はここで確かめる
+    check_checksum(checksum_algo)
+    stats.add("payload_bytes", len(payload_bytes))
+    with stats.stage("compress"):
+        codec_id, body = compress_payload(payload_bytes, compress)
+    if codec_id != NONE:
+        log.summary(f"[ENCODE INFO] compression={CODEC_NAMES[codec_id]} {len(payload_bytes)} -> {len(body)} bytes")
+    # 先頭に（圧縮後の）バイト長を 4 バイト（big-endian）で付与しておく
+    with stats.stage("pack"):
+        bytes_data = length_header(len(body), codec_id) + body
+        # 6bit シンボル列（1 シンボル 1 バイト）。末尾の端数はゼロで埋まる
+        bulk = codec_numpy.backend(len(bytes_data) * 8 // mode.bits)
+        if bulk is not None:
+            symbols = bulk.bytes_to_symbols(bytes_data, mode.bits)
+        else:
+            symbols = bytes_to_symbols(bytes_data, mode.bits)
+
+    if log.summary_on:
+        # DEBUG: エンコード情報出力（ビット・チャンク数・末尾チャンク）
+        log.write(f"[ENCODE INFO] payload_bytes_len={len(payload_bytes)} total_bytes_len={len(bytes_data)} "
+              f"binary_bits_len={len(bytes_data) * 8} chunks={len(symbols)} last_chunk={format(symbols[-1], f'0{mode.bits}b')!r}")
+
+    log.summary("\n=== Adaptive MIDI Encoding (timeshift keyframe) ===")
+    if stripes == 1:
+        store = EventStore()
+        TimeshiftEncoder(store, log, checksum_algo, mode, on_sync, stats, sync_offsets).feed(symbols)
+        return [store]
+
+    # ストライプごとに独立したトラック・チャンネル・エンコーダ状態を持つ
+    stores = []
+    for k, part in enumerate(split_symbols(symbols, stripes)):
+        store = EventStore(STRIPE_CHANNELS[k])
+        stores.append(store)
+        store.text(format_stripe(k, stripes))
+        log.summary(f"--- stripe {k}/{stripes} (channel {STRIPE_CHANNELS[k]}) symbols={len(part)} ---")
+        TimeshiftEncoder(store, log, checksum_algo, mode, on_sync, stats, sync_offsets).feed(part)
+    return stores
+
+def encode_bytes(payload_bytes, log=None, checksum_algo=DEFAULT_CHECKSUM, compress=None, bits_per_note=CLASSIC_BITS,
+                 stripes=1, on_sync=None, stats=None, sync_offsets=False):
+    """payload_bytes を timeshift 方式でエンコードした MidiFile を返す（保存はしない）。
+    引数は encode_events と同じ。mido のメッセージは最後にまとめて作る。"""
+    stores = encode_events(payload_bytes, log, checksum_algo, compress, bits_per_note, stripes, on_sync, stats,
+                           sync_offsets)
+    stats = get_stats(stats)
+    with stats.stage("events"):
+        return to_midi_file(stores)
+
+def save_events(stores, path, stats=None, seek_index=False):
+    """EventStore のリストを mido を介さずに .mid として保存する（MidiFile.save と同じバイト列）。
+    seek_index が真なら範囲復号用の索引トラックを足す（seek_index 参照）。"""
+    with get_stats(stats).stage("write"), open(path, "wb") as f:
+        write_smf(stores, f, seek_index=seek_index)
+
+# ストリーム入力の読み込み単位（3 の倍数なのでシンボル境界がずれない）
+STREAM_READ_SIZE = 3 * 16384
 
-def crc8_bits(bitstr):
-    if len(bitstr) % 8 != 0:
-        bitstr = bitstr + '0' * (8 - (len(bitstr) % 8))
-    data = [int(bitstr[i:i+8], 2) for i in range(0, len(bitstr), 8)]
+def stream_encode(src, dst, checksum_algo=DEFAULT_CHECKSUM, length=None, read_size=STREAM_READ_SIZE,
+                  bits_per_note=CLASSIC_BITS, stats=None, sync_offsets=False, seek_index=False):
+    """バイナリストリーム src を読みながら SMF を dst に逐次書き出す（メモリ使用量は入力長に依存しない）。
+    length を与えた場合は従来どおりの長さヘッダを使い、encode_bytes と同一のファイルになる。
+    与えない場合はストリーム形式（STREAM_LENGTH ヘッダ + END トレーラ）で書く。
+    seek_index が真なら末尾に範囲復号用の索引トラックを足す（seek_index 参照）。
+    dst がシーク不可（パイプ等）のときは一時ファイルに書いてからコピーする。"""
+    check_checksum(checksum_algo)
+    if not dst.seekable():
+        with tempfile.TemporaryFile() as tmp:
+            n = stream_encode(src, tmp, checksum_algo, length, read_size, bits_per_note, stats, sync_offsets,
+                              seek_index)
+            tmp.seek(0)
+            shutil.copyfileobj(tmp, dst)
+        return n
+
+    stats = get_stats(stats)
+    mode = get_mode(bits_per_note)
+    # 読み込み単位はシンボル境界に揃える（6bit なら 3 バイト = 4 シンボル）
+    group = lcm(8, mode.bits) // 8
+    read_size -= read_size % group
+    writer = SmfTrackWriter(dst, n_tracks=2 if seek_index else 1)
+    if seek_index:
+        from seek_index import SeekRecorder
+        writer = SeekRecorder(writer)
+    # SmfTrackWriter はイベントをそのままファイルに書くので、events には SMF の書き出しも含まれる
+    enc = TimeshiftEncoder(writer, checksum_algo=checksum_algo, mode=mode, stats=stats, sync_offsets=sync_offsets)
+    pending = length_header(length) if length is not None else stream_header()
+    total = 0
     crc = 0
-    for b in data:
-        crc ^= b
-        for _ in range(8):
-            if crc & 0x80:
-                crc = ((crc << 1) & 0xFF) ^ 0x07
-            else:
-                crc = (crc << 1) & 0xFF
-    return crc
+    read = stats.stage("read")
+    pack = stats.stage("pack")
+    while True:
+        with read:
+            block = src.read(read_size)
+        if not block:
+            break
+        total += len(block)
+        with pack:
+            crc = crc32(block, crc)
+            pending += block
+            cut = len(pending) - len(pending) % group
+            symbols = bytes_to_symbols(pending[:cut], mode.bits)
+            pending = pending[cut:]
+        enc.feed(symbols)
+    # 残り（3 バイト未満）は末尾パディング付きでシンボル化
+    enc.feed(bytes_to_symbols(pending, mode.bits))
+    if length is None:
+        writer.text(format_end(total, crc))
+    elif length != total:
+        raise ValueError(f"length mismatch: header={length} actual={total}")
+    with stats.stage("write"):
+        writer.close()
+    stats.add("payload_bytes", total)
+    return total
 
-def main():
+def encode_text(text, log=None, checksum_algo=DEFAULT_CHECKSUM, compress=None, bits_per_note=CLASSIC_BITS,
+                stripes=1, stats=None):
+    # UTF-8 バイト列でエンコード（日本語・絵文字を正しく扱う）
+    return encode_bytes(text.encode('utf-8'), log=log, checksum_algo=checksum_algo, compress=compress,
+                        bits_per_note=bits_per_note, stripes=stripes, stats=stats)
+
+def encode_text_events(text, log=None, checksum_algo=DEFAULT_CHECKSUM, compress=None, bits_per_note=CLASSIC_BITS,
+                       stripes=1, stats=None):
+    return encode_events(text.encode('utf-8'), log=log, checksum_algo=checksum_algo, compress=compress,
+                         bits_per_note=bits_per_note, stripes=stripes, stats=stats)
+
+def output_filename_for(title, output_dir="mid"):
+    # タイトルにすでに "_timeshift" が含まれている場合は重複させない
+    if title.endswith("_timeshift"):
+        out_basename = f"{title}.mid"
+    else:
+        out_basename = f"{title}_timeshift.mid"
+    return os.path.join(output_dir, out_basename)
+
+def read_text_and_title():
     import sys
     # stdin がパイプ/リダイレクトの場合は全入力を読み取り、
     # 「末尾の空でない行」を title、それ以前を text（改行を保持）とする。
@@ -122,88 +370,26 @@ def main():
             # 空なら1行入力にフォールバック
             text = input("Empty input — Enter single-line text to encode: ")
         title = input("Enter title for MIDI data: ")
+    return text, title
 
-    # UTF-8 バイト列でエンコード（日本語・絵文字を正しく扱う）
-    payload_bytes = text.encode('utf-8')
-    # 先頭に元のバイト長を 4 バイト（big-endian）で付与しておく
-    length_header = len(payload_bytes).to_bytes(4, 'big')
-    bytes_data = length_header + payload_bytes
-    binary_data = ''.join(f'{b:08b}' for b in bytes_data)
-    chunks = [binary_data[i:i+6].ljust(6, '0') for i in range(0, len(binary_data), 6)]
-
-    # DEBUG: エンコード情報出力（ビット・チャンク数・末尾チャンク）
-    print(f"[ENCODE INFO] payload_bytes_len={len(payload_bytes)} total_bytes_len={len(bytes_data)} "
-          f"binary_bits_len={len(binary_data)} chunks={len(chunks)} last_chunk={chunks[-1]!r}")
-
-    mid = MidiFile()
-    track = MidiTrack()
-    mid.tracks.append(track)
-
-    prev_note = "C4"
-    block_bits = ""
-    notes_since_keyframe = 0
-    print("\n=== Adaptive MIDI Encoding (timeshift keyframe) ===")
-
-    for step, chunk in enumerate(chunks, 1):
-        pitch_bits = chunk[:4]
-        dur_bits = chunk[4:]
-        pitch_bits_for_map = pitch_bits
-
-        prob_table = make_probability_table(prev_note)
-        mapping = make_mapping_from_prob_table(prob_table)
-
-        candidates = [b for b, n in mapping.items() if n == mapping[pitch_bits_for_map]]
-        candidates.sort(key=lambda x: int(x,2))
-        try:
-            slot_index = candidates.index(pitch_bits_for_map)
-        except ValueError:
-            slot_index = 0
-
-        print_mapping_verbose(prob_table, mapping, step, prev_note, chunk, pitch_bits_for_map, slot_index)
-
-        note_name = mapping[pitch_bits_for_map]
-        duration = DURATION_TABLE[dur_bits]
-        new_velocity = BASE_VELOCITY + slot_index
-        if new_velocity > 127:
-            new_velocity = 127
-
-        note_num = NOTE_TO_MIDI[note_name]
-
-        # decide whether THIS data note is the KEYFRAME (i.e. the N=KEYFRAME_INTERVAL-th note)
-        is_keyframe_note = (notes_since_keyframe + 1) >= KEYFRAME_INTERVAL
-
-        # append data note; if it's keyframe note, add duration shift to its note_off
-        track.append(Message('note_on', note=note_num, velocity=new_velocity, time=0))
-        off_time = duration + (KEYFRAME_DURATION_SHIFT if is_keyframe_note else 0)
-        track.append(Message('note_off', note=note_num, velocity=0, time=off_time))
-
-        # accumulate bits (include this 20th note's bits)
-        block_bits += pitch_bits + dur_bits
-
-        # update notes counter / handle keyframe action AFTER adding the 20th note
-        notes_since_keyframe += 1
-        if is_keyframe_note:
-            crc = crc8_bits(block_bits)
-            # emit SYNC text immediately after the shifted note_off
-            last_note = note_name
-            sync_text = f"SYNC:{step}:{last_note}:{crc:02X}"
-            track.append(MetaMessage('text', text=sync_text, time=0))
-            print(f"[SYNC(timeshift) WRITE] step={step} block_bits_len={len(block_bits)} crc={crc:02X} keyframe_note={last_note} text='{sync_text}'")
-            block_bits = ""
-            notes_since_keyframe = 0
-
-        prev_note = note_name
+def main():
+    # TIMESHIFT_STATS=1（,profile / ,memory）で段階ごとの計測を artifacts/<title>_encode_stats.json に書く
+    stats = stats_from_env()
+    if stats.on:
+        stats.start()
+    with stats.stage("read"):
+        text, title = read_text_and_title()
+    # 長文は圧縮した方がノート数（演奏時間）が減る。短くならなければ圧縮しない
+    stores = encode_text_events(text, log=level_from_env(), compress="auto", stats=stats)
 
     output_dir = "mid"
     os.makedirs(output_dir, exist_ok=True)
-    # タイトルにすでに "_timeshift" が含まれている場合は重複させない
-    if title.endswith("_timeshift"):
-        out_basename = f"{title}.mid"
-    else:
-        out_basename = f"{title}_timeshift.mid"
-    output_filename = os.path.join(output_dir, out_basename)
-    mid.save(output_filename)
+    output_filename = output_filename_for(title, output_dir)
+    save_events(stores, output_filename, stats)
     print(f"\nMIDI saved: {output_filename}")
+    if stats.on:
+        stats.stop()
+        print(f"stats: {stats.save(os.path.splitext(os.path.basename(output_filename))[0] + '_encode')}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,260 @@
+# mid/ の .mid ファイルのメタデータ索引（artifacts/mid_index.sqlite3）
+# ファイルごとに タイトル・サイズ・mtime・ノート数・SYNC 数・長さヘッダの値・コーデック・最後の検証結果 を持つ。
+# update はディレクトリを走査し、size と mtime_ns が前回と同じファイルは読まずに済ませ、
+# 新しい・変わったファイルだけ復号して検証し直す（消えたファイルの行は消す）。
+#
+#   index = MidIndex()
+#   index.update()                      # mid/ の差分だけ反映
+#   index.find(min_payload=1024)        # ペイロードが 1 KB 以上のもの
+#   index.find(crc_ok=False)            # CRC が合わないもの
+#
+# 一覧・絞り込みは SQLite への問い合わせだけで、MIDI ファイルは開かない。
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from midi_shared import ARTIFACTS_DIR, MID_DIR
+
+DB_PATH = ARTIFACTS_DIR / "mid_index.sqlite3"
+# 列や記録内容を変えたら上げる（古い索引は作り直す）
+INDEX_VERSION = 1
+MID_SUFFIX = ".mid"
+TITLE_SUFFIX = "_timeshift"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    title TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    notes INTEGER,
+    sync_count INTEGER,
+    header_len INTEGER,
+    payload_len INTEGER,
+    codec TEXT,
+    bits_per_note INTEGER,
+    crc_ok INTEGER,
+    crc_errors INTEGER,
+    trailer_ok INTEGER,
+    error TEXT,
+    verified_at REAL,
+    PRIMARY KEY (dir, name)
+);
+CREATE INDEX IF NOT EXISTS files_payload ON files (dir, payload_len);
+CREATE INDEX IF NOT EXISTS files_crc ON files (dir, crc_ok);
+"""
+
+_COLUMNS = ("dir", "name", "title", "size", "mtime_ns", "notes", "sync_count", "header_len", "payload_len", "codec",
+            "bits_per_note", "crc_ok", "crc_errors", "trailer_ok", "error", "verified_at")
+
+@dataclass
+class MidInfo:
+    dir: str
+    name: str
+    title: str
+    size: int
+    mtime_ns: int
+    notes: Optional[int]
+    sync_count: Optional[int]
+    # 先頭 4 バイトの長さヘッダの値（ストリーム形式は END の長さ、圧縮なら圧縮後の長さ）
+    header_len: Optional[int]
+    # 復号したペイロードのバイト数
+    payload_len: Optional[int]
+    # "classic" / "hd1" など（codec_mode）
+    codec: Optional[str]
+    bits_per_note: Optional[int]
+    crc_ok: Optional[bool]
+    crc_errors: Optional[int]
+    trailer_ok: Optional[bool]
+    # 読めなかったときの例外メッセージ
+    error: Optional[str]
+    verified_at: Optional[float]
+
+    @property
+    def path(self):
+        return Path(self.dir) / self.name
+
+def title_for(name):
+    """ファイル名からタイトル（output_filename_for の逆。_timeshift と拡張子を外す）。"""
+    stem = name[:-len(MID_SUFFIX)] if name.lower().endswith(MID_SUFFIX) else name
+    return stem[:-len(TITLE_SUFFIX)] if stem.endswith(TITLE_SUFFIX) else stem
+
+def _bool(value):
+    return None if value is None else bool(value)
+
+def scan_file(path):
+    """1 ファイルを復号して索引の列（dir, name, size, mtime_ns 以外）を dict で返す。"""
+    from codec_mode import CLASSIC_BITS, MODE_VERSION
+    from decode_adaptive_timeshift_decode import decode_smf
+    row = {"notes": None, "sync_count": None, "header_len": None, "payload_len": None, "codec": None,
+           "bits_per_note": None, "crc_ok": None, "crc_errors": None, "trailer_ok": None, "error": None}
+    try:
+        result = decode_smf(path)
+    except (ValueError, IndexError, OSError) as e:
+        row["error"] = str(e) or type(e).__name__
+    else:
+        bits = result.bits_per_note
+        row.update(notes=result.notes, sync_count=len(result.sync_blocks), header_len=result.expected_len,
+                   payload_len=len(result.payload), bits_per_note=bits,
+                   codec="classic" if bits == CLASSIC_BITS else f"hd{MODE_VERSION}",
+                   crc_ok=result.crc_ok, crc_errors=len(result.crc_errors), trailer_ok=result.trailer_ok)
+    row["verified_at"] = time.time()
+    return row
+
+def _scan_job(path):
+    return scan_file(path)
+
+class MidIndex:
+    def __init__(self, directory=MID_DIR, db_path=DB_PATH):
+        self.dir = Path(directory).resolve()
+        self.db_path = Path(db_path)
+        self._db = None
+
+    def _conn(self):
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(self.db_path))
+            if db.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+                db.execute("DROP TABLE IF EXISTS files")
+                db.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _stat_dir(self):
+        # name -> (size, mtime_ns)。ディレクトリが無ければ空
+        found = {}
+        try:
+            entries = os.scandir(self.dir)
+        except FileNotFoundError:
+            return found
+        with entries:
+            for e in entries:
+                if e.name.lower().endswith(MID_SUFFIX) and e.is_file():
+                    st = e.stat()
+                    found[e.name] = (st.st_size, st.st_mtime_ns)
+        return found
+
+    def update(self, force=False, workers=1):
+        """ディレクトリの変化を索引に反映する。(追加・更新した数, 消した数) を返す。
+        force なら変わっていないファイルも検証し直す。workers > 1 なら復号をプロセス並列にする。"""
+        db = self._conn()
+        d = str(self.dir)
+        known = {name: (size, mtime) for name, size, mtime in
+                 db.execute("SELECT name, size, mtime_ns FROM files WHERE dir = ?", (d,))}
+        found = self._stat_dir()
+        stale = [name for name in known if name not in found]
+        changed = sorted(name for name, st in found.items() if force or known.get(name) != st)
+        paths = [str(self.dir / name) for name in changed]
+        if workers > 1 and len(paths) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                rows = list(pool.map(_scan_job, paths, chunksize=16))
+        else:
+            rows = [scan_file(p) for p in paths]
+        with db:
+            db.executemany("DELETE FROM files WHERE dir = ? AND name = ?", [(d, name) for name in stale])
+            placeholders = ", ".join("?" * len(_COLUMNS))
+            db.executemany(f"INSERT OR REPLACE INTO files ({', '.join(_COLUMNS)}) VALUES ({placeholders})",
+                           [tuple({"dir": d, "name": name, "title": title_for(name), "size": found[name][0],
+                                   "mtime_ns": found[name][1], **row}[c] for c in _COLUMNS)
+                            for name, row in zip(changed, rows)])
+        return len(changed), len(stale)
+
+    def _rows(self, where="", params=()):
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM files WHERE dir = ?{where} ORDER BY name"
+        out = []
+        for row in self._conn().execute(sql, (str(self.dir),) + tuple(params)):
+            info = MidInfo(*row)
+            info.crc_ok = _bool(info.crc_ok)
+            info.trailer_ok = _bool(info.trailer_ok)
+            out.append(info)
+        return out
+
+    def get(self, name):
+        """ファイル名（またはパス）の MidInfo。索引に無ければ None。"""
+        rows = self._rows(" AND name = ?", (Path(name).name,))
+        return rows[0] if rows else None
+
+    def find(self, title=None, min_payload=None, max_payload=None, crc_ok=None, errors=None):
+        """条件に合う MidInfo のリスト（ファイル名順）。title はタイトルの部分一致、
+        crc_ok は検証結果、errors が真なら読めなかったファイルだけ（偽ならそれ以外）。"""
+        where, params = [], []
+        if title is not None:
+            where.append("instr(title, ?) > 0")
+            params.append(title)
+        if min_payload is not None:
+            where.append("payload_len >= ?")
+            params.append(min_payload)
+        if max_payload is not None:
+            where.append("payload_len <= ?")
+            params.append(max_payload)
+        if crc_ok is not None:
+            where.append("crc_ok = ?")
+            params.append(int(crc_ok))
+        if errors is not None:
+            where.append("error IS NOT NULL" if errors else "error IS NULL")
+        return self._rows("".join(f" AND {w}" for w in where), params)
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM files WHERE dir = ?", (str(self.dir),)).fetchone()[0]
+
+def main(argv=None):
+    import argparse
+    import json
+    from dataclasses import asdict
+    ap = argparse.ArgumentParser(description="mid/ の .mid のメタデータ索引を更新して一覧・絞り込みする")
+    ap.add_argument("dir", nargs="?", default=str(MID_DIR))
+    ap.add_argument("--db", default=str(DB_PATH))
+    ap.add_argument("--no-update", action="store_true", help="索引を更新せずに問い合わせだけする")
+    ap.add_argument("--force", action="store_true", help="変わっていないファイルも検証し直す")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--title", default=None, help="タイトルの部分一致")
+    ap.add_argument("--min-bytes", type=int, default=None, help="ペイロードがこのバイト数以上")
+    ap.add_argument("--max-bytes", type=int, default=None, help="ペイロードがこのバイト数以下")
+    ap.add_argument("--crc-errors", action="store_true", help="CRC が合わないファイルだけ")
+    ap.add_argument("--unreadable", action="store_true",
+                    help="読めなかったファイルだけ（--crc-errors と合わせるとその後ろに並べる）")
+    ap.add_argument("--json", action="store_true", help="1 行 1 ファイルの JSON で出す")
+    args = ap.parse_args(argv)
+
+    with MidIndex(args.dir, args.db) as index:
+        if not args.no_update:
+            t0 = time.perf_counter()
+            n_changed, n_removed = index.update(force=args.force, workers=args.workers)
+            print(f"index: {len(index)} files ({n_changed} scanned, {n_removed} removed, "
+                  f"{time.perf_counter() - t0:.3f}s)", file=sys.stderr)
+        query = dict(title=args.title, min_payload=args.min_bytes, max_payload=args.max_bytes)
+        if args.crc_errors or args.unreadable:
+            # CRC の合わないファイルと読めなかったファイルは別々に問い合わせ、この順に並べる
+            rows = ((index.find(crc_ok=False, **query) if args.crc_errors else [])
+                    + (index.find(errors=True, **query) if args.unreadable else []))
+        else:
+            rows = index.find(**query)
+    for r in rows:
+        if args.json:
+            print(json.dumps(asdict(r), ensure_ascii=False))
+        else:
+            status = "error" if r.error else ("ok" if r.crc_ok else "crc-ng")
+            print(f"{r.name:40s} {r.size:>9d} {r.notes if r.notes is not None else '-':>8} "
+                  f"{r.payload_len if r.payload_len is not None else '-':>8} {r.codec or '-':7s} {status}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
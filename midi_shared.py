@@ -1,14 +1,11 @@
 # 共通定義・パス
 from pathlib import Path
-import os
 
 ROOT = Path(__file__).parent
 MID_DIR = ROOT / "mid"
 ARTIFACTS_DIR = ROOT / "artifacts"
 ENCODERS_DIR = ROOT
 
-MID_DIR.mkdir(exist_ok=True)
-ARTIFACTS_DIR.mkdir(exist_ok=True)
 
 ENCODER_SCRIPT = "makemidi_adaptive_timeshift.py"
 DECODER_SCRIPT = "decode_adaptive_timeshift_decode.py"
@@ -24,5 +21,11 @@ SAMPLE_TEXTS = [
     "Emoji test 👍🚀🎵",
 ]
 
+def ensure_dir(path):
+    # import 時にはディレクトリを作らない。書き込む直前に呼ぶ
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
 def script_path(name: str):
     return str((ROOT / name).resolve())
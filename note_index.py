@@ -0,0 +1,213 @@
+# MIDI イベント列を 1 パスで走査し、note_on/note_off の対応を取った索引を作る
+# 従来は note_on ごとに前方へ note_off を探し直していた（重なり・欠落があると O(n^2)）。
+# ここではデルタ時間を絶対 tick に直しながら、音高ごとの未解決 note_on を保持して対応付ける。
+from array import array
+from collections import deque
+
+from framing import END_PREFIX
+from codec_mode import MODE_PREFIX
+
+# note_off の後、この件数以内のメッセージに SYNC テキストがあればそのノートに紐づける
+SYNC_WINDOW = 64
+
+class NoteIndex:
+    """ノート 1 個 = 各配列の同じ添字。off_tick / sync は対応なしのとき -1。"""
+
+    __slots__ = ("on_tick", "off_tick", "note", "velocity", "sync",
+                 "on_msg", "off_msg", "sync_texts", "sync_msgs", "text_msgs", "end_text", "mode_text", "msg_count")
+
+    def __init__(self):
+        self.on_tick = array('q')
+        self.off_tick = array('q')
+        self.note = array('B')
+        self.velocity = array('B')
+        self.sync = array('l')
+        # 元のメッセージ列での位置（キーフレーム検出・表示用）
+        self.on_msg = array('q')
+        self.off_msg = array('q')
+        self.sync_texts = []
+        self.sync_msgs = array('q')
+        self.text_msgs = array('q')
+        # ストリーム形式の END トレーラ（framing.format_end）
+        self.end_text = None
+        # hd モードの宣言（codec_mode.MODE_PREFIX）。最初の 1 つだけを採る
+        self.mode_text = None
+        self.msg_count = 0
+
+    def __len__(self):
+        return len(self.on_tick)
+
+    def duration(self, i):
+        off = self.off_tick[i]
+        return None if off < 0 else off - self.on_tick[i]
+
+    def sync_text(self, i):
+        k = self.sync[i]
+        return None if k < 0 else self.sync_texts[k]
+
+class NoteIndexBuilder:
+    """メッセージを 1 件ずつ feed して NoteIndex を組み立てる。"""
+
+    def __init__(self, sync_window=SYNC_WINDOW):
+        self.index = NoteIndex()
+        self.sync_window = sync_window
+        self._tick = 0
+        self._open = {}          # pitch -> 未解決の note id リスト
+        self._waiting = deque()  # note_off 済みで SYNC 待ちの note id（off_msg 昇順）
+
+    def feed(self, delta, kind, note=None, velocity=0, text=None):
+        ix = self.index
+        pos = ix.msg_count
+        ix.msg_count += 1
+        self._tick += delta
+        if kind == "note_on" and velocity > 0:
+            nid = len(ix.on_tick)
+            ix.on_tick.append(self._tick)
+            ix.off_tick.append(-1)
+            ix.note.append(note)
+            ix.velocity.append(velocity)
+            ix.sync.append(-1)
+            ix.on_msg.append(pos)
+            ix.off_msg.append(-1)
+            self._open.setdefault(note, []).append(nid)
+        elif kind == "note_off" or kind == "note_on":
+            # 同じ音高で未解決の note_on はすべてこの note_off と組にする
+            # （従来の「直後の note_off を探す」前方走査と同じ結果になる）
+            pending = self._open.get(note)
+            if pending:
+                waiting = self._waiting
+                for nid in pending:
+                    ix.off_tick[nid] = self._tick
+                    ix.off_msg[nid] = pos
+                    waiting.append(nid)
+                pending.clear()
+                self._expire(pos)
+        elif kind == "text":
+            ix.text_msgs.append(pos)
+            if isinstance(text, str) and text.startswith("SYNC:"):
+                k = len(ix.sync_texts)
+                ix.sync_texts.append(text)
+                ix.sync_msgs.append(pos)
+                self._expire(pos)
+                for nid in self._waiting:
+                    ix.sync[nid] = k
+                self._waiting.clear()
+            elif isinstance(text, str) and text.startswith(END_PREFIX):
+                ix.end_text = text
+            elif isinstance(text, str) and text.startswith(MODE_PREFIX) and ix.mode_text is None:
+                ix.mode_text = text
+
+    def _expire(self, pos):
+        waiting = self._waiting
+        off_msg = self.index.off_msg
+        while waiting and pos - off_msg[waiting[0]] > self.sync_window:
+            waiting.popleft()
+
+    def has_open_notes(self):
+        """note_off の来ていない note_on が残っているか。"""
+        return any(self._open.values())
+
+    def has_waiting_notes(self):
+        """SYNC 待ちのノートが残っているか（この後の SYNC に紐づく可能性がある）。"""
+        return bool(self._waiting)
+
+    def finish(self):
+        return self.index
+
+def feed_messages(feed, messages):
+    """mido のメッセージ列を feed(delta, kind, note, velocity, text) の形に直して流す。
+    mido との境界はここだけで、属性は種類ごとに必要なものしか読まない。"""
+    for m in messages:
+        kind = m.type
+        if kind == "note_on" or kind == "note_off":
+            feed(m.time, kind, m.note, m.velocity)
+        elif kind == "text":
+            feed(m.time, kind, None, 0, m.text)
+        else:
+            feed(getattr(m, "time", 0), kind)
+
+def build_note_index(messages, sync_window=SYNC_WINDOW):
+    """mido のメッセージ列（複数トラックを連結したものでも可）から NoteIndex を作る。"""
+    b = NoteIndexBuilder(sync_window)
+    feed_messages(b.feed, messages)
+    return b.finish()
+
+class NoteStream:
+    """NoteIndexBuilder の逐次版。全ノートを保持せず、確定したノートから順に取り出す。
+    ノートは note_off が来て、かつ SYNC を待つ窓（SYNC_WINDOW 件）を過ぎるか SYNC が来た時点で確定する。
+    note_off の来ない note_on が max_pending 件以上溜まった場合は、先頭を対応なしとして確定させる
+    （バッチ版と結果が変わるのは、そのような壊れたファイルに限られる）。"""
+
+    def __init__(self, sync_window=SYNC_WINDOW, max_pending=1 << 16):
+        self.sync_window = sync_window
+        self.max_pending = max_pending
+        self.end_text = None
+        self.mode_text = None
+        self.msg_count = 0
+        self._tick = 0
+        # record: [on_tick, off_tick, note, velocity, off_msg, sync_text]
+        self._pending = deque()
+        self._open = {}
+        self._waiting = deque()
+
+    def feed(self, delta, kind, note=None, velocity=0, text=None):
+        pos = self.msg_count
+        self.msg_count += 1
+        self._tick += delta
+        if kind == "note_on" and velocity > 0:
+            rec = [self._tick, -1, note, velocity, -1, None]
+            self._pending.append(rec)
+            self._open.setdefault(note, []).append(rec)
+        elif kind == "note_off" or kind == "note_on":
+            pending = self._open.get(note)
+            if pending:
+                for rec in pending:
+                    rec[1] = self._tick
+                    rec[4] = pos
+                    self._waiting.append(rec)
+                pending.clear()
+        elif kind == "text":
+            if isinstance(text, str) and text.startswith("SYNC:"):
+                waiting = self._waiting
+                while waiting:
+                    rec = waiting.popleft()
+                    if pos - rec[4] <= self.sync_window:
+                        rec[5] = text
+            elif isinstance(text, str) and text.startswith(END_PREFIX):
+                self.end_text = text
+            elif isinstance(text, str) and text.startswith(MODE_PREFIX) and self.mode_text is None:
+                self.mode_text = text
+
+    def drain(self):
+        """確定したノートを (note, velocity, duration, sync_text) のリストで返す。"""
+        out = []
+        pending = self._pending
+        last = self.msg_count - 1
+        while pending:
+            rec = pending[0]
+            if rec[1] < 0:
+                if len(pending) < self.max_pending:
+                    break
+                # 対応なしとして確定
+                self._open[rec[2]].remove(rec)
+            elif rec[5] is None and last - rec[4] < self.sync_window:
+                break
+            pending.popleft()
+            out.append(self._emit(rec))
+        waiting = self._waiting
+        while waiting and last - waiting[0][4] >= self.sync_window:
+            waiting.popleft()
+        return out
+
+    def flush(self):
+        """入力終端で残りのノートをすべて確定させる。"""
+        out = [self._emit(rec) for rec in self._pending]
+        self._pending.clear()
+        self._open.clear()
+        self._waiting.clear()
+        return out
+
+    @staticmethod
+    def _emit(rec):
+        dur = rec[1] - rec[0] if rec[1] >= 0 else None
+        return rec[2], rec[3], dur, rec[5]
@@ -0,0 +1,255 @@
+# SYNC キーフレームを分割点にした並列復号
+# SYNC の直後はイベント境界で、running status も切れている（エンコーダはメタイベントの後に必ずステータスを書く）。
+# また SYNC が来ると SYNC 待ちのノートは片付くので、SYNC の直後で区切ればノートの対応付けも区間内で閉じる。
+# 各区間の開始時の prev_note は直前の SYNC に書かれたキーフレーム音なので、区間ごとに独立に復号できる。
+#
+#   1. ファイルを mmap し、目標サイズごとに次の SYNC テキストを探して分割点にする
+#   2. 区間ごとにワーカープロセスで「イベント解析 → ノート対応付け → シンボル復号」を行う
+#   3. 区間の復号結果（詰め済みバイト列とシンボル数）と SYNC ブロックの CRC 結果を順に連結する
+#
+# 壊れたファイルで前提が崩れた場合（区間をまたぐノート・境界のずれ・prev の不一致）は、
+# その区間を正しい prev で直列に復号し直すか、ファイル全体を直列復号にフォールバックするので、
+# 結果は直列の decode_smf と常に一致する。
+# ストライプ形式（stripes 参照）のファイルは、区間ではなくストライプ（トラック）単位で並列に復号する。
+import os
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from codebook import DEFAULT_PREV, NOTE_INDEX
+from codec_mode import MODE_PREFIX, get_mode, mode_from_text
+from bitpack import bytes_to_symbols, symbols_to_bytes
+from note_index import NoteIndexBuilder
+from sync_marker import parse_sync
+from framing import parse_end, unframe
+from smf_stream import iter_events, iter_track, iter_track_range, open_smf, track_ranges
+from decode_adaptive_timeshift_decode import (
+    DecodeResult, TimeshiftDecoder, decode_smf, decode_stripe, feed_index, join_stripes, track_index,
+)
+from stripes import stripe_marker
+from archive import reject_archive
+
+# 1 区間のおおよそのバイト数の下限（これより小さいファイルは分割しない）
+MIN_CHUNK_BYTES = 1 << 20
+CHUNKS_PER_WORKER = 4
+
+SYNC_PATTERN = b"SYNC:"
+
+class SplitError(ValueError):
+    """区間単位の復号の前提が崩れた（直列復号に切り替える）。"""
+
+def find_split_points(buf, start, end, step):
+    """トラック [start, end) 内で、step バイトおきに次の SYNC テキストの直後の位置を返す。"""
+    points = []
+    target = start + step
+    while target < end:
+        p = buf.find(SYNC_PATTERN, target, end)
+        if p < 0:
+            break
+        # ... <delta> FF 01 <len> "SYNC:..." の形になっているか（len は 1 バイトの可変長）
+        length = buf[p - 1]
+        if buf[p - 3] == 0xFF and buf[p - 2] == 0x01 and length < 0x80 and buf[p - 4] < 0x80:
+            cut = p + length
+            if cut < end:
+                points.append(cut)
+            target = max(cut, target + step)
+        else:
+            target = p + 1
+    return points
+
+def plan_chunks(buf, n_chunks):
+    """[(start, end, start_prev)] の区間リスト。start_prev は None なら「直前の区間の終了状態」。"""
+    chunks = []
+    for start, end in track_ranges(buf):
+        step = max(MIN_CHUNK_BYTES, (end - start) // max(1, n_chunks))
+        prev_cut = start
+        for cut in find_split_points(buf, start, end, step):
+            chunks.append([prev_cut, cut])
+            prev_cut = cut
+        chunks.append([prev_cut, end])
+    out = []
+    for k, (start, end) in enumerate(chunks):
+        start_prev = DEFAULT_PREV if k == 0 else None
+        if k and start == chunks[k - 1][1]:
+            # 区間の先頭は SYNC の直後: そのキーフレーム音が prev になる
+            p = buf.rfind(SYNC_PATTERN, chunks[k - 1][0], start)
+            marker = parse_sync(bytes(buf[p:start]).decode("latin-1")) if p >= 0 else None
+            if marker is not None:
+                start_prev = NOTE_INDEX.get(marker.note)
+        out.append((start, end, start_prev))
+    return out
+
+def read_mode_text(buf):
+    """最初のノートより前にある MODE テキスト（hd モードの宣言）。無ければ None。"""
+    for _, kind, _, velocity, text in iter_events(buf):
+        if kind == "note_on" and velocity > 0:
+            return None
+        if kind == "text" and text.startswith(MODE_PREFIX):
+            return text
+    return None
+
+def decode_chunk(src, start, end, start_prev, bits_per_note=6):
+    """src の [start, end) を start_prev から復号する。
+    (詰め済みバイト列, シンボル数, ノート数, sync_blocks, 終了時の prev, END テキスト, SYNC 待ちノートの有無) を返す。"""
+    with open_smf(src) as buf:
+        builder = NoteIndexBuilder()
+        feed = builder.feed
+        for ev in iter_track_range(buf, start, end):
+            feed(*ev)
+    if builder.has_open_notes():
+        raise SplitError("note_on without note_off crosses a chunk boundary")
+    index = builder.finish()
+    dec = TimeshiftDecoder(mode=get_mode(bits_per_note))
+    dec.prev = start_prev
+    feed_index(dec, index)
+    return (dec.writer.getvalue(), dec.writer.symbols, dec.step - 1, dec.sync_blocks, dec.prev, index.end_text,
+            builder.has_waiting_notes())
+
+def _job_source(src, start, end):
+    # バイト列を丸ごと渡すとジョブごとにファイル全体が pickle されるので、その区間だけを切り出して渡す
+    if isinstance(src, bytes):
+        return src[start:end], 0, end - start
+    return src, start, end
+
+def _decode_chunk_job(args):
+    try:
+        return decode_chunk(*args)
+    except (ValueError, IndexError) as e:
+        # 境界のずれ等。親プロセスで直列復号に切り替える
+        return SplitError(str(e))
+
+def _stripe_job(args):
+    # ストライプ 1 本（= 1 トラック）を復号する。mode は親で get_mode し直す（CLASSIC との同一性判定のため）
+    src, track_range, k = args
+    try:
+        with open_smf(src) as buf:
+            index = track_index(buf, track_range)
+        dec = decode_stripe(index, k)
+    except (ValueError, IndexError) as e:
+        return SplitError(str(e))
+    return dec.writer.syms, dec.sync_blocks, dec.step - 1, dec.mode.bits
+
+def _decode_stripes_parallel(src, stripe_tracks, workers):
+    """ストライプ形式のファイルはトラック（ストライプ）単位で並列に復号して組み直す。"""
+    # 同じ番号が重複していれば先のものを使う（_decode_striped と同じ）
+    n = max(mk[1] for mk, _ in stripe_tracks)
+    by_k = {}
+    for (k, _), r in stripe_tracks:
+        by_k.setdefault(k, r)
+    jobs = []
+    for k, (start, end) in sorted(by_k.items()):
+        job_src, a, b = _job_source(src, start, end)
+        jobs.append((job_src, (a, b), k))
+    if len(jobs) == 1 or workers == 1:
+        results = [_stripe_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            results = list(pool.map(_stripe_job, jobs, chunksize=1))
+    if any(isinstance(res, SplitError) for res in results):
+        return decode_smf(src)
+    decoded = {job[2]: res for job, res in zip(jobs, results)}
+    parts = []
+    for k in range(n):
+        res = decoded.get(k)
+        if res is None:
+            parts.append((array('H'), [], 0, None))
+        else:
+            syms, blocks, notes, bits = res
+            parts.append((syms, blocks, notes, get_mode(bits)))
+    return join_stripes(parts)
+
+def _join(parts, bits):
+    # 途中の区間のビット数が 8 の倍数（6bit なら 4 シンボルの倍数）ならそのまま連結できる
+    if all(n * bits % 8 == 0 for _, n in parts[:-1]):
+        return b"".join(data for data, _ in parts)
+    syms = []
+    for data, n in parts:
+        syms.extend(bytes_to_symbols(data, bits)[:n])
+    return symbols_to_bytes(syms, bits)
+
+def decode_parallel(src, workers=None, chunks_per_worker=CHUNKS_PER_WORKER):
+    """SMF ファイル（パスまたはバイト列）を区間並列で復号し、decode_smf と同じ DecodeResult を返す。
+    sync_blocks に SYNC ブロックごとの CRC 結果が入る。"""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        src = bytes(src)
+    workers = workers or os.cpu_count() or 1
+    with open_smf(src) as buf:
+        if not len(buf):
+            raise ValueError("empty input (not a Standard MIDI File)")
+        if isinstance(buf, memoryview):
+            buf = src
+        ranges = track_ranges(buf)
+        if not ranges:
+            # トラックが無い: 区間に分けるものが無いので直列復号と同じ結果（空のペイロード）を返す
+            return decode_smf(src)
+        reject_archive(buf, ranges)
+        markers = [stripe_marker((ev[1], ev[3], ev[4]) for ev in iter_track(buf, *r)) for r in ranges]
+        stripe_tracks = [(mk, r) for mk, r in zip(markers, ranges) if mk]
+        if not stripe_tracks:
+            plan = plan_chunks(buf, workers * chunks_per_worker)
+            try:
+                bits = mode_from_text(read_mode_text(buf)).bits
+            except (ValueError, IndexError):
+                return decode_smf(src)
+    if stripe_tracks:
+        return _decode_stripes_parallel(src, stripe_tracks, workers)
+    jobs = [(*_job_source(src, start, end), DEFAULT_PREV if start_prev is None else start_prev, bits)
+            for start, end, start_prev in plan]
+    if len(jobs) == 1 or workers == 1:
+        results = [_decode_chunk_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_decode_chunk_job, jobs, chunksize=1))
+
+    parts = []
+    sync_blocks = []
+    notes = 0
+    end_text = None
+    prev = DEFAULT_PREV
+    last = len(plan) - 1
+    for k, ((start, end, start_prev), job, res) in enumerate(zip(plan, jobs, results)):
+        if isinstance(res, SplitError):
+            return decode_smf(src)
+        if job[3] != prev:
+            # 想定した prev が直前区間の終了状態と違う（壊れたキーフレーム等）: 正しい prev でやり直す
+            try:
+                res = decode_chunk(src, start, end, prev, bits)
+            except (ValueError, IndexError):
+                return decode_smf(src)
+        data, n_syms, n_notes, blocks, prev, text, waiting = res
+        if waiting and k != last:
+            # 区間末に SYNC 待ちのノートがある（トラック境界など）: 次の区間の SYNC に紐づくかもしれない
+            return decode_smf(src)
+        parts.append((data, n_syms))
+        sync_blocks.extend(blocks)
+        notes += n_notes
+        if text is not None:
+            end_text = text
+
+    raw = _join(parts, bits)
+    payload, expected_len, trailer_ok = unframe(raw, parse_end(end_text))
+    return DecodeResult(text=payload.decode('utf-8', errors='replace'), payload=payload, raw_bytes=raw,
+                        expected_len=expected_len, notes=notes, sync_blocks=sync_blocks, trailer_ok=trailer_ok,
+                        bits_per_note=bits)
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="SYNC キーフレーム単位の並列復号")
+    ap.add_argument("path")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--out", default=None, help="ペイロードの書き出し先（省略時はテキストとして表示）")
+    args = ap.parse_args()
+    result = decode_parallel(args.path, args.workers)
+    for step, reported, actual in result.sync_blocks:
+        if reported is not None and reported != actual:
+            print(f"[SYNC step={step}] CRC MISMATCH reported={reported:X} actual={actual:X}")
+    print(f"notes={result.notes} sync_blocks={len(result.sync_blocks)} crc_errors={len(result.crc_errors)}",
+          file=sys.stderr)
+    if args.out:
+        with open(args.out, "wb") as f:
+            f.write(result.payload)
+    else:
+        print(f"復号テキスト: {result.text}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+# CRC が一致しない SYNC ブロックの修復（候補を絞った探索）
+# corrupt_midi.py のような「1 音が半音ずれた」程度の破損を想定し、失敗したブロックごとに 1 か所・2 か所の
+# 書き換え候補を make_probability_table のモデルで確からしい順に試し、CRC が一致したものを採用する。
+#   - ブロックは SYNC テキストで区切る。ノートは note_on と次の note_off を並び順で対にする
+#     （エンコーダの出力では必ず隣り合うので、音高が壊れても対応は崩れない。on/off の音高の食い違いは破損の手がかり）
+#   - ブロック先頭の prev は直前の SYNC に書かれたキーフレーム音。前のブロックが壊れていても影響しない
+#   - 候補は 1 ノートの音高・velocity・長さのどれかを変えたもの。音高は prev から見た確率 ×
+#     元の音からの距離（1 半音違いが最も多い）、velocity・長さは音高より低い一定の重みで順位を付ける
+#   - CRC-8 は 1/256 で偶然一致するので、エンコーダが作りうるブロック（音階内の音・候補数に収まる velocity・
+#     表にある長さ・末尾が SYNC の音名）になった候補だけを CRC にかける
+#   - 1 ブロックあたり CRC を計算する候補は max_trials 個まで。ブロック単位でプロセスプールに配る
+#   python repair.py mid/corrupted_*.mid --out-dir mid/repaired --workers 4
+import heapq
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from codebook import (
+    DEFAULT_PREV, KEYFRAME_DURATION_SHIFT, MIDI_TO_INDEX, NOTE_INDEX, NOTE_MIDI, NOTE_NAMES,
+    NOTE_SLOTS, PROB_TABLES, prev_index,
+)
+from bitpack import symbols_to_bytes
+from checksum import checksum
+from codec_mode import MODE_PREFIX, get_mode, mode_from_text
+from smf_stream import iter_track, open_smf, track_ranges
+from stripes import parse_stripe
+from sync_marker import parse_sync
+
+# 1 ブロックあたりに CRC を計算する候補数の上限
+MAX_TRIALS = 20000
+# 音高の候補の重み: 元の音から n 半音離れるごとに掛ける
+PITCH_DECAY = 0.5
+# note_off の音高と一致する候補（note_on だけが書き換わった破損）に掛ける重み
+OFF_PITCH_BONUS = 8.0
+# velocity・長さの候補全体の重み（音高のずれより起こりにくいとみなす）
+VELOCITY_WEIGHT = 0.05
+DURATION_WEIGHT = 0.05
+
+PITCH, VELOCITY, DURATION = 0, 1, 2
+FIELD_NAMES = ("pitch", "velocity", "duration")
+
+@dataclass
+class Fix:
+    """1 ノートの書き換え。track / on_msg / off_msg は mido のトラック番号とトラック内のメッセージ位置。"""
+    track: int
+    on_msg: int
+    off_msg: int
+    field: str
+    old: int
+    new: int
+
+@dataclass
+class BlockRepair:
+    step: str
+    trials: int
+    fixes: List[Fix] = field(default_factory=list)
+    # CRC が一致した候補の数（2 以上なら CRC だけでは決めきれず、最も確からしいものを採った）
+    matches: int = 0
+    # 修復できなかった理由（max_trials / no candidate / no sync）。修復できたときは None
+    reason: Optional[str] = None
+
+    @property
+    def repaired(self):
+        return self.reason is None
+
+    @property
+    def ambiguous(self):
+        return self.matches > 1
+
+@dataclass
+class RepairReport:
+    blocks: List[BlockRepair] = field(default_factory=list)
+
+    @property
+    def fixes(self):
+        return [f for b in self.blocks for f in b.fixes]
+
+    @property
+    def failed(self):
+        return [b for b in self.blocks if not b.repaired]
+
+# --- SMF からブロックを取り出す ---
+class _Row:
+    __slots__ = ("track", "on_msg", "off_msg", "pitch", "velocity", "duration", "off_pitch", "on_tick")
+
+    def __init__(self, track, on_msg, pitch, velocity, on_tick):
+        self.track = track
+        self.on_msg = on_msg
+        self.off_msg = -1
+        self.pitch = pitch
+        self.velocity = velocity
+        self.duration = None
+        self.off_pitch = None
+        self.on_tick = on_tick
+
+def _scan_track(buf, track_range, track, rows, blocks, state):
+    """1 トラックのノートを並び順で対にして rows に足し、SYNC ごとに (rows の区間, marker) を blocks に足す。"""
+    tick = 0
+    open_row = None
+    for pos, (delta, kind, note, velocity, text) in enumerate(iter_track(buf, *track_range)):
+        tick += delta
+        if kind == "note_on" and velocity > 0:
+            open_row = _Row(track, pos, note, velocity, tick)
+            rows.append(open_row)
+        elif kind == "note_off" or kind == "note_on":
+            if open_row is not None:
+                open_row.off_msg = pos
+                open_row.duration = tick - open_row.on_tick
+                open_row.off_pitch = note
+                open_row = None
+        elif kind == "text":
+            marker = parse_sync(text)
+            if marker is not None:
+                if len(rows) > state["start"]:
+                    blocks.append((state["start"], len(rows), marker))
+                state["start"] = len(rows)
+            elif text.startswith(MODE_PREFIX) and state["mode_text"] is None:
+                state["mode_text"] = text
+            elif state["stripe"] is None and not rows:
+                state["stripe"] = parse_stripe(text)
+
+def scan_smf(src):
+    """[(step の接頭辞, mode, rows, blocks)]。ストライプ形式ならトラックごと、そうでなければ全トラックを連結した 1 本。"""
+    with open_smf(src) as buf:
+        ranges = track_ranges(buf)
+        parts = []
+        for t, r in enumerate(ranges):
+            rows, blocks = [], []
+            state = {"start": 0, "mode_text": None, "stripe": None}
+            _scan_track(buf, r, t, rows, blocks, state)
+            parts.append((state, rows, blocks))
+    if any(state["stripe"] for state, _, _ in parts):
+        return [(f"s{state['stripe'][0]}:", mode_from_text(state["mode_text"]), rows, blocks)
+                for state, rows, blocks in parts if state["stripe"]]
+    # 連結するときはブロックの位置をずらす
+    all_rows, all_blocks, mode_text = [], [], None
+    for state, rows, blocks in parts:
+        base = len(all_rows)
+        all_rows.extend(rows)
+        all_blocks.extend((base + a, base + b, mk) for a, b, mk in blocks)
+        mode_text = mode_text or state["mode_text"]
+    return [("", mode_from_text(mode_text), all_rows, all_blocks)]
+
+# --- ブロックの検証（エンコーダが作りうる形かどうかも見る） ---
+def _slot(mode, velocity):
+    # (スロット順位, velocity の追加ビット)。範囲外なら None
+    off = velocity - mode.velocity_base
+    if off < 0:
+        return None
+    if not mode.vel_bits:
+        return off, 0
+    extra = off // mode.vel_stride
+    if extra > mode.vel_mask:
+        return None
+    return off % mode.vel_stride, extra
+
+def block_symbols(mode, prev, notes):
+    """notes = [(pitch, velocity, duration)] を prev から厳密に復号する。(シンボル列, 末尾の prev) か、
+    エンコーダが出さない値（音階外の音・候補数を超える velocity・表にない長さ）があれば (None, その位置)。"""
+    syms = []
+    last = len(notes) - 1
+    durations = mode.durations
+    for k in range(len(notes)):
+        pitch, velocity, duration = notes[k]
+        idx = MIDI_TO_INDEX.get(pitch)
+        if idx is None or duration is None:
+            return None, k
+        cands = NOTE_SLOTS[prev][idx]
+        slot = _slot(mode, velocity)
+        if slot is None or slot[0] >= len(cands):
+            return None, k
+        if k == last:
+            duration -= KEYFRAME_DURATION_SHIFT
+        code = mode.nearest_duration_code(duration)
+        if durations[code] != duration:
+            return None, k
+        syms.append((cands[slot[0]] << mode.low_bits) | (slot[1] << mode.dur_bits) | code)
+        prev = idx
+    return syms, prev
+
+def block_ok(mode, prev, notes, end_idx, reported, algo):
+    syms, last = block_symbols(mode, prev, notes)
+    if syms is None or (end_idx is not None and last != end_idx):
+        return False
+    return checksum(algo, symbols_to_bytes(syms, mode.bits)) == reported
+
+# --- 候補の生成 ---
+def single_edits(mode, prev, notes, off_pitches):
+    """[(重み, 位置, 種類, 新しい値)] を重みの大きい順に返す。"""
+    edits = []
+    last = len(notes) - 1
+    shift_durations = [d + KEYFRAME_DURATION_SHIFT for d in mode.durations]
+    for k, (pitch, velocity, duration) in enumerate(notes):
+        # 位置 k での prev は受け取ったままの音から求める（音階外なら 1 つ前のまま）
+        probs = PROB_TABLES[prev]
+        for j, name in enumerate(NOTE_NAMES):
+            midi = NOTE_MIDI[j]
+            if midi == pitch:
+                continue
+            w = probs.get(name, 0.0) or 1e-3
+            w *= PITCH_DECAY ** (abs(midi - pitch) - 1)
+            if off_pitches[k] == midi:
+                w *= OFF_PITCH_BONUS
+            edits.append((w, k, PITCH, midi))
+        idx = MIDI_TO_INDEX.get(pitch)
+        if idx is not None:
+            n_slots = len(NOTE_SLOTS[prev][idx])
+            values = [mode.velocity(s, e) for e in range(mode.vel_mask + 1) for s in range(n_slots)]
+            values = [v for v in values if v != velocity]
+            for v in values:
+                edits.append((VELOCITY_WEIGHT / len(values) * PITCH_DECAY ** (abs(v - velocity) - 1), k, VELOCITY, v))
+            prev = idx
+        table = shift_durations if k == last else mode.durations
+        values = [d for d in table if d != duration]
+        for d in values:
+            edits.append((DURATION_WEIGHT / len(values), k, DURATION, d))
+    edits.sort(key=lambda e: -e[0])
+    return edits
+
+def _pairs(edits):
+    # 異なる書き換え 2 つの組を重みの積の大きい順に返す（edits は重みの降順）
+    m = len(edits)
+    if m < 2:
+        return
+    heap = [(-edits[0][0] * edits[1][0], 0, 1)]
+    while heap:
+        _, i, j = heapq.heappop(heap)
+        if j + 1 < m:
+            heapq.heappush(heap, (-edits[i][0] * edits[j + 1][0], i, j + 1))
+        if j == i + 1 and j + 1 < m:
+            heapq.heappush(heap, (-edits[j][0] * edits[j + 1][0], j, j + 1))
+        a, b = edits[i], edits[j]
+        if a[1] == b[1] and a[2] == b[2]:
+            continue
+        yield (a, b) if a[1] <= b[1] else (b, a)
+
+def _apply(notes, edit_list):
+    out = list(notes)
+    for _, k, kind, value in edit_list:
+        row = list(out[k])
+        row[kind] = value
+        out[k] = tuple(row)
+    return out
+
+def search_block(bits, prev, notes, off_pitches, end_idx, reported, algo, max_trials=MAX_TRIALS):
+    """1 ブロックの修復候補を探す。(採用した書き換えのリスト か None, CRC を計算した候補数, CRC が一致した候補数)。
+    1 か所の書き換えは上限までの全候補を試し、一致が複数あれば最も確からしいものを採る（matches > 1 は曖昧）。
+    2 か所の書き換えは 1 か所で見つからないときだけ試し、最初に一致したものを採る。"""
+    mode = get_mode(bits)
+    # 受け取ったまま厳密に読めた範囲。最初の書き換えはそれより後ろにあっても意味がない
+    syms, bad = block_symbols(mode, prev, notes)
+    first_bad = bad if syms is None else len(notes)
+    trials = 0
+    best, matches = None, 0
+    singles = single_edits(mode, prev, notes, off_pitches)
+    for tier in (((e,) for e in singles), _pairs(singles)):
+        for edit_list in tier:
+            if edit_list[0][1] > first_bad:
+                continue
+            if trials >= max_trials:
+                return best, trials, matches
+            trials += 1
+            if block_ok(mode, prev, _apply(notes, edit_list), end_idx, reported, algo):
+                matches += 1
+                if best is None:
+                    best = list(edit_list)
+                if len(edit_list) > 1:
+                    return best, trials, matches
+        if best is not None:
+            break
+    return best, trials, matches
+
+def _search_job(args):
+    return search_block(*args)
+
+# --- ファイル単位 ---
+def failed_blocks(src):
+    """CRC が一致しない（またはエンコーダが作りえない）SYNC ブロックを探索ジョブにする。
+    [(step, rows, 探索の引数)] を返す。max_trials は呼び出し側で足す。
+    最後の SYNC より後ろ（CRC の無い末尾）に壊れたノートがあれば、引数 None の "<接頭辞>tail" として返す。"""
+    jobs = []
+    for prefix, mode, rows, blocks in scan_smf(src):
+        prev = DEFAULT_PREV
+        for a, b, marker in blocks:
+            block_rows = rows[a:b]
+            notes = [(r.pitch, r.velocity, r.duration) for r in block_rows]
+            end_idx = NOTE_INDEX.get(marker.note)
+            if marker.crc_known and not block_ok(mode, prev, notes, end_idx, marker.crc, marker.algo):
+                args = (mode.bits, prev, notes, [r.off_pitch for r in block_rows], end_idx, marker.crc, marker.algo)
+                jobs.append((prefix + marker.step, block_rows, args))
+            prev = prev_index(marker.note)
+        tail = rows[blocks[-1][1] if blocks else 0:]
+        if any(r.pitch not in MIDI_TO_INDEX or r.off_pitch != r.pitch for r in tail):
+            jobs.append((prefix + "tail", tail, None))
+    return jobs
+
+def _fixes(rows, edit_list):
+    fixes = []
+    for _, k, kind, value in edit_list:
+        r = rows[k]
+        old = (r.pitch, r.velocity, r.duration)[kind]
+        fixes.append(Fix(r.track, r.on_msg, r.off_msg, FIELD_NAMES[kind], old, value))
+    return fixes
+
+def _run(jobs, workers):
+    if workers == 1 or len(jobs) <= 1:
+        return [_search_job(job) for job in jobs]
+    workers = min(workers, len(jobs))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_search_job, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+
+def repair_smfs(sources, workers=None, max_trials=MAX_TRIALS):
+    """複数の SMF（パスまたはバイト列）の失敗ブロックをまとめて 1 つのプールで探索し、RepairReport のリストを返す。"""
+    max_trials = max_trials or MAX_TRIALS
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError(f"workers must be >= 1: {workers}")
+    per_file = [failed_blocks(src) for src in sources]
+    jobs = [args + (max_trials,) for found in per_file for _, _, args in found if args is not None]
+    results = iter(_run(jobs, workers))
+    reports = []
+    for found in per_file:
+        report = RepairReport()
+        for step, rows, args in found:
+            if args is None:
+                report.blocks.append(BlockRepair(step, 0, reason="no sync"))
+                continue
+            edit_list, trials, matches = next(results)
+            if edit_list is None:
+                reason = "max_trials" if trials >= max_trials else "no candidate"
+                report.blocks.append(BlockRepair(step, trials, reason=reason))
+            else:
+                report.blocks.append(BlockRepair(step, trials, _fixes(rows, edit_list), matches=matches))
+        reports.append(report)
+    return reports
+
+def repair_smf(src, workers=None, max_trials=MAX_TRIALS):
+    return repair_smfs([src], workers, max_trials)[0]
+
+def apply_fixes(src, fixes, dst):
+    """fixes を当てた SMF を dst（パスまたは書き込み可能なファイル）に保存する。"""
+    import io
+    from mido import MidiFile
+    mid = MidiFile(file=io.BytesIO(bytes(src))) if isinstance(src, (bytes, bytearray, memoryview)) else MidiFile(src)
+    for fx in fixes:
+        track = mid.tracks[fx.track]
+        on = track[fx.on_msg]
+        off = track[fx.off_msg] if fx.off_msg >= 0 else None
+        if fx.field == "pitch":
+            on.note = fx.new
+            if off is not None:
+                off.note = fx.new
+        elif fx.field == "velocity":
+            on.velocity = fx.new
+        elif off is not None:
+            off.time += fx.new - fx.old
+    if isinstance(dst, (str, os.PathLike)):
+        mid.save(dst)
+    else:
+        mid.save(file=dst)
+
+def repair_file(src, dst, workers=None, max_trials=MAX_TRIALS):
+    """src を修復して dst に保存し、RepairReport を返す（修復するものが無くても dst は書く）。"""
+    report = repair_smf(src, workers, max_trials)
+    apply_fixes(src, report.fixes, dst)
+    return report
+
+def print_report(name, report, out=sys.stdout):
+    for b in report.blocks:
+        if b.repaired:
+            desc = ", ".join(f"{f.field} {f.old}->{f.new} @msg{f.on_msg}" for f in b.fixes)
+            note = f", CRC 一致 {b.matches} 件のうち最も確からしいもの" if b.ambiguous else ""
+            print(f"{name} [SYNC step={b.step}] 修復 ({b.trials} 候補{note}): {desc}", file=out)
+        else:
+            print(f"{name} [SYNC step={b.step}] 修復できず ({b.reason}, {b.trials} 候補)", file=out)
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="CRC が一致しない SYNC ブロックを候補探索で修復する")
+    ap.add_argument("paths", nargs="+", help="修復する .mid")
+    ap.add_argument("--out-dir", default=None, help="修復したファイルの保存先（既定: 元と同じ場所に repaired_<名前>）")
+    ap.add_argument("--workers", type=int, default=None, help="プロセス数（既定: CPU 数）")
+    ap.add_argument("--max-trials", type=int, default=MAX_TRIALS, help="1 ブロックあたりに試す候補数の上限")
+    args = ap.parse_args(argv)
+    if args.workers is not None and args.workers < 1:
+        ap.error("--workers must be >= 1")
+    reports = repair_smfs(args.paths, args.workers, args.max_trials)
+    failed = 0
+    for path, report in zip(args.paths, reports):
+        print_report(path, report)
+        if not report.blocks:
+            continue
+        out_dir = args.out_dir or os.path.dirname(path)
+        if args.out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        dst = os.path.join(out_dir, "repaired_" + os.path.basename(path))
+        apply_fixes(path, report.fixes, dst)
+        print(f"保存しました: {dst}")
+        failed += len(report.failed)
+    return 0 if failed == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
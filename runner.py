@@ -1,59 +1,92 @@
 # 実行ラッパー（エンコーダ/デコーダ呼び出し・ログ保存・テスト実行）
 
-import subprocess
-import sys
-import os
+import io
+from functools import partial
 from pathlib import Path
-from midi_shared import ROOT, MID_DIR, ARTIFACTS_DIR, ENCODER_SCRIPT, DECODER_SCRIPT
-
-def run_script(script_name, stdin_text, cwd=ROOT):
-    proc = subprocess.run([sys.executable, str(Path(cwd) / script_name)],
-                          input=stdin_text, text=True,
-                          capture_output=True, cwd=str(cwd))
-    return proc
+from midi_shared import MID_DIR, ARTIFACTS_DIR, ensure_dir
+import timeshift_codec
+from codec_log import CodecLog, get_log
+from decode_cache import cached_decode
 
 def save_log(kind, basename, stdout, stderr):
-    p = ARTIFACTS_DIR / f"{basename}_{kind}.txt"
+    p = ensure_dir(ARTIFACTS_DIR) / f"{basename}_{kind}.txt"
     with open(p, "w", encoding="utf-8") as f:
         f.write(f"--- STDOUT ---\n{stdout}\n\n--- STDERR ---\n{stderr}\n")
     return str(p)
 
-def encode_text(text, out_basename):
+def resolve_mid_path(mid_name):
+    # フルパス（.mid 付き）でも mid/ 配下の basename でも受け付ける
+    p = Path(mid_name)
+    if p.suffix.lower() == ".mid" and p.exists():
+        return p
+    return MID_DIR / f"{p.stem if p.suffix.lower() == '.mid' else mid_name}.mid"
+
+class _Tee:
+    """書き込みを複数のストリームに流す（artifacts 用のバッファと GUI など）。"""
+
+    def __init__(self, *streams):
+        self.streams = streams
+
+    def write(self, s):
+        for st in self.streams:
+            st.write(s)
+
+    def flush(self):
+        pass
+
+def _buffered_log(log, out):
+    # ログはレベルだけを引き継ぎ、出力先を artifacts 用のバッファ（と呼び出し側のストリーム）にする。
+    # trace は呼び出し側が作った CodecLog がもう TRACE_MAGIC を書いているので、ヘッダは書かない
+    log = get_log(log)
+    return CodecLog(log.level, stream=out, trace=log.trace, header=False)
+
+def encode_text(text, out_basename, log=None, stream=None, on_sync=None):
+    """text をエンコードして mid/ に保存し、保存先パスを返す。log はレベル（codec_log 参照）。
+    stream を渡すとログを逐次そこにも書く。on_sync(step, crc) は SYNC を書くたびに呼ばれる。"""
     # normalize basename: avoid duplicate "_timeshift" suffix
     suffix = "_timeshift"
     if out_basename.endswith(suffix):
         base = out_basename[:-len(suffix)]
     else:
         base = out_basename
-    enc = run_script(ENCODER_SCRIPT, f"{text}\n{base}\n")
+    buf = io.StringIO()
+    out = buf if stream is None else _Tee(buf, stream)
+    mid = timeshift_codec.encode(text, log=_buffered_log(log, out), on_sync=on_sync)
+    path = timeshift_codec.save(mid, base)
+    out.write(f"\nMIDI saved: {path}\n")
     # save logs under the final expected basename (base + suffix)
-    save_log("encode", base + suffix, enc.stdout, enc.stderr)
-    return enc
+    save_log("encode", base + suffix, buf.getvalue(), "")
+    return path
 
-def decode_mid(mid_basename):
-    dec = run_script(DECODER_SCRIPT, f"{mid_basename}\n")
-    save_log("decode", mid_basename, dec.stdout, dec.stderr)
-    return dec
+def decode_mid(mid_basename, log=None, stream=None, on_sync=None):
+    """mid/<basename>.mid（またはパス）を復号して DecodeResult を返す。
+    ファイルが前回から変わっていなければ復号キャッシュ（decode_cache）の結果を返す（このとき on_sync は呼ばれない）。"""
+    path = resolve_mid_path(mid_basename)
+    buf = io.StringIO()
+    out = buf if stream is None else _Tee(buf, stream)
+    decoder = partial(timeshift_codec.decode, on_sync=on_sync) if on_sync is not None else None
+    result = cached_decode(path, log=_buffered_log(log, out), decoder=decoder)
+    out.write(f"notes={result.notes} sync_blocks={len(result.sync_blocks)} "
+              f"crc_errors={len(result.crc_errors)}\n")
+    out.write(f"復号テキスト: {result.text}\n")
+    save_log("decode", path.stem, buf.getvalue(), "")
+    return result
 
 def run_test_samples(samples):
     results = []
     for i, text in enumerate(samples, start=1):
         basename = f"testcase_{i:02d}_timeshift"
-        enc = encode_text(text, basename)
-        if enc.returncode != 0:
+        try:
+            saved_mid = encode_text(text, basename)
+        except Exception:
             results.append((text, False, "encoder_failed"))
             continue
-        # extract saved mid name (same extraction logic as earlier)
-        import re
-        m = re.search(r"MIDI saved:\s*(?:mid/)?([^\s]+\.mid)", enc.stdout)
-        saved_mid = m.group(1) if m else f"{basename}.mid"
-        dec = decode_mid(Path(saved_mid).stem)
-        if dec.returncode != 0:
+        try:
+            dec = decode_mid(saved_mid.stem)
+        except Exception:
             results.append((text, False, "decoder_failed"))
             continue
-        # extract decoded text
-        m2 = re.search(r"復号テキスト:\s*(.*)", dec.stdout)
-        decoded = (m2.group(1).strip() if m2 else dec.stdout.strip().splitlines()[-1])
+        decoded = dec.text
         ok = decoded == text
         results.append((text, ok, decoded))
     return results
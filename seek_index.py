@@ -0,0 +1,213 @@
+# シークテーブル（SYNC ブロック -> 絶対 tick・ファイル内のイベント位置・復元バイト位置）と範囲復号
+# エンコーダ（write_smf / stream_encode の seek_index）は stride ブロックごとに SYNC の直後の位置を記録し、
+# ファイル末尾にノートの無い索引トラックを 1 本足して、次のテキスト 1 個として書く:
+#   SEEK:<version>:<stride>:<step>,<tick>,<offset>,<note>;...
+#     step   : その SYNC までのシンボル数（復元バイト列上のビット位置 = step * bits、
+#              ペイロード上のバイト位置 = step * bits // 8 - 4）
+#     tick   : SYNC の絶対 tick
+#     offset : SYNC の次のイベントのファイル内バイト位置（メタイベントの後なので running status は切れている）
+#     note   : SYNC のキーフレーム音（そこから復号するときの prev）
+#   先頭エントリはトラックの始まり（step 0, tick 0, prev = C4）。
+# 索引を知らないデコーダはテキストを読み飛ばすだけなので従来どおり復号できる。
+# decode_range は範囲の始まりを含むエントリから、範囲の終わりより後の最初のエントリまでだけを復号する
+# （読むのは範囲の長さ + 最大 stride ブロック分）。
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from codebook import DEFAULT_PREV, NOTE_INDEX, NOTE_NAMES
+from codec_mode import mode_from_text
+from framing import LENGTH_HEADER_SIZE, STREAM_LENGTH, is_compressed, parse_end
+from smf_stream import iter_track, open_smf, track_ranges
+from sync_marker import parse_sync
+
+SEEK_PREFIX = "SEEK:"
+SEEK_VERSION = 1
+# 何ブロックごとにエントリを置くか（1 ブロック = KEYFRAME_INTERVAL ノート）
+SEEK_STRIDE = 8
+
+@dataclass
+class SeekEntry:
+    step: int
+    tick: int
+    offset: int
+    note: str
+
+    @property
+    def prev(self):
+        return NOTE_INDEX.get(self.note, DEFAULT_PREV)
+
+    def payload_offset(self, bits):
+        # このエントリから復号したときの先頭がペイロードの何バイト目にあたるか（ヘッダ内なら負）
+        return self.step * bits // 8 - LENGTH_HEADER_SIZE
+
+class SeekTable:
+    """書き込み中のトラックの SYNC を受け取り、stride ブロックごとにエントリを記録する。"""
+
+    def __init__(self, offset, stride=SEEK_STRIDE):
+        self.stride = stride
+        self.blocks = 0
+        self.entries = [SeekEntry(0, 0, offset, NOTE_NAMES[DEFAULT_PREV])]
+
+    def add(self, text, tick, offset):
+        """テキストを書いた直後に呼ぶ。tick はそのテキストの絶対 tick、offset は書いた後のファイル位置。"""
+        marker = parse_sync(text)
+        if marker is None or not marker.step.isdigit():
+            return
+        self.blocks += 1
+        if self.blocks % self.stride == 0:
+            self.entries.append(SeekEntry(int(marker.step), tick, offset, marker.note))
+
+    def format(self):
+        body = ";".join(f"{e.step},{e.tick},{e.offset},{e.note}" for e in self.entries)
+        return f"{SEEK_PREFIX}{SEEK_VERSION}:{self.stride}:{body}"
+
+class SeekRecorder:
+    """TimeshiftEncoder と SmfTrackWriter の間に挟み、書きながら SeekTable を作る（stream_encode 用）。"""
+
+    def __init__(self, writer, stride=SEEK_STRIDE):
+        self.writer = writer
+        self.tick = 0
+        self.table = SeekTable(writer.tell(), stride)
+
+    def note(self, note_num, velocity, duration, channel=0):
+        self.writer.note(note_num, velocity, duration, channel)
+        self.tick += duration
+
+    def text(self, text):
+        self.writer.text(text)
+        self.table.add(text, self.tick, self.writer.tell())
+
+    def close(self):
+        """索引トラックを書いてファイルを閉じる（writer は n_tracks=2 で作っておく）。"""
+        self.writer.next_track()
+        self.writer.text(self.table.format())
+        self.writer.close()
+
+def parse_seek(text):
+    """SEEK テキストから (stride, [SeekEntry]) を返す。解釈できなければ None。"""
+    if not isinstance(text, str) or not text.startswith(SEEK_PREFIX):
+        return None
+    parts = text.split(":", 3)
+    if len(parts) != 4 or parts[1] != str(SEEK_VERSION) or not parts[2].isdigit():
+        return None
+    entries = []
+    try:
+        for item in parts[3].split(";"):
+            step, tick, offset, note = item.split(",")
+            entries.append(SeekEntry(int(step), int(tick), int(offset), note))
+    except ValueError:
+        return None
+    return int(parts[2]), entries
+
+def read_seek_index(buf):
+    """最後のトラックにある SEEK テキストを探す。(stride, entries) または None。"""
+    ranges = track_ranges(buf)
+    if len(ranges) < 2:
+        return None
+    for _, kind, _, _, text in iter_track(buf, *ranges[-1]):
+        if kind == "text" and text.startswith(SEEK_PREFIX):
+            return parse_seek(text)
+    return None
+
+def has_seek_index(src):
+    with open_smf(src) as buf:
+        return read_seek_index(buf) is not None
+
+@dataclass
+class RangeResult:
+    payload: bytes
+    # ペイロード上の開始位置（範囲がペイロードの外にはみ出した分は切り詰めてある）
+    start: int
+    # 復号したブロックの (step, reported_crc, actual_crc)
+    sync_blocks: List[Tuple[str, Optional[int], int]] = field(default_factory=list)
+    # シークテーブルを使えたか（False なら全体を復号して切り出した）
+    indexed: bool = True
+
+    @property
+    def crc_errors(self):
+        return [b for b in self.sync_blocks if b[1] is not None and b[1] != b[2]]
+
+    @property
+    def crc_ok(self):
+        return not self.crc_errors
+
+def _track_end(buf, offset):
+    for start, end in track_ranges(buf):
+        if start <= offset < end:
+            return end
+    raise ValueError(f"seek entry outside any track: {offset}")
+
+def _stream_length(buf, entry, end):
+    # ストリーム形式: 長さは最後のノートの後の END テキスト（最後のエントリより後にある）
+    for _, kind, _, _, text in iter_track(buf, entry.offset, end):
+        if kind == "text":
+            parsed = parse_end(text)
+            if parsed is not None:
+                return parsed[0]
+    return None
+
+def _extract_bits(data, first_bit, nbytes):
+    # data（先頭がビット 0）の first_bit から nbytes バイトを取り出す。足りない分は切り詰める
+    total = len(data) * 8
+    nbytes = max(0, min(nbytes, (total - first_bit) // 8))
+    if nbytes == 0:
+        return b""
+    value = int.from_bytes(data, 'big') >> (total - first_bit - nbytes * 8)
+    return (value & ((1 << (nbytes * 8)) - 1)).to_bytes(nbytes, 'big')
+
+def _full_range(src, start, length):
+    from decode_adaptive_timeshift_decode import decode_smf
+    res = decode_smf(src)
+    start = max(0, start)
+    return RangeResult(res.payload[start:start + length], min(start, len(res.payload)), res.sync_blocks,
+                       indexed=False)
+
+def decode_range(src, start, length):
+    """src（パスまたはバイト列）のペイロード [start, start + length) を復号して RangeResult で返す。
+    シークテーブルがあれば start を含むブロックの手前のエントリから必要なブロックだけを復号する。
+    索引が無い・圧縮ペイロード（伸長は先頭からしかできない）のときは全体を復号して切り出す。"""
+    from parallel_decode import decode_chunk, read_mode_text
+    start = max(0, start)
+    with open_smf(src) as buf:
+        index = read_seek_index(buf)
+        if index is None:
+            return _full_range(src, start, length)
+        mode = mode_from_text(read_mode_text(buf))
+        _, entries = index
+        end = _track_end(buf, entries[0].offset)
+        if entries[-1].offset > end:
+            raise ValueError("seek index does not match the note track")
+        stream_len = _stream_length(buf, entries[-1], end)
+    bits = mode.bits
+    steps = [e.step for e in entries]
+
+    def span(i, j):
+        stop = entries[j].offset if j < len(entries) else end
+        data, _, _, blocks, _, _, _ = decode_chunk(src, entries[i].offset, stop, entries[i].prev, bits)
+        return data, blocks
+
+    # 長さヘッダ（と圧縮方式の 1 バイト）は先頭エントリの区間にある
+    head, head_blocks = span(0, 1)
+    if len(head) <= LENGTH_HEADER_SIZE:
+        return _full_range(src, start, length)
+    header_len = int.from_bytes(head[:LENGTH_HEADER_SIZE], 'big')
+    if is_compressed(header_len, head[LENGTH_HEADER_SIZE]):
+        return _full_range(src, start, length)
+    total = stream_len if header_len == STREAM_LENGTH else header_len
+    if total is not None:
+        start = min(start, total)
+        length = max(0, min(length, total - start))
+    if length <= 0:
+        return RangeResult(b"", start, [])
+
+    # 復元バイト列上の [a, b) をシンボル位置に直し、それを含むエントリの区間だけ復号する
+    a = (start + LENGTH_HEADER_SIZE) * 8
+    b = (start + length + LENGTH_HEADER_SIZE) * 8
+    i = bisect_right(steps, a // bits) - 1
+    j = bisect_left(steps, -(-b // bits))
+    if i == 0 and j <= 1:
+        data, blocks = head, head_blocks
+    else:
+        data, blocks = span(i, j)
+    return RangeResult(_extract_bits(data, a - steps[i] * bits, length), start, blocks)
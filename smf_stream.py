@@ -0,0 +1,220 @@
+# mido を介さずに SMF (Standard MIDI File) を直接読み書きする低レベル部品
+# 書き込みはイベントを逐次ファイルへ流し、トラックの終わりで MTrk の長さを書き戻す。
+# 出力バイト列は mido.MidiFile.save と同じ（running status の扱いも揃えている）。
+import contextlib
+import mmap
+import os
+import struct
+
+DEFAULT_TICKS_PER_BEAT = 480
+FLUSH_SIZE = 1 << 16
+# MThd のトラック数（mido は符号付きで読むので 0x7FFF まで）
+MAX_TRACKS = 0x7FFF
+
+META_TEXT = 0x01
+META_END_OF_TRACK = 0x2F
+META_SET_TEMPO = 0x51
+
+def encode_varlen(value):
+    out = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.reverse()
+    return bytes(out)
+
+class SmfTrackWriter:
+    """シーク可能なバイナリストリームに SMF を書く。n_tracks > 1 ならトラックの区切りで next_track を呼ぶ。
+    header が偽なら MThd を書かず、out の今の位置からトラックを足す（既存ファイルへの追記用。
+    トラック数は set_track_count で書き直す）。"""
+
+    def __init__(self, out, ticks_per_beat=DEFAULT_TICKS_PER_BEAT, midi_type=1, n_tracks=1, header=True):
+        self.out = out
+        if header:
+            out.write(b"MThd" + struct.pack(">Lhhh", 6, midi_type, n_tracks, ticks_per_beat))
+        self._buf = bytearray()
+        self.closed = False
+        self._start_track()
+
+    def _start_track(self):
+        self._len_pos = self.out.tell() + 4
+        self.out.write(b"MTrk\x00\x00\x00\x00")
+        self._track_len = 0
+        # running status はトラックごと（mido と同じ）
+        self._running = None
+
+    def tell(self):
+        """次のイベントが書かれるファイル内の位置（未フラッシュのバッファ分を含む）。"""
+        return self.out.tell() + len(self._buf)
+
+    def _flush(self):
+        if self._buf:
+            self.out.write(self._buf)
+            self._track_len += len(self._buf)
+            self._buf = bytearray()
+
+    def channel_event(self, delta, status, data1, data2):
+        buf = self._buf
+        buf += encode_varlen(delta)
+        if status != self._running:
+            buf.append(status)
+            self._running = status
+        buf.append(data1)
+        buf.append(data2)
+        if len(buf) >= FLUSH_SIZE:
+            self._flush()
+
+    def meta(self, delta, meta_type, data):
+        self._buf += encode_varlen(delta) + bytes([0xFF, meta_type]) + encode_varlen(len(data)) + data
+        self._running = None
+        if len(self._buf) >= FLUSH_SIZE:
+            self._flush()
+
+    # --- TimeshiftEncoder の出力先としてのインタフェース ---
+    def note(self, note_num, velocity, duration, channel=0):
+        self.channel_event(0, 0x90 | channel, note_num, velocity)
+        self.channel_event(duration, 0x80 | channel, note_num, 0)
+
+    def text(self, text):
+        self.meta(0, META_TEXT, text.encode("latin-1"))
+
+    def _end_track(self):
+        self.meta(0, META_END_OF_TRACK, b"")
+        self._flush()
+        end = self.out.tell()
+        self.out.seek(self._len_pos)
+        self.out.write(struct.pack(">L", self._track_len))
+        self.out.seek(end)
+
+    def next_track(self):
+        """今のトラックを閉じて次のトラックを始める。"""
+        self._end_track()
+        self._start_track()
+
+    def close(self):
+        """end_of_track を書いてトラック長を書き戻す。"""
+        if self.closed:
+            return
+        self._end_track()
+        self.closed = True
+
+def set_track_count(out, n_tracks):
+    """シーク可能な out の MThd のトラック数を書き直す（位置は元に戻す）。"""
+    if not 0 < n_tracks <= MAX_TRACKS:
+        raise ValueError(f"too many tracks for one SMF: {n_tracks} (max {MAX_TRACKS})")
+    pos = out.tell()
+    out.seek(10)
+    out.write(struct.pack(">h", n_tracks))
+    out.seek(pos)
+
+# --- 読み込み ---
+
+# ステータス上位 4bit -> データバイト数
+_CHANNEL_DATA_LEN = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+_SYSTEM_DATA_LEN = {0xF1: 1, 0xF2: 2, 0xF3: 1, 0xF6: 0, 0xF8: 0, 0xFA: 0, 0xFB: 0, 0xFC: 0, 0xFE: 0}
+
+@contextlib.contextmanager
+def open_smf(src):
+    """パスならメモリマップ、bytes 類ならそのまま memoryview として SMF を開く。"""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        yield memoryview(src)
+        return
+    with open(src, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield memoryview(b"")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+def _read_varlen(buf, i):
+    value = 0
+    while True:
+        b = buf[i]
+        i += 1
+        value = (value << 7) | (b & 0x7F)
+        if not b & 0x80:
+            return value, i
+
+def track_ranges(buf):
+    """MTrk チャンクごとの (データ開始, 終了) バイト位置のリスト。"""
+    n = len(buf)
+    if n < 14 or bytes(buf[0:4]) != b"MThd":
+        raise ValueError("not a Standard MIDI File (missing MThd)")
+    ranges = []
+    pos = 8 + struct.unpack(">L", bytes(buf[4:8]))[0]
+    while pos + 8 <= n:
+        name = bytes(buf[pos:pos + 4])
+        size = struct.unpack(">L", bytes(buf[pos + 4:pos + 8]))[0]
+        i = pos + 8
+        pos = i + size
+        if name == b"MTrk":
+            ranges.append((i, min(i + size, n)))
+    return ranges
+
+def ticks_per_beat(buf):
+    """MThd の分解能（tick / 四分音符）。SMPTE 形式の場合はそのままの値を返す。"""
+    if len(buf) < 14 or bytes(buf[0:4]) != b"MThd":
+        raise ValueError("not a Standard MIDI File (missing MThd)")
+    return struct.unpack(">H", bytes(buf[12:14]))[0]
+
+def iter_events(buf):
+    """SMF のバイト列から (delta, kind, note, velocity, text) を先頭から順に返すジェネレータ。
+    kind は 'note_on' / 'note_off' / 'text' / 'end_of_track' / 'set_tempo' / 'meta' / 'sysex' / 'other'。
+    set_tempo のテンポ（usec/beat）は最後の要素（text の位置）に入る。
+    複数トラックはファイル内の順に連結して返す（mido で読んだトラックを連結したものと同じ並び）。"""
+    for start, end in track_ranges(buf):
+        yield from iter_track(buf, start, end)
+
+def iter_track_range(buf, start, end):
+    """トラック内の [start, end) を 1 イベント目から読む（並列復号の分割単位）。
+    start はイベント境界で、running status は未設定として扱う。最後のイベントがちょうど end で
+    終わらなければ分割位置がイベント境界でなかったとみなして ValueError。"""
+    i = yield from iter_track(buf, start, end)
+    if i != end:
+        raise ValueError(f"track range does not end on an event boundary ({i} != {end})")
+
+def iter_track(buf, i, end):
+    """1 トラック（track_ranges の 1 要素）のイベントを順に返す。"""
+    running = None
+    while i < end:
+        delta, i = _read_varlen(buf, i)
+        status = buf[i]
+        if status < 0x80:
+            if running is None:
+                raise ValueError(f"running status without previous status at byte {i}")
+            status = running
+        else:
+            i += 1
+            # Meta messages don't set running status (mido と同じ扱い)
+            if status != 0xFF:
+                running = status
+        if status == 0xFF:
+            meta_type = buf[i]
+            length, i = _read_varlen(buf, i + 1)
+            data = bytes(buf[i:i + length])
+            i += length
+            if meta_type == META_TEXT:
+                yield delta, "text", None, 0, data.decode("latin-1")
+            elif meta_type == META_END_OF_TRACK:
+                yield delta, "end_of_track", None, 0, None
+            elif meta_type == META_SET_TEMPO and length == 3:
+                yield delta, "set_tempo", None, 0, int.from_bytes(data, "big")
+            else:
+                yield delta, "meta", None, 0, None
+        elif status == 0xF0 or status == 0xF7:
+            length, i = _read_varlen(buf, i)
+            i += length
+            yield delta, "sysex", None, 0, None
+        else:
+            hi = status & 0xF0
+            if hi == 0x90:
+                yield delta, "note_on", buf[i], buf[i + 1], None
+                i += 2
+            elif hi == 0x80:
+                yield delta, "note_off", buf[i], buf[i + 1], None
+                i += 2
+            else:
+                i += _CHANNEL_DATA_LEN.get(hi) if hi != 0xF0 else _SYSTEM_DATA_LEN.get(status, 0)
+                yield delta, "other", None, 0, None
+    return i
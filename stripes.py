@@ -0,0 +1,60 @@
+# ストライプ（複数トラック同時演奏）モード
+# 枠付きのシンボル列を round-robin で N 本のトラックに振り分け、各トラックを別々の
+# TimeshiftEncoder（prev_note・SYNC の連鎖・ステップ数はトラックごと）で書く。
+# 全トラックが同時に鳴るので演奏時間はおよそ 1/N になる。
+# 各トラックの先頭に STRIPE:<k>:<n> テキストを置き、デコーダはトラックごとに復号してから
+# シンボルを round-robin で組み直す。トラック k は MIDI チャンネル STRIPE_CHANNELS[k] で鳴らす。
+
+STRIPE_PREFIX = "STRIPE:"
+# チャンネル 10（index 9）はドラム用なので使わない
+STRIPE_CHANNELS = [c for c in range(16) if c != 9]
+MAX_STRIPES = len(STRIPE_CHANNELS)
+
+def format_stripe(k, n):
+    return f"{STRIPE_PREFIX}{k}:{n}"
+
+def parse_stripe(text):
+    """STRIPE テキストから (k, n) を返す。解釈できなければ None。"""
+    if not isinstance(text, str) or not text.startswith(STRIPE_PREFIX):
+        return None
+    parts = text.split(":")
+    if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit():
+        return None
+    k, n = int(parts[1]), int(parts[2])
+    return (k, n) if 0 <= k < n else None
+
+def stripe_marker(events):
+    """(kind, velocity, text) の列のうち、最初のノートより前にある STRIPE テキストの (k, n)。無ければ None。"""
+    for kind, velocity, text in events:
+        if kind == "note_on" and velocity:
+            return None
+        if kind == "text":
+            marker = parse_stripe(text)
+            if marker is not None:
+                return marker
+    return None
+
+def check_stripes(n):
+    if not 1 <= n <= MAX_STRIPES:
+        raise ValueError(f"stripes must be 1..{MAX_STRIPES}: {n}")
+
+def split_symbols(symbols, n):
+    """シンボル列を n 本に振り分ける（シンボル i はストライプ i % n）。"""
+    return [symbols[k::n] for k in range(n)]
+
+def interleave(stripes):
+    """split_symbols の逆。壊れたファイルで長さが揃っていなければ、残っているストライプだけで続ける。"""
+    n = len(stripes)
+    total = sum(len(s) for s in stripes)
+    if all(len(s) == len(range(k, total, n)) for k, s in enumerate(stripes)):
+        out = [0] * total
+        for k, s in enumerate(stripes):
+            out[k::n] = s
+        return out
+    out = []
+    longest = max((len(s) for s in stripes), default=0)
+    for i in range(longest):
+        for s in stripes:
+            if i < len(s):
+                out.append(s[i])
+    return out
@@ -0,0 +1,60 @@
+# SYNC メタテキストの組み立て・解釈
+# 形式: SYNC:<step>:<note>:<crc>[:key=value ...]
+#   旧形式 SYNC:step:note:XX（CRC-8）はそのまま読める。拡張フィールドは key=value で後ろに足す。
+#   alg=<名前> で CRC の種類を指定（省略時 crc8）。
+#   off=<ビット数> はそのブロックの終わりまでのシンボル列の累積ビット数（エンコーダの sync_offsets で付く。
+#   ストライプ形式ではそのトラックのシンボル列での値）。resync 復号の位置合わせに使う。
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from checksum import CHECKSUMS, DEFAULT_CHECKSUM, hex_digits
+
+SYNC_PREFIX = "SYNC:"
+OFFSET_KEY = "off"
+
+@dataclass
+class SyncMarker:
+    step: str
+    note: str
+    crc: Optional[int]
+    algo: str = DEFAULT_CHECKSUM
+    extra: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def crc_known(self):
+        # 未知のアルゴリズムや壊れた CRC 欄は検証できない
+        return self.crc is not None and self.algo in CHECKSUMS
+
+    @property
+    def bit_offset(self):
+        # off= が無い・壊れているときは None
+        value = self.extra.get(OFFSET_KEY)
+        return int(value) if value is not None and value.isdigit() else None
+
+def format_sync(step, note, crc, algo=DEFAULT_CHECKSUM, **extra):
+    text = f"SYNC:{step}:{note}:{crc:0{hex_digits(algo)}X}"
+    if algo != DEFAULT_CHECKSUM:
+        text += f":alg={algo}"
+    for k, v in extra.items():
+        text += f":{k}={v}"
+    return text
+
+def parse_sync(text):
+    """SYNC テキストを解釈する。SYNC でない・欄が足りないときは None。"""
+    if not isinstance(text, str) or not text.startswith(SYNC_PREFIX):
+        return None
+    parts = text.split(":")
+    if len(parts) < 4:
+        return None
+    _, s_step, s_note, s_crc = parts[:4]
+    extra = {}
+    for p in parts[4:]:
+        k, sep, v = p.partition("=")
+        if sep:
+            extra[k] = v
+    algo = extra.pop("alg", DEFAULT_CHECKSUM)
+    try:
+        crc = int(s_crc, 16)
+    except ValueError:
+        crc = None
+    return SyncMarker(s_step, s_note, crc, algo, extra)
@@ -1,14 +1,9 @@
-import subprocess
-import sys
-import os
-import re
-import tempfile
-import shutil
 from pathlib import Path
 
+import timeshift_codec
+from batch_timeshift import first_diff_index
+
 SCRIPT_DIR = Path(__file__).parent
-ENCODER = "makemidi_adaptive_timeshift.py"
-DECODER = "decode_adaptive_timeshift_decode.py"
 MID_DIR = SCRIPT_DIR / "mid"
 MID_DIR.mkdir(exist_ok=True)
 
@@ -22,57 +17,33 @@ SAMPLES = [
     "Emoji test 👍🚀🎵",
 ]
 
-def run_script(script, stdin_text, cwd=SCRIPT_DIR):
-    proc = subprocess.run([sys.executable, script], input=stdin_text, text=True,
-                          capture_output=True, cwd=str(cwd))
-    return proc
-
-def extract_saved_mid(stdout, fallback_basename):
-    m = re.search(r"MIDI saved:\s*(?:mid/)?([^\s]+\.mid)", stdout)
-    if m:
-        return m.group(1)
-    return f"{fallback_basename}.mid"
-
-def extract_decoded_text(dec_stdout):
-    m = re.search(r"復号テキスト:\s*(.*)", dec_stdout)
-    if m:
-        return m.group(1).strip()
-    # fallback: try last non-empty line
-    lines = [l.strip() for l in dec_stdout.splitlines() if l.strip()]
-    return lines[-1] if lines else ""
-
 def main():
     results = []
     for i, text in enumerate(SAMPLES, start=1):
         basename = f"testcase_{i:02d}_timeshift"
         print(f"\n--- CASE {i} ---")
         print(f"原文: {repr(text)[:120]}")
-        # run encoder
-        enc_proc = run_script(ENCODER, f"{text}\n{basename}\n")
-        if enc_proc.returncode != 0:
-            print(f"[ENCODER ERROR] returncode={enc_proc.returncode}")
-            print(enc_proc.stderr)
+        # run encoder (in-process)
+        try:
+            mid_path = timeshift_codec.save(timeshift_codec.encode(text), basename, MID_DIR)
+        except Exception as e:
+            print(f"[ENCODER ERROR] {e!r}")
             results.append((text, False, "encoder_failed"))
             continue
-        saved_mid = extract_saved_mid(enc_proc.stdout, basename)
-        mid_path = MID_DIR / saved_mid
-        if not mid_path.exists():
-            # fallback path
-            mid_path = MID_DIR / f"{basename}.mid"
         print(f"生成されたMIDI: {mid_path}")
         if not mid_path.exists():
             print("[ERROR] MIDIが見つかりません")
             results.append((text, False, "mid_missing"))
             continue
 
-        # run decoder
-        dec_proc = run_script(DECODER, f"{Path(saved_mid).stem}\n")
-        if dec_proc.returncode != 0:
-            print(f"[DECODER ERROR] returncode={dec_proc.returncode}")
-            print(dec_proc.stderr)
+        # run decoder (in-process)
+        try:
+            dec = timeshift_codec.decode(mid_path)
+        except Exception as e:
+            print(f"[DECODER ERROR] {e!r}")
             results.append((text, False, "decoder_failed"))
             continue
-        decoded = extract_decoded_text(dec_proc.stdout)
+        decoded = dec.text
         ok = decoded == text
         # 復号結果表示（簡潔）
         print(f"復号結果: {repr(decoded)[:120]}")
@@ -84,14 +55,7 @@ def main():
             print(f"orig_len={len(text)} dec_len={len(decoded)}")
             print(f"orig_bytes_len={len(orig_bytes)} dec_bytes_len={len(dec_bytes)}")
             # 最初の差分位置を探す
-            min_len = min(len(orig_bytes), len(dec_bytes))
-            diff_idx = None
-            for j in range(min_len):
-                if orig_bytes[j] != dec_bytes[j]:
-                    diff_idx = j
-                    break
-            if diff_idx is None and len(orig_bytes) != len(dec_bytes):
-                diff_idx = min_len
+            diff_idx = first_diff_index(orig_bytes, dec_bytes)
             if diff_idx is not None:
                 context_start = max(0, diff_idx-8)
                 context_end = min(len(orig_bytes), diff_idx+8)
@@ -0,0 +1,201 @@
+# timeshift コーデックの往復（encode → decode）とバイト単位の同一性のテスト（pytest）
+#   python -m pytest -q test_timeshift_roundtrip.py
+# ファイルは pytest の tmp_path にだけ書く（mid/ には触れない）。
+import io
+import random
+
+import pytest
+
+import parallel_decode
+import timeshift_cli
+import timeshift_codec
+from archive import ArchiveError, append_archive, extract, read_directory, write_archive
+from codec_mode import CLASSIC_BITS, MAX_BITS
+from compression import CODECS
+from decode_adaptive_timeshift_decode import StreamDecoder, decode_midi, decode_smf
+from makemidi_adaptive_timeshift import encode_bytes, stream_encode
+from seek_index import decode_range
+
+def _payload(n, seed=0):
+    return random.Random(seed).randbytes(n)
+
+def _smf(payload, **kwargs):
+    return timeshift_codec.midi_to_bytes(timeshift_codec.encode_bytes(payload, **kwargs))
+
+@pytest.mark.parametrize("text", ["Hello", "これは日本語のテストです。", "Emoji test 👍🚀🎵", ""])
+def test_text_roundtrip(text):
+    assert timeshift_codec.decode(timeshift_codec.encode(text)).text == text
+
+def test_bytes_roundtrip():
+    payload = _payload(1000)
+    result = timeshift_codec.decode(_smf(payload))
+    assert result.payload == payload and result.crc_ok
+
+@pytest.mark.parametrize("algo", ["crc8", "crc16", "crc32"])
+def test_checksum_roundtrip(algo):
+    payload = _payload(800)
+    result = timeshift_codec.decode(_smf(payload, checksum_algo=algo))
+    assert result.payload == payload and result.crc_ok
+
+def test_stream_encode_with_length_matches_encode_bytes():
+    payload = _payload(5000)
+    out = io.BytesIO()
+    stream_encode(io.BytesIO(payload), out, length=len(payload))
+    assert out.getvalue() == _smf(payload)
+
+def test_stream_format_roundtrip(tmp_path):
+    payload = _payload(5000)
+    (tmp_path / "in.bin").write_bytes(payload)
+    timeshift_codec.encode_file(tmp_path / "in.bin", tmp_path / "out.mid")
+    result = timeshift_codec.decode(tmp_path / "out.mid")
+    assert result.payload == payload and result.trailer_ok
+
+def test_stream_decoder_roundtrip(tmp_path):
+    payload = _payload(5000)
+    (tmp_path / "in.bin").write_bytes(payload)
+    timeshift_codec.encode_file(tmp_path / "in.bin", tmp_path / "stream.mid")
+    for src in (_smf(payload), tmp_path / "stream.mid"):
+        dec = StreamDecoder(src)
+        assert b"".join(dec) == payload
+        assert dec.crc_ok
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parallel_decode_matches_serial(monkeypatch, workers):
+    # 小さな区間に分けて、区間の継ぎ目を実際に通す
+    monkeypatch.setattr(parallel_decode, "MIN_CHUNK_BYTES", 4096)
+    payload = _payload(30000)
+    smf = _smf(payload)
+    result = parallel_decode.decode_parallel(smf, workers=workers)
+    assert result.payload == payload
+    assert result.sync_blocks == decode_smf(smf).sync_blocks
+
+@pytest.mark.parametrize("method", ["auto"] + list(CODECS))
+def test_compression_roundtrip(method):
+    payload = b"timeshift " * 500 + _payload(100)
+    smf = _smf(payload, compress=method)
+    assert len(smf) < len(_smf(payload))
+    assert decode_smf(smf).payload == payload
+
+@pytest.mark.parametrize("bits", range(CLASSIC_BITS, MAX_BITS + 1))
+def test_hd_modes_roundtrip(bits):
+    payload = _payload(1500, bits)
+    result = decode_smf(_smf(payload, bits_per_note=bits))
+    assert result.payload == payload
+    assert result.crc_ok
+    assert result.bits_per_note == bits
+
+@pytest.mark.parametrize("stripes", [2, 3, 15])
+def test_stripes_roundtrip(stripes):
+    payload = _payload(3000, stripes)
+    smf = _smf(payload, stripes=stripes)
+    assert decode_smf(smf).payload == payload
+    assert timeshift_codec.decode(smf).payload == payload
+    assert parallel_decode.decode_parallel(smf, workers=1).payload == payload
+
+@pytest.mark.parametrize("bits", [CLASSIC_BITS, 10])
+def test_numpy_and_pure_encode_identical(monkeypatch, bits):
+    pytest.importorskip("numpy")
+    payload = _payload(20000, bits)
+    monkeypatch.setenv("TIMESHIFT_NUMPY", "0")
+    pure = _smf(payload, bits_per_note=bits)
+    monkeypatch.setenv("TIMESHIFT_NUMPY", "1")
+    assert _smf(payload, bits_per_note=bits) == pure
+
+def _drop_note(mid, n):
+    # n 番目のノートを note_on / note_off ごと消す（時間はその後のイベントに寄せる）
+    track = mid.tracks[0]
+    on = [i for i, m in enumerate(track) if m.type == "note_on" and m.velocity][n]
+    off = next(i for i in range(on + 1, len(track))
+               if track[i].type in ("note_off", "note_on") and track[i].note == track[on].note)
+    track[off + 1].time += sum(m.time for m in track[on:off + 1])
+    del track[off], track[on]
+
+def _damaged(result):
+    damaged = set()
+    for a, b in result.payload_erasures:
+        damaged.update(range(a, b))
+    return damaged
+
+def test_resync_after_dropped_note():
+    payload = _payload(3000)
+    mid = encode_bytes(payload, sync_offsets=True)
+    _drop_note(mid, 500)
+    result = decode_midi(mid, resync=True)
+    assert len(result.payload) == len(payload)
+    damaged = _damaged(result)
+    assert damaged and len(damaged) < 64
+    assert all(result.payload[i] == payload[i] for i in range(len(payload)) if i not in damaged)
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_decode_range(tmp_path, stream):
+    payload = _payload(20000)
+    path = tmp_path / "seek.mid"
+    if stream:
+        (tmp_path / "in.bin").write_bytes(payload)
+        timeshift_codec.encode_file(tmp_path / "in.bin", path, seek_index=True)
+    else:
+        with open(path, "wb") as f:
+            timeshift_codec.write_smf(timeshift_codec.encode_events(payload), f, seek_index=True)
+    assert decode_smf(path).payload == payload
+    for start, length in [(0, 10), (1, 1), (777, 3000), (19990, 100), (25000, 5)]:
+        res = decode_range(path, start, length)
+        assert res.indexed
+        assert res.crc_ok
+        assert res.payload == payload[start:start + length]
+
+def _archive(path, items):
+    with open(path, "wb") as f:
+        write_archive(items, f)
+    return path
+
+def test_archive_extract(tmp_path):
+    items = [("a", _payload(300, 1)), ("日本語", "タイトル".encode("utf-8") * 20), ("empty", b"")]
+    path = _archive(tmp_path / "box.mid", items)
+    append_archive(path, [("b", _payload(1000, 2))], bits_per_note=12)
+    items.append(("b", _payload(1000, 2)))
+
+    assert [e.title for e in read_directory(path)] == [title for title, _ in items]
+    for k, (title, payload) in enumerate(items):
+        assert extract(path, k) == payload
+        assert extract(path, title) == payload
+    assert [p.name for p in tmp_path.iterdir()] == ["box.mid"]
+
+def test_facade_forwards_resync_options():
+    payload = _payload(3000)
+    mid = timeshift_codec.encode_bytes(payload, sync_offsets=True)
+    assert any("off=" in getattr(m, "text", "") for m in mid.tracks[0])
+    _drop_note(mid, 500)
+    result = timeshift_codec.decode(mid, resync=True)
+    assert len(result.payload) == len(payload) and result.erasures
+
+def test_unknown_checksum_rejected():
+    # 1 ブロックに満たない入力でもすぐに失敗する
+    with pytest.raises(ValueError):
+        timeshift_codec.encode_bytes(b"x", checksum_algo="md5")
+
+def test_decoders_reject_archive(tmp_path):
+    path = _archive(tmp_path / "box.mid", [("a", b"hello"), ("b", b"world")])
+    stream = lambda src: b"".join(StreamDecoder(src))
+    for decode in (decode_smf, parallel_decode.decode_parallel, stream, timeshift_codec.decode):
+        with pytest.raises(ArchiveError):
+            decode(path)
+
+def test_cli_stream_decode_rejects_archive(tmp_path, capsys):
+    path = _archive(tmp_path / "box.mid", [("a", b"hello"), ("b", b"world")])
+    assert timeshift_cli.main(["decode", str(path), "--stream", "-o", str(tmp_path / "out.bin")]) != 0
+    assert "archive" in capsys.readouterr().err
+    assert not (tmp_path / "out.bin").exists()
+
+def test_resync_after_unpaired_note():
+    # note_on の音高だけ変えて note_off と組にならないノートを作る
+    payload = _payload(3000)
+    mid = encode_bytes(payload, sync_offsets=True)
+    on = [m for m in mid.tracks[0] if m.type == "note_on" and m.velocity][505]
+    on.note ^= 1
+    result = decode_midi(mid, resync=True)
+    assert len(result.payload) == len(payload)
+    labels = [label for label, _, _ in result.sync_blocks]
+    assert len(labels) == len(set(labels))
+    damaged = _damaged(result)
+    assert damaged and len(damaged) <= 16
+    assert all(result.payload[i] == payload[i] for i in range(len(payload)) if i not in damaged)
@@ -0,0 +1,383 @@
+# timeshift コーデックの非対話 CLI（シェルのパイプや cron のバッチ向け）
+#   python timeshift_cli.py encode message.txt -o message.mid
+#   printf 'hello' | python timeshift_cli.py encode - -o - > hello.mid      # - は標準入出力（バイナリ）
+#   python timeshift_cli.py encode big.bin --stream -o big.mid              # メモリ一定のストリーム形式
+#   python timeshift_cli.py decode hello.mid -o -                           # ペイロードをそのまま stdout へ
+#   python timeshift_cli.py decode damaged.mid --resync -o out.bin          # ノートの欠落・挿入を SYNC で合わせ直す
+#   python timeshift_cli.py decode big.mid --range 1000000:4096 -o -        # encode --seek-index の索引で一部だけ復号
+#   python timeshift_cli.py inspect hello.mid --json
+#   python timeshift_cli.py repair broken.mid -o fixed.mid                  # CRC 不一致のブロックを候補探索で修復
+#   python timeshift_cli.py archive create box.mid a.txt b.txt              # 複数メッセージを 1 ファイルに（archive 参照）
+#   python timeshift_cli.py batch corpus.jsonl --out mid/batch --workers 4  # batch_timeshift と同じ引数
+# コーデック本体（と mido）はサブコマンドの中で import するので、--help や小さな処理はすぐ終わる。
+# 終了コード: 0 成功 / 1 CRC 不一致など検証の失敗 / 2 引数・入出力のエラー / 3 出力先のパイプが閉じられた
+import argparse
+import os
+import sys
+from contextlib import nullcontext
+
+from codec_log import LEVEL_NAMES
+
+EXIT_OK = 0
+EXIT_VERIFY = 1
+EXIT_USAGE = 2
+EXIT_BROKEN_PIPE = 3
+
+class CliError(Exception):
+    pass
+
+def _log(args):
+    # ログは常に stderr へ（stdout はペイロード用に空けておく）
+    from codec_log import CodecLog
+    return CodecLog(LEVEL_NAMES[args.log], stream=sys.stderr)
+
+def _read_input(path):
+    if path == "-":
+        return sys.stdin.buffer.read()
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError as e:
+        raise CliError(f"cannot read {path}: {e.strerror}")
+
+def _open_output(path, tty_ok=False):
+    """出力先を開く。- は stdout（tty_ok でなければ端末には書かない）。"""
+    if path == "-":
+        if not tty_ok and sys.stdout.isatty():
+            raise CliError("refusing to write binary data to a terminal; use -o FILE or a pipe")
+        return nullcontext(sys.stdout.buffer)
+    try:
+        return open(path, "wb")
+    except OSError as e:
+        raise CliError(f"cannot write {path}: {e.strerror}")
+
+# --- encode ---
+def cmd_encode(args):
+    from codec_mode import get_mode
+    from compression import METHODS
+    from stripes import check_stripes
+    try:
+        get_mode(args.bits)
+        check_stripes(args.stripes)
+    except ValueError as e:
+        raise CliError(str(e))
+    if args.compress not in METHODS:
+        raise CliError(f"--compress must be one of {', '.join(METHODS)}")
+    if args.seek_index and args.stripes != 1:
+        raise CliError("--seek-index does not support --stripes")
+    output = args.output
+    if output is None:
+        if args.title:
+            from makemidi_adaptive_timeshift import output_filename_for
+            from midi_shared import MID_DIR, ensure_dir
+            output = output_filename_for(args.title, str(ensure_dir(MID_DIR)))
+        else:
+            output = "-"
+
+    if args.stream:
+        if args.stripes != 1 or args.compress not in ("none", "auto"):
+            raise CliError("--stream does not support --stripes or --compress")
+        from makemidi_adaptive_timeshift import stream_encode
+        src = sys.stdin.buffer if args.input == "-" else _open_stream(args.input)
+        with src, _open_output(output) as dst:
+            n = stream_encode(src, dst, args.checksum, bits_per_note=args.bits, sync_offsets=args.sync_offsets,
+                              seek_index=args.seek_index)
+        _note(args, f"encoded {n} bytes (stream) -> {output}")
+        return EXIT_OK
+
+    from makemidi_adaptive_timeshift import encode_events
+    from event_store import write_smf
+    payload = _read_input(args.input)
+    stores = encode_events(payload, log=_log(args), checksum_algo=args.checksum, compress=args.compress,
+                           bits_per_note=args.bits, stripes=args.stripes, sync_offsets=args.sync_offsets)
+    with _open_output(output) as dst:
+        write_smf(stores, dst, seek_index=args.seek_index)
+    _note(args, f"encoded {len(payload)} bytes, {sum(s.note_count for s in stores)} notes -> {output}")
+    return EXIT_OK
+
+def _open_stream(path):
+    try:
+        return open(path, "rb")
+    except OSError as e:
+        raise CliError(f"cannot read {path}: {e.strerror}")
+
+def _note(args, msg):
+    if not args.quiet:
+        print(msg, file=sys.stderr)
+
+# --- decode ---
+def _parse_range(text):
+    start, sep, length = text.partition(":")
+    if not sep or not start.isdigit() or not length.isdigit():
+        raise CliError(f"--range must be START:LENGTH (bytes): {text!r}")
+    return int(start), int(length)
+
+def cmd_decode(args):
+    if args.range is not None:
+        if args.stream or args.workers or args.cache or args.resync:
+            raise CliError("--range cannot be combined with --stream, --workers, --cache or --resync")
+        from seek_index import decode_range
+        start, length = _parse_range(args.range)
+        src = _read_input("-") if args.input == "-" else _check_file(args.input)
+        result = decode_range(src, start, length)
+        if not result.indexed:
+            _note(args, "no usable seek index; decoded the whole file")
+        with _open_output(args.output, tty_ok=True) as dst:
+            dst.write(result.payload)
+        if result.crc_errors:
+            return _report(args, result.crc_errors, None, 0)
+        end = result.start + len(result.payload)
+        _note(args, f"decoded bytes [{result.start}, {end}) from {len(result.sync_blocks)} blocks, crc ok")
+        return EXIT_OK
+
+    if args.resync:
+        if args.stream or args.workers or args.cache:
+            raise CliError("--resync cannot be combined with --stream, --workers or --cache")
+        from decode_adaptive_timeshift_decode import decode_smf
+        src = _read_input("-") if args.input == "-" else _check_file(args.input)
+        result = decode_smf(src, log=_log(args), resync=True)
+        with _open_output(args.output, tty_ok=True) as dst:
+            dst.write(result.payload)
+        erasures = result.payload_erasures
+        if erasures is None:
+            erasures = [(a, b) for a, b in result.erasures]
+            where = "raw stream (compressed payload)"
+        else:
+            where = "payload"
+        for a, b in erasures[:10]:
+            print(f"  erasure {where} bytes [{a}, {b})", file=sys.stderr)
+        return _report(args, result.crc_errors, result.trailer_ok, result.notes, result.expected_len)
+
+    if args.stream:
+        from decode_adaptive_timeshift_decode import StreamDecoder
+        src = _read_input("-") if args.input == "-" else _check_file(args.input)
+        dec = StreamDecoder(src)
+        # 最初の塊まで進めてから出力を開く（アーカイブなど復号できない入力で空のファイルを残さない）
+        chunks = iter(dec)
+        first = next(chunks, b"")
+        with _open_output(args.output, tty_ok=True) as dst:
+            dst.write(first)
+            for chunk in chunks:
+                dst.write(chunk)
+        if dec.striped:
+            _note(args, "striped input: decoded in one pass, not streamed")
+        return _report(args, dec.crc_errors, dec.trailer_ok, dec.notes, dec.expected_len)
+
+    if args.cache and args.input == "-":
+        raise CliError("--cache needs a file path (the cache is keyed by path); it cannot be used with stdin")
+    if args.cache:
+        from decode_cache import cached_decode
+        from decode_adaptive_timeshift_decode import decode_smf
+        decoder = _parallel_decoder(args.workers) if args.workers else decode_smf
+        result = cached_decode(_check_file(args.input), log=_log(args), decoder=decoder)
+    else:
+        src = _read_input("-") if args.input == "-" else _check_file(args.input)
+        if args.workers:
+            from parallel_decode import decode_parallel
+            result = decode_parallel(src, workers=args.workers)
+        else:
+            from decode_adaptive_timeshift_decode import decode_smf
+            result = decode_smf(src, log=_log(args))
+    # 復号結果はテキストのことが多いので端末にもそのまま出す
+    with _open_output(args.output, tty_ok=True) as dst:
+        dst.write(result.payload)
+    return _report(args, result.crc_errors, result.trailer_ok, result.notes, result.expected_len)
+
+def _parallel_decoder(workers):
+    def decode(path, log=None):
+        from parallel_decode import decode_parallel
+        return decode_parallel(path, workers=workers)
+    return decode
+
+def _check_file(path):
+    if not os.path.isfile(path):
+        raise CliError(f"no such file: {path}")
+    return path
+
+def _report(args, crc_errors, trailer_ok, notes, expected_len=0):
+    if expected_len is None:
+        # トラックが無い・長さヘッダ（4 バイト）ぶんのノートも無い: timeshift のファイルではない
+        print("verify failed: no timeshift payload (no tracks or no length header)", file=sys.stderr)
+        return EXIT_VERIFY
+    if crc_errors or trailer_ok is False:
+        print(f"verify failed: crc_errors={len(crc_errors)} trailer_ok={trailer_ok}", file=sys.stderr)
+        for step, rep, act in crc_errors[:10]:
+            print(f"  SYNC {step}: reported={rep} actual={act}", file=sys.stderr)
+        return EXIT_VERIFY
+    _note(args, f"decoded {notes} notes, crc ok")
+    return EXIT_OK
+
+# --- inspect ---
+def inspect_smf(src):
+    """SMF の構造と復号結果の要約を dict で返す（inspect サブコマンド用）。"""
+    from decode_adaptive_timeshift_decode import decode_smf
+    from seek_index import read_seek_index
+    from smf_stream import iter_track, open_smf, ticks_per_beat, track_ranges
+    from stripes import stripe_marker
+    info = {}
+    with open_smf(src) as buf:
+        info["smf_bytes"] = len(buf)
+        info["ticks_per_beat"] = ticks_per_beat(buf)
+        ranges = track_ranges(buf)
+        info["tracks"] = len(ranges)
+        ticks = 0
+        stripes = 0
+        for r in ranges:
+            events = list(iter_track(buf, *r))
+            ticks = max(ticks, sum(ev[0] for ev in events))
+            if stripe_marker((ev[1], ev[3], ev[4]) for ev in events):
+                stripes += 1
+        info["stripes"] = stripes or 1
+        seek = read_seek_index(buf)
+        info["seek_entries"] = len(seek[1]) if seek else 0
+        info["ticks"] = ticks
+        # テンポ指定なし（120 BPM）として演奏時間を出す
+        info["seconds"] = round(ticks / info["ticks_per_beat"] * 0.5, 3) if info["ticks_per_beat"] else None
+    result = decode_smf(src)
+    info.update({
+        "bits_per_note": result.bits_per_note,
+        "notes": result.notes,
+        "payload_bytes": len(result.payload),
+        "expected_len": result.expected_len,
+        "sync_blocks": len(result.sync_blocks),
+        "crc_errors": [list(b) for b in result.crc_errors],
+        "trailer_ok": result.trailer_ok,
+        "crc_ok": result.crc_ok,
+    })
+    return info, result
+
+def cmd_inspect(args):
+    src = _read_input("-") if args.input == "-" else _check_file(args.input)
+    try:
+        info, result = inspect_smf(src)
+    except (ValueError, IndexError) as e:
+        raise CliError(f"not a readable timeshift MIDI file: {e}")
+    info["file"] = args.input
+    if args.json:
+        import json
+        print(json.dumps(info, ensure_ascii=False))
+    else:
+        for key, value in info.items():
+            if key == "crc_errors":
+                value = len(value)
+            print(f"{key:14s} {value}")
+        if args.text:
+            print(f"{'text':14s} {result.text!r}")
+    return EXIT_OK if info["crc_ok"] else EXIT_VERIFY
+
+# --- repair ---
+def cmd_repair(args):
+    from repair import apply_fixes, print_report, repair_smf
+    src = _read_input("-") if args.input == "-" else _check_file(args.input)
+    report = repair_smf(src, workers=args.workers, max_trials=args.max_trials)
+    if not args.quiet:
+        print_report(args.input, report, out=sys.stderr)
+    with _open_output(args.output) as dst:
+        apply_fixes(src, report.fixes, dst)
+    if report.failed:
+        print(f"repair incomplete: {len(report.failed)} of {len(report.blocks)} blocks", file=sys.stderr)
+        return EXIT_VERIFY
+    _note(args, f"repaired {len(report.blocks)} blocks -> {args.output}")
+    return EXIT_OK
+
+# --- archive ---
+def cmd_archive(args):
+    from archive import main as archive_main
+    try:
+        return archive_main(args.archive_args)
+    except (ValueError, OSError) as e:
+        # ArchiveError（アーカイブでない・検証の失敗）も ValueError
+        raise CliError(str(e))
+
+# --- batch ---
+def cmd_batch(args):
+    from batch_timeshift import main as batch_main
+    return batch_main(args.batch_args)
+
+def build_parser():
+    ap = argparse.ArgumentParser(prog="timeshift_cli.py", description="timeshift MIDI コーデック（非対話 CLI）")
+    ap.add_argument("-q", "--quiet", action="store_true", help="stderr への要約を出さない")
+    ap.add_argument("--log", default="silent", choices=list(LEVEL_NAMES),
+                    help="コーデックのログ（stderr へ）")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    enc = sub.add_parser("encode", help="バイト列を .mid にする")
+    enc.add_argument("input", nargs="?", default="-", help="入力ファイル（- で stdin、既定）")
+    enc.add_argument("-o", "--output", default=None,
+                     help="出力 .mid（- で stdout。省略時は --title があれば mid/<title>_timeshift.mid、なければ stdout）")
+    enc.add_argument("--title", default=None, help="mid/ に保存するときのタイトル")
+    enc.add_argument("--bits", type=int, default=6, help="1 ノートあたりのビット数（6 = 従来、7〜14 = hd モード）")
+    enc.add_argument("--stripes", type=int, default=1, help="同時に鳴らすトラック数")
+    enc.add_argument("--compress", default="auto", help="圧縮方式（none / auto / zlib / lzma）")
+    enc.add_argument("--checksum", default="crc8", choices=["crc8", "crc16", "crc32"])
+    enc.add_argument("--stream", action="store_true",
+                     help="入力を読みながら書く（メモリ一定、ストリーム形式。圧縮・ストライプなし）")
+    enc.add_argument("--sync-offsets", action="store_true",
+                     help="SYNC に累積ビット数 off= を書く（decode --resync の位置合わせ用）")
+    enc.add_argument("--seek-index", action="store_true",
+                     help="末尾に索引トラックを足す（decode --range で必要なブロックだけ復号できる）")
+    enc.set_defaults(func=cmd_encode)
+
+    dec = sub.add_parser("decode", help=".mid からペイロードを取り出す")
+    dec.add_argument("input", nargs="?", default="-", help="入力 .mid（- で stdin、既定）")
+    dec.add_argument("-o", "--output", default="-", help="ペイロードの出力先（- で stdout、既定）")
+    dec.add_argument("--workers", type=int, default=None, help="区間並列で復号するプロセス数")
+    dec.add_argument("--stream", action="store_true", help="メモリ一定のストリーム復号")
+    dec.add_argument("--cache", action="store_true", help="artifacts/decode_cache の復号キャッシュを使う")
+    dec.add_argument("--resync", action="store_true",
+                     help="ノートの欠落・挿入を SYNC で合わせ直し、壊れた範囲を stderr に出す")
+    dec.add_argument("--range", default=None, metavar="START:LENGTH",
+                     help="ペイロードの一部（バイト位置）だけを復号する（索引付きのファイルなら必要なブロックだけ読む）")
+    dec.set_defaults(func=cmd_decode)
+
+    ins = sub.add_parser("inspect", help=".mid の構造と検証結果を表示する")
+    ins.add_argument("input", help="入力 .mid（- で stdin）")
+    ins.add_argument("--json", action="store_true", help="1 行の JSON で出す")
+    ins.add_argument("--text", action="store_true", help="復号テキストも表示する")
+    ins.set_defaults(func=cmd_inspect)
+
+    rep = sub.add_parser("repair", help="CRC が一致しない SYNC ブロックを候補探索で修復した .mid を書く")
+    rep.add_argument("input", help="入力 .mid（- で stdin）")
+    rep.add_argument("-o", "--output", default="-", help="修復した .mid の出力先（- で stdout、既定）")
+    rep.add_argument("--workers", type=int, default=None, help="探索に使うプロセス数（既定: CPU 数）")
+    rep.add_argument("--max-trials", type=int, default=None, help="1 ブロックあたりに試す候補数の上限")
+    rep.set_defaults(func=cmd_repair)
+
+    arc = sub.add_parser("archive", help="複数メッセージのアーカイブ（create / append / list / extract、archive.py と同じ引数）",
+                         add_help=False)
+    arc.add_argument("archive_args", nargs=argparse.REMAINDER)
+    arc.set_defaults(func=cmd_archive)
+
+    bat = sub.add_parser("batch", help="一括 encode/decode/検証（引数は batch_timeshift.py と同じ）",
+                         add_help=False)
+    bat.add_argument("batch_args", nargs=argparse.REMAINDER)
+    bat.set_defaults(func=cmd_batch)
+    return ap
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ["batch"]:
+        # batch の引数（--help を含む）はそのまま batch_timeshift に渡す
+        from batch_timeshift import main as batch_main
+        return batch_main(argv[1:])
+    if argv[:1] == ["archive"] and any(a in ("-h", "--help") for a in argv[1:]):
+        from archive import main as archive_main
+        return archive_main(argv[1:])
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except CliError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    except ValueError as e:
+        # SMF として読めない入力など
+        print(f"error: {args.input}: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    except BrokenPipeError:
+        # head などで読み手が先に閉じた場合。終了時の flush で再び例外にならないよう stdout を捨てる
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return EXIT_BROKEN_PIPE
+
+if __name__ == "__main__":
+    sys.exit(main())
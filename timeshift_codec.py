@@ -0,0 +1,83 @@
+# timeshift エンコーダ/デコーダのライブラリ API
+# サブプロセスを起動せず同一プロセス内で encode → decode を呼び出すための薄いラッパー
+import io
+from pathlib import Path
+
+from mido import MidiFile
+
+from midi_shared import MID_DIR
+from checksum import DEFAULT_CHECKSUM
+from codec_mode import CLASSIC_BITS
+from codec_stats import CodecStats, get_stats
+from event_store import EventStore, write_smf
+from makemidi_adaptive_timeshift import (encode_bytes as _encode_bytes, encode_events as _encode_events,
+                                         output_filename_for, stream_encode)
+from decode_adaptive_timeshift_decode import DecodeResult, StreamDecoder, decode_events, decode_midi, stream_decode
+from parallel_decode import decode_parallel
+from seek_index import RangeResult, decode_range
+
+__all__ = ["DecodeResult", "StreamDecoder", "encode", "encode_bytes", "stream_encode", "encode_file",
+           "midi_to_bytes", "save", "load", "decode", "decode_parallel", "stream_decode", "CodecStats",
+           "encode_events", "decode_events", "EventStore", "write_smf", "RangeResult", "decode_range"]
+
+def encode(text, log=None, checksum_algo=DEFAULT_CHECKSUM, compress=None, bits_per_note=CLASSIC_BITS,
+           stripes=1, on_sync=None, stats=None, sync_offsets=False):
+    """text を UTF-8 でエンコードした MidiFile を返す。log は codec_log.get_log が受け付ける値、
+    compress は圧縮方式（"auto" で最短のものを自動選択）、bits_per_note は 6（従来）〜14（hd モード）、
+    stripes は同時に鳴らすトラック数（1〜15）。on_sync(step, crc) は SYNC を書くたびに呼ばれる。
+    stats は段階ごとの計測（codec_stats 参照）。sync_offsets が真なら SYNC に off= を書く（decode の resync 用）。"""
+    return _encode_bytes(text.encode('utf-8'), log=log, checksum_algo=checksum_algo, compress=compress,
+                         bits_per_note=bits_per_note, stripes=stripes, on_sync=on_sync, stats=stats,
+                         sync_offsets=sync_offsets)
+
+def encode_bytes(payload, log=None, checksum_algo=DEFAULT_CHECKSUM, compress=None, bits_per_note=CLASSIC_BITS,
+                 stripes=1, on_sync=None, stats=None, sync_offsets=False):
+    return _encode_bytes(bytes(payload), log=log, checksum_algo=checksum_algo, compress=compress,
+                         bits_per_note=bits_per_note, stripes=stripes, on_sync=on_sync, stats=stats,
+                         sync_offsets=sync_offsets)
+
+def encode_events(payload, log=None, checksum_algo=DEFAULT_CHECKSUM, compress=None, bits_per_note=CLASSIC_BITS,
+                  stripes=1, on_sync=None, stats=None, sync_offsets=False):
+    """encode_bytes と同じだが、mido の MidiFile ではなくトラックごとの EventStore のリストを返す。
+    write_smf(stores, f) で .mid に書け、decode_events でそのまま復号できる。"""
+    return _encode_events(bytes(payload), log=log, checksum_algo=checksum_algo, compress=compress,
+                          bits_per_note=bits_per_note, stripes=stripes, on_sync=on_sync, stats=stats,
+                          sync_offsets=sync_offsets)
+
+def encode_file(src_path, dst_path, checksum_algo=DEFAULT_CHECKSUM, bits_per_note=CLASSIC_BITS, stats=None,
+                seek_index=False, sync_offsets=False):
+    """ファイルを読みながらストリーム形式で .mid に書き出す。入力サイズによらずメモリ一定。
+    seek_index が真なら decode_range で一部だけ読めるよう索引トラックを足す。"""
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        return stream_encode(src, dst, checksum_algo, bits_per_note=bits_per_note, stats=stats,
+                             seek_index=seek_index, sync_offsets=sync_offsets)
+
+def midi_to_bytes(mid):
+    buf = io.BytesIO()
+    mid.save(file=buf)
+    return buf.getvalue()
+
+def save(mid, title, output_dir=MID_DIR, stats=None):
+    """エンコーダ CLI と同じ命名規則 (<title>_timeshift.mid) で保存し、そのパスを返す。"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    path = Path(output_filename_for(title, str(output_dir)))
+    with get_stats(stats).stage("write"):
+        mid.save(str(path))
+    return path
+
+def load(src):
+    """MidiFile / SMF バイト列 / ファイルパスのいずれかから MidiFile を得る。"""
+    if isinstance(src, MidiFile):
+        return src
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return MidiFile(file=io.BytesIO(bytes(src)))
+    return MidiFile(str(src))
+
+def decode(src, log=None, on_sync=None, stats=None, resync=False):
+    """src（パス・MidiFile）を復号する。on_sync(step, reported_crc, actual_crc) は SYNC ブロックごとに呼ばれる。
+    resync が真ならノートの欠落・挿入を SYNC で合わせ直し、壊れた範囲を result.erasures に返す。"""
+    stats = get_stats(stats)
+    with stats.stage("parse"):
+        mid = load(src)
+    return decode_midi(mid, log=log, on_sync=on_sync, stats=stats, resync=resync)